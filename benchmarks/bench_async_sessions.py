@@ -0,0 +1,85 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+"""
+Drive many simulated concurrent streaming sessions through AsyncWenetSTTDecoder on one event loop, feeding audio in real time, and report latency percentiles.
+
+Usage: python benchmarks/bench_async_sessions.py MODEL_DIR [--sessions N] [--chunk-ms MS] [--speed X]
+"""
+
+import argparse, asyncio, concurrent.futures, os, random, time, wave
+
+import numpy as np
+
+from wenet_stt import WenetSTTModel, AsyncWenetSTTDecoder
+
+default_wav_path = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'test.wav')
+
+def percentiles(values):
+    if not values:
+        return 'n/a'
+    return '  '.join('p%d %7.1fms' % (p, np.percentile(values, p) * 1000) for p in (50, 90, 99)) + '  max %7.1fms' % (max(values) * 1000)
+
+async def run_session(model, wav_samples, sample_rate, chunk_ms, speed, executor, stats):
+    await asyncio.sleep(random.uniform(0, chunk_ms / 1000))  # Stagger session starts
+    decoder = AsyncWenetSTTDecoder(model, executor=executor)
+    chunk_len = sample_rate * chunk_ms // 1000
+    chunks = [wav_samples[i:i+chunk_len] for i in range(0, len(wav_samples), chunk_len)]
+    sent_times = []
+
+    async def audio():
+        for chunk in chunks:
+            sent_times.append(time.perf_counter())
+            yield chunk
+            await asyncio.sleep(chunk_ms / 1000 / speed)
+
+    start = time.perf_counter()
+    first_partial_time = None
+    async for text, final in decoder.stream(audio()):
+        now = time.perf_counter()
+        if text and first_partial_time is None:
+            first_partial_time = now
+            stats['first_partial'].append(now - start)
+        if not final and sent_times:
+            stats['partial'].append(now - sent_times[-1])
+        if final:
+            stats['final'].append(now - sent_times[-1])
+            stats['texts'].append(text)
+    decoder.close()
+
+async def run(args):
+    model = WenetSTTModel(WenetSTTModel.build_config(args.model_dir, dict(num_threads=args.num_threads)))
+    with wave.open(args.wav_file, 'rb') as wav_file:
+        sample_rate = wav_file.getframerate()
+        wav_samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), np.int16)
+    stats = dict(first_partial=[], partial=[], final=[], texts=[])
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.executor_threads)
+    start = time.perf_counter()
+    await asyncio.gather(*[run_session(model, wav_samples, sample_rate, args.chunk_ms, args.speed, executor, stats) for _ in range(args.sessions)])
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+
+    audio_seconds = args.sessions * len(wav_samples) / sample_rate
+    print("%d sessions, %.1fs audio in %.1fs wall (%.1fx real time aggregate)" % (args.sessions, audio_seconds, elapsed, audio_seconds / elapsed))
+    print("first partial (from session start):", percentiles(stats['first_partial']))
+    print("partial (from last chunk sent):    ", percentiles(stats['partial']))
+    print("final (from finalize):             ", percentiles(stats['final']))
+    print("distinct final texts:", sorted(set(stats['texts'])))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_dir')
+    parser.add_argument('--wav-file', default=default_wav_path)
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--chunk-ms', type=int, default=100)
+    parser.add_argument('--speed', type=float, default=1.0, help='Audio feeding speed relative to real time')
+    parser.add_argument('--num-threads', type=int, default=1)
+    parser.add_argument('--executor-threads', type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+"""
+Compare throughput of WenetSTTModel.decode_batch() against a loop of WenetSTTModel.decode() calls.
+
+Usage: python benchmarks/bench_decode_batch.py MODEL_DIR [WAV_FILE ...] [--repeat N] [--batch-size N ...]
+"""
+
+import argparse, os, time, wave
+
+from wenet_stt import WenetSTTModel
+
+default_wav_path = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'test.wav')
+
+def read_wav(path):
+    with wave.open(path, 'rb') as wav_file:
+        return wav_file.readframes(wav_file.getnframes())
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_dir')
+    parser.add_argument('wav_file', nargs='*', default=[default_wav_path])
+    parser.add_argument('--repeat', type=int, default=32, help='Number of times to repeat the list of WAV files')
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--num-threads', type=int, default=1)
+    args = parser.parse_args()
+
+    model = WenetSTTModel(WenetSTTModel.build_config(args.model_dir, dict(num_threads=args.num_threads)))
+    utterances = [read_wav(path) for path in args.wav_file] * args.repeat
+    audio_seconds = sum(len(wav_samples) // 2 for wav_samples in utterances) / 16000
+    model.decode(utterances[0])  # Warm up
+
+    start = time.perf_counter()
+    loop_texts = [model.decode(wav_samples) for wav_samples in utterances]
+    loop_seconds = time.perf_counter() - start
+    print("%-16s %8.2fs  RTF %.4f  %6.1f utterances/s" % ('decode loop', loop_seconds, loop_seconds / audio_seconds, len(utterances) / loop_seconds))
+
+    for batch_size in args.batch_size:
+        start = time.perf_counter()
+        batch_texts = model.decode_batch(utterances, max_batch_size=batch_size)
+        batch_seconds = time.perf_counter() - start
+        print("%-16s %8.2fs  RTF %.4f  %6.1f utterances/s  speedup %.2fx%s" % ('batch size %d' % batch_size,
+            batch_seconds, batch_seconds / audio_seconds, len(utterances) / batch_seconds, loop_seconds / batch_seconds,
+            '' if batch_texts == loop_texts else '  (results differ from loop!)'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+"""
+Measure aggregate streaming throughput against per-chunk latency as the number of concurrent streams sharing one model grows, with and without chunk coalescing (max_coalesced_chunks) on the shared decoder thread pool.
+
+Usage: python benchmarks/bench_streaming_concurrency.py MODEL_DIR [--streams 1 4 16 64] [--coalesce 1 4] [--decoder-threads N] [--speed X]
+"""
+
+import argparse, os, threading, time, wave
+
+import numpy as np
+
+from wenet_stt import WenetSTTModel, WenetSTTDecoder
+
+default_wav_path = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'test.wav')
+
+def run_stream(model, wav_samples, chunk_len, chunk_seconds, results):
+    decoder = WenetSTTDecoder(model)
+    chunks = [wav_samples[i:i+chunk_len] for i in range(0, len(wav_samples), chunk_len)]
+    start = time.perf_counter()
+    for i, chunk in enumerate(chunks):
+        # Feed at the given pace, catching up rather than drifting if we fall behind.
+        delay = start + i * chunk_seconds - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        decoder.decode(chunk, i == len(chunks) - 1)
+    finalized = time.perf_counter()
+    text, final = decoder.get_result(True)
+    stats = decoder.get_stats()
+    results.append(dict(text=text, final_latency=time.perf_counter() - finalized, stats=stats))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_dir')
+    parser.add_argument('--wav-file', default=default_wav_path)
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 4, 16, 32, 64])
+    parser.add_argument('--coalesce', type=int, nargs='+', default=[1, 4], help='max_coalesced_chunks values to compare')
+    parser.add_argument('--decoder-threads', type=int, default=os.cpu_count())
+    parser.add_argument('--num-threads', type=int, default=1)
+    parser.add_argument('--chunk-ms', type=int, default=100)
+    parser.add_argument('--speed', type=float, default=1.0, help='Audio feeding speed relative to real time')
+    args = parser.parse_args()
+
+    with wave.open(args.wav_file, 'rb') as wav_file:
+        sample_rate = wav_file.getframerate()
+        wav_samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), np.int16)
+    chunk_len = sample_rate * args.chunk_ms // 1000
+    chunk_seconds = args.chunk_ms / 1000 / args.speed
+    audio_seconds = len(wav_samples) / sample_rate
+
+    print("%8s %8s %10s %12s %12s %12s %10s" % ('coalesce', 'streams', 'xRT', 'wait p50ms', 'wait p99ms', 'final p50ms', 'coalesced'))
+    for max_coalesced_chunks in args.coalesce:
+        model = WenetSTTModel(WenetSTTModel.build_config(args.model_dir, dict(num_threads=args.num_threads,
+            decoder_threads=args.decoder_threads, max_coalesced_chunks=max_coalesced_chunks)))
+        for num_streams in args.streams:
+            results = []
+            threads = [threading.Thread(target=run_stream, args=(model, wav_samples, chunk_len, chunk_seconds, results)) for _ in range(num_streams)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            mean_waits = [result['stats']['queue_wait_ms_total'] / max(1, result['stats']['times_scheduled']) for result in results]
+            print("%8d %8d %10.2f %12.1f %12.1f %12.1f %10d" % (max_coalesced_chunks, num_streams,
+                num_streams * audio_seconds / elapsed,
+                np.percentile(mean_waits, 50), np.percentile(mean_waits, 99),
+                np.percentile([result['final_latency'] * 1000 for result in results], 50),
+                sum(result['stats']['chunks_coalesced'] for result in results)))
+        del model
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,25 @@
 //
 
 #include <torch/script.h>
+#include <ATen/Parallel.h>
 
+#ifdef __linux__
+#include <pthread.h>
+#include <sched.h>
+#endif
+
+#include <atomic>
+#include <chrono>
+#include <cstring>
+#include <deque>
+#include <fstream>
+#include <list>
+#include <map>
+#include <numeric>
+#include <unordered_map>
+
+#include "decoder/context_graph.h"
+#include "decoder/ctc_prefix_beam_search.h"
 #include "decoder/params.h"
 #include "utils/timer.h"
 #include "utils/utils.h"
@@ -21,18 +39,18 @@
     }
 
 namespace wenet {
-    void from_json(const nlohmann::json& j, CtcEndpointConfig& c) {
-        if (j.contains("blank")) j.at("blank").get_to(c.blank);
-        if (j.contains("blank_threshold")) j.at("blank_threshold").get_to(c.blank_threshold);
-        // if (j.contains("rule1")) j.at("rule1").get_to(c.rule1);
-        // if (j.contains("rule2")) j.at("rule2").get_to(c.rule2);
-        // if (j.contains("rule3")) j.at("rule3").get_to(c.rule3);
-    }
     NLOHMANN_DEFINE_TYPE_NON_INTRUSIVE(CtcEndpointRule,
         must_decoded_sth,
         min_trailing_silence,
         min_utterance_length
     );
+    void from_json(const nlohmann::json& j, CtcEndpointConfig& c) {
+        if (j.contains("blank")) j.at("blank").get_to(c.blank);
+        if (j.contains("blank_threshold")) j.at("blank_threshold").get_to(c.blank_threshold);
+        if (j.contains("rule1")) j.at("rule1").get_to(c.rule1);
+        if (j.contains("rule2")) j.at("rule2").get_to(c.rule2);
+        if (j.contains("rule3")) j.at("rule3").get_to(c.rule3);
+    }
     NLOHMANN_DEFINE_TYPE_NON_INTRUSIVE(CtcPrefixBeamSearchOptions,
         blank,
         first_beam_size,
@@ -51,6 +69,12 @@ namespace wenet {
 }
 
 
+using Clock = std::chrono::steady_clock;
+
+inline double ElapsedMs(Clock::time_point start, Clock::time_point end = Clock::now()) {
+    return std::chrono::duration<double, std::milli>(end - start).count();
+}
+
 std::shared_ptr<wenet::FeaturePipelineConfig> InitFeaturePipelineConfigFromJson(const nlohmann::json& j) {
     return std::make_shared<wenet::FeaturePipelineConfig>(
         j.at("num_bins").get<int>(),
@@ -93,10 +117,17 @@ std::shared_ptr<wenet::DecodeOptions> InitDecodeOptionsFromSimpleJson(const nloh
     if (j.contains("acoustic_scale")) { j.at("acoustic_scale").get_to(decode_config->ctc_wfst_search_opts.acoustic_scale); } else { decode_config->ctc_wfst_search_opts.acoustic_scale = FLAGS_acoustic_scale; }
     if (j.contains("blank_skip_thresh")) { j.at("blank_skip_thresh").get_to(decode_config->ctc_wfst_search_opts.blank_skip_thresh); } else { decode_config->ctc_wfst_search_opts.blank_skip_thresh = FLAGS_blank_skip_thresh; }
     if (j.contains("nbest")) { j.at("nbest").get_to(decode_config->ctc_wfst_search_opts.nbest); } else { decode_config->ctc_wfst_search_opts.nbest = FLAGS_nbest; }
+    if (j.contains("first_beam_size")) { j.at("first_beam_size").get_to(decode_config->ctc_prefix_search_opts.first_beam_size); } else { decode_config->ctc_prefix_search_opts.first_beam_size = FLAGS_first_beam_size; }
+    if (j.contains("second_beam_size")) { j.at("second_beam_size").get_to(decode_config->ctc_prefix_search_opts.second_beam_size); } else { decode_config->ctc_prefix_search_opts.second_beam_size = FLAGS_second_beam_size; }
 
-    decode_config->ctc_endpoint_config.rule1.min_utterance_length = 60000;
-    decode_config->ctc_endpoint_config.rule2.min_utterance_length = 60000;
-    decode_config->ctc_endpoint_config.rule3.min_utterance_length = 60000;
+    if (j.contains("ctc_endpoint_config")) j.at("ctc_endpoint_config").get_to(decode_config->ctc_endpoint_config);
+
+    // Endpoints are only acted upon in continuous mode, so otherwise push them out of the way.
+    if (!(j.contains("continuous") && j.at("continuous").get<bool>())) {
+        decode_config->ctc_endpoint_config.rule1.min_utterance_length = 60000;
+        decode_config->ctc_endpoint_config.rule2.min_utterance_length = 60000;
+        decode_config->ctc_endpoint_config.rule3.min_utterance_length = 60000;
+    }
     return decode_config;
 }
 
@@ -142,32 +173,46 @@ std::shared_ptr<wenet::DecodeResource> InitDecodeResourceFromJson(const nlohmann
     return resource;
 }
 
-std::shared_ptr<wenet::DecodeResource> InitDecodeResourceFromSimpleJson(const nlohmann::json& j) {
+// Loads the decode resource, recording how long each phase took (in ms) into timings.
+std::shared_ptr<wenet::DecodeResource> InitDecodeResourceFromSimpleJson(const nlohmann::json& j, nlohmann::json& timings) {
     if (!j.is_object()) LOG(FATAL) << "decode_resource must be a valid JSON object";
     auto resource = std::make_shared<wenet::DecodeResource>();
 
+    auto start = Clock::now();
     auto model_path = j.at("model_path").get<std::string>();
     auto num_threads = (j.contains("num_threads")) ? j.at("num_threads").get<int>() : FLAGS_num_threads;
     LOG(INFO) << "Reading model " << model_path << " to use " << num_threads << " threads";
     auto model = std::make_shared<wenet::TorchAsrModel>();
     model->Read(model_path, num_threads);
     resource->model = model;
+    timings["model_ms"] = ElapsedMs(start);
 
+    start = Clock::now();
     std::shared_ptr<fst::Fst<fst::StdArc>> fst = nullptr;
     if (j.contains("fst_path")) {
         auto fst_path = j.at("fst_path").get<std::string>();
-        LOG(INFO) << "Reading fst " << fst_path;
-        fst.reset(fst::Fst<fst::StdArc>::Read(fst_path));
+        // Memory-map the FST where its type supports it (e.g. ConstFst), so it is paged in on demand and shared between processes.
+        auto fst_mmap = (j.contains("fst_mmap")) ? j.at("fst_mmap").get<bool>() : true;
+        LOG(INFO) << "Reading fst " << fst_path << (fst_mmap ? " (memory-mapped)" : "");
+        std::ifstream fst_stream(fst_path, std::ios_base::in | std::ios_base::binary);
+        CHECK(fst_stream.good()) << "Could not open fst " << fst_path;
+        fst::FstReadOptions read_options(fst_path);
+        read_options.mode = fst_mmap ? fst::FstReadOptions::MAP : fst::FstReadOptions::READ;
+        fst.reset(fst::Fst<fst::StdArc>::Read(fst_stream, read_options));
         CHECK(fst != nullptr);
     }
     resource->fst = fst;
+    timings["fst_ms"] = ElapsedMs(start);
 
+    start = Clock::now();
     auto dict_path = j.at("dict_path").get<std::string>();
     LOG(INFO) << "Reading symbol table " << dict_path;
     auto symbol_table = std::shared_ptr<fst::SymbolTable>(
         fst::SymbolTable::ReadText(dict_path));
     resource->symbol_table = symbol_table;
+    timings["symbol_table_ms"] = ElapsedMs(start);
 
+    start = Clock::now();
     std::shared_ptr<fst::SymbolTable> unit_table = nullptr;
     if (j.contains("unit_path")) {
         auto unit_path = j.at("unit_path").get<std::string>();
@@ -180,8 +225,9 @@ std::shared_ptr<wenet::DecodeResource> InitDecodeResourceFromSimpleJson(const nl
         unit_table = symbol_table;
     }
     resource->unit_table = unit_table;
+    timings["unit_table_ms"] = ElapsedMs(start);
 
-    // FIXME: handle context graph
+    // Context graphs for biasing are compiled separately, per phrase set (see ContextGraphCache), so the loaded resource can be shared.
 
     wenet::PostProcessOptions post_process_opts;
     post_process_opts.language_type = j.contains("language_type") ? static_cast<wenet::LanguageType>(j.at("language_type").get<int32_t>()) : wenet::kMandarinEnglish;
@@ -192,12 +238,723 @@ std::shared_ptr<wenet::DecodeResource> InitDecodeResourceFromSimpleJson(const nl
     return resource;
 }
 
+// Process-wide cache of loaded decode resources, keyed by the configuration they were loaded with, so that all models constructed with the same configuration share a single copy (including across forked processes, copy-on-write, if loaded before forking).
+static std::mutex decode_resource_cache_mutex_;
+static std::map<std::string, std::weak_ptr<wenet::DecodeResource>> decode_resource_cache_;
+
+std::shared_ptr<wenet::DecodeResource> LoadCachedDecodeResource(const nlohmann::json& j, nlohmann::json& timings) {
+    nlohmann::json key = nlohmann::json::object();
+    // Not num_threads, which is applied per decode (see ThreadConfigScope), so models differing only in threading share the resource.
+    for (auto name : {"model_path", "fst_path", "fst_mmap", "dict_path", "unit_path", "language_type", "lowercase"}) {
+        if (j.contains(name)) key[name] = j.at(name);
+    }
+    auto key_str = key.dump();  // Object keys are sorted, so this is canonical
+
+    std::lock_guard<std::mutex> lock(decode_resource_cache_mutex_);
+    for (auto it = decode_resource_cache_.begin(); it != decode_resource_cache_.end(); ) {
+        it = it->second.expired() ? decode_resource_cache_.erase(it) : std::next(it);
+    }
+    auto it = decode_resource_cache_.find(key_str);
+    if (it != decode_resource_cache_.end()) {
+        timings["cache_hit"] = true;
+        return it->second.lock();
+    }
+    auto resource = InitDecodeResourceFromSimpleJson(j, timings);
+    decode_resource_cache_[key_str] = resource;
+    timings["cache_hit"] = false;
+    return resource;
+}
+
+// Scores a hypothesis against attention decoder output, mirroring TorchAsrDecoder::AttentionDecoderScore().
+float AttentionDecoderScore(const torch::Tensor& prob, const std::vector<int>& hyp, int eos) {
+    float score = 0.0f;
+    auto accessor = prob.accessor<float, 2>();
+    for (size_t j = 0; j < hyp.size(); ++j) {
+        score += accessor[j][hyp[j]];
+    }
+    score += accessor[hyp.size()][eos];
+    return score;
+}
+
+// Builds the n-best results for a finished CTC prefix beam search over a single utterance, and rescores them with the attention decoder if configured, mirroring TorchAsrDecoder::AttentionRescoring().
+std::vector<wenet::DecodeResult> FinishUtteranceSearch(wenet::CtcPrefixBeamSearch& searcher, const torch::Tensor& encoder_out,
+        const wenet::DecodeResource& resource, const wenet::DecodeOptions& opts, int frame_shift_in_ms) {
+    searcher.FinalizeSearch();
+    const auto& hypotheses = searcher.Inputs();
+    const auto& likelihood = searcher.Likelihood();
+    const auto& times = searcher.Times();
+    int num_encoder_frames = encoder_out.size(1);
+
+    std::vector<wenet::DecodeResult> results;
+    for (size_t i = 0; i < hypotheses.size(); i++) {
+        const auto& hypothesis = hypotheses[i];
+        wenet::DecodeResult path;
+        path.score = likelihood[i];
+        for (size_t j = 0; j < hypothesis.size(); j++) {
+            path.sentence += resource.symbol_table->Find(hypothesis[j]);
+        }
+        if (resource.unit_table != nullptr) {
+            const auto& time_stamp = times[i];
+            for (size_t j = 0; j < hypothesis.size(); j++) {
+                int start = (j > 0) ? ((time_stamp[j - 1] + time_stamp[j]) / 2 * frame_shift_in_ms) : 0;
+                int end = (j < hypothesis.size() - 1) ? ((time_stamp[j] + time_stamp[j + 1]) / 2 * frame_shift_in_ms) : (num_encoder_frames * frame_shift_in_ms);
+                path.word_pieces.emplace_back(resource.unit_table->Find(hypothesis[j]), start, end);
+            }
+        }
+        path.sentence = resource.post_processor->Process(path.sentence, true);
+        results.push_back(std::move(path));
+    }
+
+    if (opts.rescoring_weight == 0.0 || hypotheses.empty() || num_encoder_frames == 0) {
+        return results;
+    }
+
+    int sos = resource.model->sos();
+    int eos = resource.model->eos();
+    int num_hyps = hypotheses.size();
+    torch::Tensor hyps_length = torch::zeros({num_hyps}, torch::kLong);
+    int max_hyps_len = 0;
+    for (int i = 0; i < num_hyps; ++i) {
+        int length = hypotheses[i].size() + 1;
+        max_hyps_len = std::max(length, max_hyps_len);
+        hyps_length[i] = static_cast<int64_t>(length);
+    }
+    torch::Tensor hyps_tensor = torch::zeros({num_hyps, max_hyps_len}, torch::kLong);
+    for (int i = 0; i < num_hyps; ++i) {
+        const auto& hyp = hypotheses[i];
+        hyps_tensor[i][0] = sos;
+        for (size_t j = 0; j < hyp.size(); ++j) {
+            hyps_tensor[i][j + 1] = hyp[j];
+        }
+    }
+
+    auto outputs = resource.model->torch_model()->run_method("forward_attention_decoder",
+        hyps_tensor, hyps_length, encoder_out, opts.reverse_weight).toTuple()->elements();
+    auto probs = outputs[0].toTensor();
+    auto r_probs = outputs[1].toTensor();
+    for (int i = 0; i < num_hyps; ++i) {
+        const auto& hyp = hypotheses[i];
+        float score = AttentionDecoderScore(probs[i], hyp, eos);
+        float r_score = 0.0f;
+        if (opts.reverse_weight > 0) {
+            std::vector<int> r_hyp(hyp.size());
+            std::reverse_copy(hyp.begin(), hyp.end(), r_hyp.begin());
+            r_score = AttentionDecoderScore(r_probs[i], r_hyp, eos);
+        }
+        score = (score * (1 - opts.reverse_weight)) + (r_score * opts.reverse_weight);
+        results[i].score = opts.rescoring_weight * score + opts.ctc_weight * results[i].score;
+    }
+    std::sort(results.begin(), results.end(), wenet::DecodeResult::CompareFunc);
+    return results;
+}
+
+// Strips any trailing whitespace.
+std::string StripTrailingWhitespace(const std::string& text) {
+    auto last_pos = text.find_last_not_of(' ');
+    return text.substr(0, last_pos + 1);
+}
+
+// Returns a copy of the given string allocated with malloc, for passing ownership across the C interface. Must be freed with wenet_stt__free_string().
+char *AllocateCString(const std::string& str) {
+    auto cstr = static_cast<char*>(malloc(str.size() + 1));
+    if (cstr == nullptr) throw std::bad_alloc();
+    memcpy(cstr, str.c_str(), str.size() + 1);
+    return cstr;
+}
+
+// Copies the given string into the caller's buffer if it fits, and always sets the full length needed (including NUL terminator), so the caller can retry with a larger buffer.
+bool CopyToBuffer(const std::string& str, char *buffer, int32_t buffer_len, int32_t *needed_len_p) {
+    *needed_len_p = str.size() + 1;
+    if (*needed_len_p > buffer_len) return false;
+    memcpy(buffer, str.c_str(), str.size() + 1);
+    return true;
+}
+
+// Flags (result_fields in the C interface) selecting the optional fields of results returned as JSON.
+enum ResultFields : int32_t {
+    kResultNbest = 1,  // All n-best hypotheses, rather than only the best.
+    kResultScores = 2,  // Each hypothesis's score.
+    kResultWords = 4,  // Each hypothesis's word pieces, with start and end times.
+};
+
+// Returns a result as JSON: the text and whether it is final, plus a list of hypotheses with the selected fields if any are requested by fields.
+nlohmann::json ResultToJson(const std::string& text, bool final, const std::vector<wenet::DecodeResult>& results, int32_t fields) {
+    nlohmann::json j = {{"text", StripTrailingWhitespace(text)}, {"final", final}};
+    if (fields & (kResultNbest | kResultScores | kResultWords)) {
+        auto hypotheses = nlohmann::json::array();
+        size_t num_hypotheses = (fields & kResultNbest) ? results.size() : std::min<size_t>(1, results.size());
+        for (size_t i = 0; i < num_hypotheses; ++i) {
+            nlohmann::json hypothesis = {{"text", StripTrailingWhitespace(results[i].sentence)}};
+            if (fields & kResultScores) hypothesis["score"] = results[i].score;
+            if (fields & kResultWords) {
+                auto words = nlohmann::json::array();
+                for (const auto& word_piece : results[i].word_pieces) {
+                    words.push_back({{"word", word_piece.word}, {"start_ms", word_piece.start}, {"end_ms", word_piece.end}});
+                }
+                hypothesis["words"] = std::move(words);
+            }
+            hypotheses.push_back(std::move(hypothesis));
+        }
+        j["hypotheses"] = std::move(hypotheses);
+    }
+    return j;
+}
+
+// Non-owning view of a contiguous block of audio samples passed across the C interface. Since FeaturePipeline::AcceptWaveform() only takes a std::vector<float>, samples are copied (and converted, if int16) once into a reused float buffer, with no other intermediate copies; float samples are copied too.
+template <typename T>
+struct SampleSpan {
+    const T *data;
+    size_t size;
+
+    SampleSpan(const T *data, int32_t size) : data(data), size(std::max<int32_t>(size, 0)) {}
+
+    bool empty() const { return size == 0; }
+
+    // Copies the samples (converting to float) into the given buffer, reusing its existing allocation where possible.
+    const std::vector<float>& ConvertTo(std::vector<float>& buffer) const {
+        buffer.assign(data, data + size);
+        return buffer;
+    }
+};
+
 static bool one_time_initialized_ = false;
 
+// Histogram of observed values over fixed bucket upper bounds (inclusive), plus an overflow bucket, for export to metrics systems.
+class Histogram {
+public:
+    explicit Histogram(std::vector<double> bounds) : bounds_(std::move(bounds)), counts_(bounds_.size() + 1, 0) {}
+
+    void Observe(double value) {
+        ++counts_[std::lower_bound(bounds_.begin(), bounds_.end(), value) - bounds_.begin()];
+        ++count_;
+        sum_ += value;
+    }
+
+    nlohmann::json ToJson() const {
+        return {{"bounds", bounds_}, {"counts", counts_}, {"count", count_}, {"sum", sum_}};
+    }
+
+protected:
+    std::vector<double> bounds_;
+    std::vector<uint64_t> counts_;
+    uint64_t count_ = 0;
+    double sum_ = 0;
+};
+
+const std::vector<double> kMsHistogramBounds = {1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000};
+const std::vector<double> kRtfHistogramBounds = {0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5};
+
+// Timings (in ms) and counts for decoding a single utterance.
+struct UtteranceStats {
+    static constexpr size_t kMaxChunks = 1000;  // Per-chunk timings are kept only for the most recent chunks.
+
+    double audio_ms = 0;
+    int frames = 0;
+    int chunks = 0;
+    double feature_ms = 0;
+    double decode_ms = 0;  // Encoder forward and CTC search, which TorchAsrDecoder performs together.
+    double encoder_ms = -1;  // Only measured separately by batched decoding.
+    double search_ms = -1;  // Only measured separately by batched decoding.
+    double rescoring_ms = 0;
+    double queue_wait_ms = 0;
+    double queue_wait_ms_max = 0;
+    double vad_skipped_ms = 0;  // Audio dropped as silence by the VAD, and not decoded.
+    std::deque<double> chunk_decode_ms;
+    std::deque<double> chunk_latency_ms;  // Time from the audio a chunk completed being fed until the chunk was decoded.
+    bool final = false;
+
+    void AddChunk(double chunk_decode_ms_value, int chunk_frames) {
+        ++chunks;
+        frames += chunk_frames;
+        decode_ms += chunk_decode_ms_value;
+        chunk_decode_ms.push_back(chunk_decode_ms_value);
+        if (chunk_decode_ms.size() > kMaxChunks) chunk_decode_ms.pop_front();
+    }
+
+    void AddChunkLatency(double latency_ms) {
+        chunk_latency_ms.push_back(latency_ms);
+        if (chunk_latency_ms.size() > kMaxChunks) chunk_latency_ms.pop_front();
+    }
+
+    double processing_ms() const { return feature_ms + decode_ms + rescoring_ms; }
+
+    nlohmann::json ToJson() const {
+        nlohmann::json j = {
+            {"audio_ms", audio_ms},
+            {"frames", frames},
+            {"chunks", chunks},
+            {"feature_ms", feature_ms},
+            {"decode_ms", decode_ms},
+            {"rescoring_ms", rescoring_ms},
+            {"queue_wait_ms", queue_wait_ms},
+            {"queue_wait_ms_max", queue_wait_ms_max},
+            {"vad_skipped_ms", vad_skipped_ms},
+            {"chunk_decode_ms", chunk_decode_ms},
+            {"chunk_latency_ms", chunk_latency_ms},
+            {"rtf", (audio_ms > 0) ? processing_ms() / audio_ms : 0.0},
+            {"final", final},
+        };
+        if (encoder_ms >= 0) j["encoder_ms"] = encoder_ms;
+        if (search_ms >= 0) j["search_ms"] = search_ms;
+        return j;
+    }
+};
+
+// Aggregate counters and histograms over all decoding with a model. Thread safe.
+class ModelMetrics {
+public:
+    void RecordChunk(double decode_ms) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        ++chunks_;
+        chunk_decode_ms_.Observe(decode_ms);
+    }
+
+    void RecordQueueWait(double queue_wait_ms) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        queue_wait_ms_.Observe(queue_wait_ms);
+    }
+
+    void RecordChunkLatency(double latency_ms) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        chunk_latency_ms_.Observe(latency_ms);
+    }
+
+    void RecordUtterance(const UtteranceStats& stats) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        ++utterances_;
+        frames_ += stats.frames;
+        audio_ms_ += stats.audio_ms;
+        feature_ms_ += stats.feature_ms;
+        decode_ms_ += stats.decode_ms;
+        if (stats.encoder_ms >= 0) encoder_ms_ += stats.encoder_ms;
+        if (stats.search_ms >= 0) search_ms_ += stats.search_ms;
+        rescoring_ms_ += stats.rescoring_ms;
+        queue_wait_ms_total_ += stats.queue_wait_ms;
+        vad_skipped_ms_ += stats.vad_skipped_ms;
+        if (stats.audio_ms > 0) utterance_rtf_.Observe(stats.processing_ms() / stats.audio_ms);
+    }
+
+    nlohmann::json ToJson() const {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return {
+            {"utterances", utterances_},
+            {"chunks", chunks_},
+            {"frames", frames_},
+            {"audio_ms", audio_ms_},
+            {"feature_ms", feature_ms_},
+            {"decode_ms", decode_ms_},
+            {"encoder_ms", encoder_ms_},
+            {"search_ms", search_ms_},
+            {"rescoring_ms", rescoring_ms_},
+            {"queue_wait_ms", queue_wait_ms_total_},
+            {"vad_skipped_ms", vad_skipped_ms_},
+            {"histograms", {
+                {"chunk_decode_ms", chunk_decode_ms_.ToJson()},
+                {"chunk_latency_ms", chunk_latency_ms_.ToJson()},
+                {"queue_wait_ms", queue_wait_ms_.ToJson()},
+                {"utterance_rtf", utterance_rtf_.ToJson()},
+            }},
+        };
+    }
+
+protected:
+    mutable std::mutex mutex_;
+    uint64_t utterances_ = 0;
+    uint64_t chunks_ = 0;
+    uint64_t frames_ = 0;
+    double audio_ms_ = 0;
+    double feature_ms_ = 0;
+    double decode_ms_ = 0;
+    double encoder_ms_ = 0;
+    double search_ms_ = 0;
+    double rescoring_ms_ = 0;
+    double queue_wait_ms_total_ = 0;
+    double vad_skipped_ms_ = 0;
+    Histogram chunk_decode_ms_{kMsHistogramBounds};
+    Histogram chunk_latency_ms_{kMsHistogramBounds};
+    Histogram queue_wait_ms_{kMsHistogramBounds};
+    Histogram utterance_rtf_{kRtfHistogramBounds};
+};
+
+struct VadConfig {
+    bool enabled = false;
+    float threshold_db = -45;  // Frames with energy above this (in dB relative to int16 full scale) are speech.
+    int padding_ms = 300;  // Audio kept on either side of speech. Long silences are compressed to twice this, plus min_trailing_silence_ms.
+    int min_trailing_silence_ms = 0;  // Additional silence always kept after speech, so that endpointing can still detect pauses in continuous mode.
+};
+
+// Energy-based voice activity detector, which drops all but padding on either side of speech from a stream of audio, and maps times in the kept audio back to times in the original audio.
+class EnergyVad {
+public:
+    EnergyVad(const VadConfig& config, int sample_rate) :
+        frame_size_(sample_rate / 100),
+        padding_samples_(static_cast<int64_t>(config.padding_ms) * sample_rate / 1000),
+        trailing_samples_(static_cast<int64_t>(config.padding_ms + config.min_trailing_silence_ms) * sample_rate / 1000),
+        sample_rate_(sample_rate),
+        // Compare mean squared sample value against the threshold, to avoid a log per frame.
+        threshold_energy_(std::pow(10.0, config.threshold_db / 10.0) * 32768.0 * 32768.0) {
+        Reset();
+    }
+
+    void Reset() {
+        std::lock_guard<std::mutex> lock(mutex_);
+        frame_.clear();
+        pending_.clear();
+        trailing_samples_left_ = 0;
+        original_pos_ = 0;
+        kept_pos_ = 0;
+        last_original_end_ = 0;
+        offsets_.assign(1, {0, 0});
+    }
+
+    // Appends the kept samples of the given audio to output.
+    void Process(const std::vector<float>& input, std::vector<float>& output) {
+        size_t i = 0;
+        if (!frame_.empty()) {
+            // Complete the partial frame left over from the previous call.
+            size_t needed = std::min(input.size(), frame_size_ - frame_.size());
+            frame_.insert(frame_.end(), input.begin(), input.begin() + needed);
+            i = needed;
+            if (frame_.size() < frame_size_) return;
+            ProcessFrame(frame_.data(), frame_.size(), output);
+            frame_.clear();
+        }
+        for (; i + frame_size_ <= input.size(); i += frame_size_) {
+            ProcessFrame(input.data() + i, frame_size_, output);
+        }
+        frame_.insert(frame_.end(), input.begin() + i, input.end());
+    }
+
+    // At the end of input: appends the kept samples of any final partial frame to output.
+    void Flush(std::vector<float>& output) {
+        if (!frame_.empty()) {
+            ProcessFrame(frame_.data(), frame_.size(), output);
+            frame_.clear();
+        }
+    }
+
+    // Maps a time in the kept audio to the corresponding time in the original audio.
+    int MapToOriginalMs(int kept_ms) const {
+        int64_t kept_sample = static_cast<int64_t>(kept_ms) * sample_rate_ / 1000;
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto it = std::upper_bound(offsets_.begin(), offsets_.end(), std::make_pair(kept_sample, std::numeric_limits<int64_t>::max())) - 1;
+        return (it->second + (kept_sample - it->first)) * 1000 / sample_rate_;
+    }
+
+    // Duration of audio dropped so far (excluding any held back pending more input).
+    double skipped_ms() const {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return 1000.0 * (original_pos_ - static_cast<int64_t>(pending_.size()) - kept_pos_) / sample_rate_;
+    }
+
+protected:
+    void ProcessFrame(const float *data, size_t size, std::vector<float>& output) {
+        double energy = 0;
+        for (size_t i = 0; i < size; ++i) energy += data[i] * data[i];
+        bool speech = energy / size > threshold_energy_;
+        int64_t frame_start = original_pos_;
+
+        if (speech) {
+            // Emit the silence held back before the speech as leading padding.
+            std::vector<float> pending;
+            {
+                std::lock_guard<std::mutex> lock(mutex_);
+                pending.assign(pending_.begin(), pending_.end());
+                pending_.clear();
+            }
+            if (!pending.empty()) {
+                Emit(pending.data(), pending.size(), frame_start - pending.size(), output);
+            }
+            Emit(data, size, frame_start, output);
+            trailing_samples_left_ = trailing_samples_;
+        } else if (trailing_samples_left_ > 0) {
+            Emit(data, size, frame_start, output);
+            trailing_samples_left_ -= size;
+        } else {
+            // Hold back silence in case speech follows, dropping any beyond the padding.
+            std::lock_guard<std::mutex> lock(mutex_);
+            pending_.insert(pending_.end(), data, data + size);
+            while (static_cast<int64_t>(pending_.size()) > padding_samples_) pending_.pop_front();
+        }
+        std::lock_guard<std::mutex> lock(mutex_);
+        original_pos_ += size;
+    }
+
+    void Emit(const float *data, size_t size, int64_t original_start, std::vector<float>& output) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        if (original_start != last_original_end_) {
+            offsets_.emplace_back(kept_pos_, original_start);
+        }
+        output.insert(output.end(), data, data + size);
+        kept_pos_ += size;
+        last_original_end_ = original_start + size;
+    }
+
+    const size_t frame_size_;
+    const int64_t padding_samples_;
+    const int64_t trailing_samples_;
+    const int sample_rate_;
+    const double threshold_energy_;
+
+    std::vector<float> frame_;  // Partial frame awaiting more input.
+    int64_t trailing_samples_left_ = 0;  // Silence still to keep as trailing padding after speech.
+
+    mutable std::mutex mutex_;  // For the following, which are read by other threads.
+    std::deque<float> pending_;  // Silence immediately preceding the current position, held back as potential leading padding.
+    int64_t original_pos_ = 0;  // Samples processed.
+    int64_t kept_pos_ = 0;  // Samples kept.
+    int64_t last_original_end_ = 0;
+    std::vector<std::pair<int64_t, int64_t>> offsets_;  // (kept sample, original sample) at the start of each contiguous run of kept audio.
+};
+
+// Feeds a complete utterance to the feature pipeline, gated by a VAD with the given config if enabled (returned, for mapping times back to the original audio), recording the audio it dropped into stats.
+std::unique_ptr<EnergyVad> AcceptUtterance(wenet::FeaturePipeline& feature_pipeline, const std::vector<float>& samples, const VadConfig& vad_config, int sample_rate, UtteranceStats& stats) {
+    if (!vad_config.enabled) {
+        feature_pipeline.AcceptWaveform(samples);
+        return nullptr;
+    }
+    auto vad = std::make_unique<EnergyVad>(vad_config, sample_rate);
+    std::vector<float> kept_samples;
+    vad->Process(samples, kept_samples);
+    vad->Flush(kept_samples);
+    stats.vad_skipped_ms = 1000.0 * (samples.size() - kept_samples.size()) / sample_rate;
+    if (!kept_samples.empty()) feature_pipeline.AcceptWaveform(kept_samples);
+    return vad;
+}
+
+// Maps the times of the given results' word pieces from the kept audio back to the original audio.
+void MapResultTimes(const EnergyVad& vad, std::vector<wenet::DecodeResult>& results) {
+    for (auto& result : results) {
+        for (auto& word_piece : result.word_pieces) {
+            word_piece.start = vad.MapToOriginalMs(word_piece.start);
+            word_piece.end = vad.MapToOriginalMs(word_piece.end);
+        }
+    }
+}
+
+// LRU cache of compiled context graphs, keyed by phrase set and score, so that repeatedly biasing toward the same phrases (e.g. per tenant) skips recompiling. Thread safe.
+class ContextGraphCache {
+public:
+    ContextGraphCache(size_t capacity) : capacity_(capacity) {}
+
+    // Returns the context graph for the given phrases (in any order, ignoring duplicates) and score, compiling it against symbol_table if not cached.
+    std::shared_ptr<wenet::ContextGraph> Get(std::vector<std::string> phrases, float score, const std::shared_ptr<fst::SymbolTable>& symbol_table) {
+        std::sort(phrases.begin(), phrases.end());
+        phrases.erase(std::unique(phrases.begin(), phrases.end()), phrases.end());
+        auto key = nlohmann::json{{"phrases", phrases}, {"score", score}}.dump();
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            auto it = index_.find(key);
+            if (it != index_.end()) {
+                ++hits_;
+                entries_.splice(entries_.begin(), entries_, it->second);
+                return it->second->second;
+            }
+            ++misses_;
+        }
+
+        // Compile outside the lock, so lookups of other phrase sets aren't blocked. Concurrent misses of the same phrase set may each compile it.
+        auto start = Clock::now();
+        wenet::ContextConfig config;
+        config.context_score = score;
+        auto graph = std::make_shared<wenet::ContextGraph>(config);
+        graph->BuildContextGraph(phrases, symbol_table);
+        auto compile_ms = ElapsedMs(start);
+
+        std::lock_guard<std::mutex> lock(mutex_);
+        ++compiles_;
+        compile_ms_total_ += compile_ms;
+        compile_ms_max_ = std::max(compile_ms_max_, compile_ms);
+        if (capacity_ > 0 && index_.find(key) == index_.end()) {
+            entries_.emplace_front(key, graph);
+            index_[key] = entries_.begin();
+            while (entries_.size() > capacity_) {
+                index_.erase(entries_.back().first);
+                entries_.pop_back();
+                ++evictions_;
+            }
+        }
+        return graph;
+    }
+
+    nlohmann::json GetStats() const {
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto lookups = hits_ + misses_;
+        return {
+            {"entries", entries_.size()},
+            {"capacity", capacity_},
+            {"hits", hits_},
+            {"misses", misses_},
+            {"hit_rate", lookups ? nlohmann::json(static_cast<double>(hits_) / lookups) : nlohmann::json()},
+            {"evictions", evictions_},
+            {"compiles", compiles_},
+            {"compile_ms_total", compile_ms_total_},
+            {"compile_ms_max", compile_ms_max_},
+        };
+    }
+
+private:
+    using Entry = std::pair<std::string, std::shared_ptr<wenet::ContextGraph>>;
+    const size_t capacity_;
+    mutable std::mutex mutex_;
+    std::list<Entry> entries_;  // Most recently used first.
+    std::unordered_map<std::string, std::list<Entry>::iterator> index_;
+    uint64_t hits_ = 0;
+    uint64_t misses_ = 0;
+    uint64_t evictions_ = 0;
+    uint64_t compiles_ = 0;
+    double compile_ms_total_ = 0;
+    double compile_ms_max_ = 0;
+};
+
+// Threading for decoding with a model: how many intra-op threads each decode may use, and optionally which CPUs it may run on, so that several models (or processes) on one host can be given their own cores rather than oversubscribing them.
+struct ThreadConfig {
+    int intra_op_threads = 1;
+    std::vector<int> cpu_affinity;  // CPU ids to run on; empty to run anywhere.
+};
+
+// Applies a ThreadConfig to the calling thread. The intra-op thread count is left set afterwards, so that repeated decodes on the same thread only set it when it changes (setting it can rebuild the thread pool). The CPU affinity is restored on destruction, unless permanent (for threads dedicated to decoding).
+// With OpenMP, libtorch's intra-op thread count (the OpenMP ICV) is per calling thread, and the threads it spawns for intra-op parallelism inherit the affinity of the calling thread. However, at::set_num_threads() also calls mkl_set_num_threads() when built with MKL, which is process-wide: models with different intra_op_threads decoding concurrently keep overriding each other's MKL thread count (the last one set wins), so only the OpenMP part is isolated per thread.
+class ThreadConfigScope {
+public:
+    ThreadConfigScope(const ThreadConfig& config, bool permanent = false) : permanent_(permanent) {
+        if (config.intra_op_threads > 0 && config.intra_op_threads != at::get_num_threads()) at::set_num_threads(config.intra_op_threads);
+        if (config.cpu_affinity.empty()) return;
+#ifdef __linux__
+        cpu_set_t cpu_set;
+        CPU_ZERO(&cpu_set);
+        for (auto cpu : config.cpu_affinity) {
+            if (cpu >= 0 && cpu < CPU_SETSIZE) CPU_SET(cpu, &cpu_set);
+        }
+        affinity_saved_ = !permanent_ && pthread_getaffinity_np(pthread_self(), sizeof(previous_affinity_), &previous_affinity_) == 0;
+        int error = pthread_setaffinity_np(pthread_self(), sizeof(cpu_set), &cpu_set);
+        if (error) {
+            LOG(WARNING) << "Failed to set cpu_affinity: " << strerror(error);
+            affinity_saved_ = false;
+        }
+#else
+        static std::once_flag warned;
+        std::call_once(warned, []() { LOG(WARNING) << "cpu_affinity is only supported on Linux; ignoring"; });
+#endif
+    }
+
+    ~ThreadConfigScope() {
+        if (permanent_) return;
+#ifdef __linux__
+        if (affinity_saved_) pthread_setaffinity_np(pthread_self(), sizeof(previous_affinity_), &previous_affinity_);
+#endif
+    }
+
+private:
+    bool permanent_;
+#ifdef __linux__
+    bool affinity_saved_ = false;
+    cpu_set_t previous_affinity_;
+#endif
+};
+
+// Sets the process-wide number of inter-op threads (which run forked TorchScript subgraphs in parallel). libtorch only allows setting it once, before any inter-op work, so later requests for a different number are ignored with a warning.
+void SetInterOpThreads(int num_threads) {
+    static std::mutex mutex;
+    static int set_num_threads = 0;
+    std::lock_guard<std::mutex> lock(mutex);
+    if (set_num_threads == 0) {
+        try {
+            at::set_num_interop_threads(num_threads);
+            set_num_threads = num_threads;
+        } catch (const std::exception& e) {
+            LOG(WARNING) << "Failed to set inter_op_threads: " << e.what();
+            set_num_threads = at::get_num_interop_threads();
+        }
+    } else if (num_threads != set_num_threads) {
+        LOG(WARNING) << "inter_op_threads is process-wide and already " << set_num_threads << "; ignoring " << num_threads;
+    }
+}
+
+class WenetSTTDecoder;
+
+// Fixed pool of worker threads shared by many streaming decoders, rather than each decoder having its own thread. A decoder is only queued once it has enough new features for a chunk, and each turn decodes a single chunk before the decoder goes to the back of the queue, so decoders are served fairly.
+class DecodeScheduler {
+public:
+    DecodeScheduler(int num_threads, const ThreadConfig& thread_config) : thread_config_(thread_config) {
+        CHECK_GT(num_threads, 0);
+        for (int i = 0; i < num_threads; ++i) {
+            workers_.emplace_back(&DecodeScheduler::WorkerFunc, this);
+        }
+    }
+
+    ~DecodeScheduler() {
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            stopping_ = true;
+        }
+        cv_.notify_all();
+        for (auto& worker : workers_) {
+            worker.join();
+        }
+    }
+
+    void Enqueue(WenetSTTDecoder *decoder) {
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            queue_.push_back(decoder);
+            max_queue_depth_ = std::max(max_queue_depth_, queue_.size());
+        }
+        cv_.notify_one();
+    }
+
+    void RegisterDecoder() { ++num_decoders_; }
+    void UnregisterDecoder() { --num_decoders_; }
+
+    nlohmann::json GetStats() const {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return {
+            {"num_threads", workers_.size()},
+            {"num_decoders", num_decoders_.load()},
+            {"queue_depth", queue_.size()},
+            {"max_queue_depth", max_queue_depth_},
+            {"active_workers", active_workers_},
+            {"chunks_decoded", chunks_decoded_},
+            {"busy_ms", busy_ms_},
+        };
+    }
+
+protected:
+    void WorkerFunc();
+
+    const ThreadConfig thread_config_;
+    std::vector<std::thread> workers_;
+    mutable std::mutex mutex_;
+    std::condition_variable cv_;
+    std::deque<WenetSTTDecoder*> queue_;
+    bool stopping_ = false;
+    std::atomic<int> num_decoders_{0};
+
+    size_t max_queue_depth_ = 0;
+    int active_workers_ = 0;
+    uint64_t chunks_decoded_ = 0;
+    double busy_ms_ = 0;
+};
+
 struct WenetSTTModel {
     std::shared_ptr<wenet::FeaturePipelineConfig> feature_config_;
     std::shared_ptr<wenet::DecodeOptions> decode_config_;
-    std::shared_ptr<wenet::DecodeResource> decode_resource_;
+    std::shared_ptr<wenet::DecodeResource> decode_resource_;  // With the default context graph, if any.
+    std::shared_ptr<wenet::DecodeResource> shared_resource_;  // As loaded (and shared through the process-wide cache), without any context graph.
+    std::shared_ptr<DecodeScheduler> decode_scheduler_;  // Shared by all decoders of this model, or nullptr for each decoder to use its own thread.
+    int max_coalesced_chunks_ = 1;  // Maximum number of chunks a lagging decoder may decode in a single encoder forward, when using decode_scheduler_. Each stream is still forwarded separately (at batch size 1), and since frames attend to the rest of their chunk, coalesced results can differ slightly from decoding chunk by chunk.
+    bool continuous_ = false;  // Whether to finalize a segment and continue decoding at each endpoint, rather than ignoring endpoints.
+    VadConfig vad_config_;
+    ThreadConfig thread_config_;
+    std::vector<std::string> context_phrases_;  // Default phrases to bias decoding toward.
+    float context_score_ = FLAGS_context_score;  // Default bonus per biased token.
+    std::shared_ptr<ContextGraphCache> context_graph_cache_;
+
+    std::shared_ptr<ModelMetrics> metrics_ = std::make_shared<ModelMetrics>();  // Shared with decoders, which record into it.
+
+    nlohmann::json config_json_;
+    std::mutex load_mutex_;
+    nlohmann::json load_timings_;
 
     WenetSTTModel(const std::string& config_json_str) {
         if (!one_time_initialized_) {
@@ -208,79 +965,311 @@ struct WenetSTTModel {
         if (!config_json_str.empty()) {
             auto config_json = nlohmann::json::parse(config_json_str);
             if (!config_json.is_object()) LOG(FATAL) << "config_json_str must be a valid JSON object";
+            config_json_ = config_json;
             feature_config_ = InitFeaturePipelineConfigFromSimpleJson(config_json);
             decode_config_ = InitDecodeOptionsFromSimpleJson(config_json);
-            decode_resource_ = InitDecodeResourceFromSimpleJson(config_json);
+            if (config_json.contains("context_phrases")) config_json.at("context_phrases").get_to(context_phrases_);
+            if (config_json.contains("context_score")) config_json.at("context_score").get_to(context_score_);
+            auto context_cache_size = (config_json.contains("context_cache_size")) ? config_json.at("context_cache_size").get<int>() : 64;
+            context_graph_cache_ = std::make_shared<ContextGraphCache>(std::max(0, context_cache_size));
+            thread_config_.intra_op_threads = (config_json.contains("num_threads")) ? config_json.at("num_threads").get<int>() : FLAGS_num_threads;
+            if (config_json.contains("cpu_affinity")) config_json.at("cpu_affinity").get_to(thread_config_.cpu_affinity);
+            for (auto cpu : thread_config_.cpu_affinity) {
+                if (cpu < 0) LOG(FATAL) << "cpu_affinity must be a list of CPU ids";
+            }
+            if (config_json.contains("inter_op_threads")) SetInterOpThreads(config_json.at("inter_op_threads").get<int>());
+            auto lazy_load = (config_json.contains("lazy_load")) ? config_json.at("lazy_load").get<bool>() : false;
+            if (!lazy_load) EnsureLoaded();
+            auto decoder_threads = (config_json.contains("decoder_threads")) ? config_json.at("decoder_threads").get<int>() : 0;
+            if (decoder_threads > 0) {
+                decode_scheduler_ = std::make_shared<DecodeScheduler>(decoder_threads, thread_config_);
+            }
+            if (config_json.contains("max_coalesced_chunks")) config_json.at("max_coalesced_chunks").get_to(max_coalesced_chunks_);
+            if (config_json.contains("continuous")) config_json.at("continuous").get_to(continuous_);
+            if (config_json.contains("vad")) config_json.at("vad").get_to(vad_config_.enabled);
+            if (config_json.contains("vad_threshold_db")) config_json.at("vad_threshold_db").get_to(vad_config_.threshold_db);
+            if (config_json.contains("vad_padding_ms")) config_json.at("vad_padding_ms").get_to(vad_config_.padding_ms);
+            // The VAD compresses silences, so in continuous mode it must keep enough after speech for the trailing silence endpoint rule (with speech decoded) to fire.
+            if (continuous_) vad_config_.min_trailing_silence_ms = decode_config_->ctc_endpoint_config.rule2.min_trailing_silence;
+            if (max_coalesced_chunks_ > 1 && decode_config_->num_left_chunks >= 0) {
+                LOG(WARNING) << "max_coalesced_chunks requires num_left_chunks < 0, since the attention cache size is measured in chunks; disabling";
+                max_coalesced_chunks_ = 1;
+            }
         }
     }
 
     int sample_rate() const { return feature_config_->sample_rate; }
     bool is_streaming() const { return decode_config_->chunk_size > 0; }
 
-    std::string DecodeUtterance(const std::vector<float>& wav_samples) {
+    // Loads the decode resource (from the process-wide cache, if possible), unless already loaded.
+    void EnsureLoaded() {
+        std::lock_guard<std::mutex> lock(load_mutex_);
+        if (decode_resource_) return;
+        auto start = Clock::now();
+        nlohmann::json timings;
+        bool use_cache = (config_json_.contains("model_cache")) ? config_json_.at("model_cache").get<bool>() : true;
+        shared_resource_ = use_cache ? LoadCachedDecodeResource(config_json_, timings) : InitDecodeResourceFromSimpleJson(config_json_, timings);
+        decode_resource_ = ResourceWithContext(context_phrases_, context_score_);
+        timings["total_ms"] = ElapsedMs(start);
+        load_timings_ = timings;
+        LOG(INFO) << "Loaded model in " << timings["total_ms"] << "ms" << (timings.value("cache_hit", false) ? " (cached)" : "");
+    }
+
+    // Returns a decode resource biased toward the given phrases, sharing everything but the context graph with the loaded resource. Must be loaded.
+    std::shared_ptr<wenet::DecodeResource> ResourceWithContext(const std::vector<std::string>& phrases, float score) const {
+        if (phrases.empty()) return shared_resource_;
+        auto resource = std::make_shared<wenet::DecodeResource>(*shared_resource_);
+        resource->context_graph = context_graph_cache_->Get(phrases, score, shared_resource_->symbol_table);
+        return resource;
+    }
+
+    // Returns the decode resource for the given context: the default if null, otherwise an object of phrases (an empty list for no biasing) and optional score. Must be loaded.
+    std::shared_ptr<wenet::DecodeResource> ResourceForContext(const nlohmann::json& context) const {
+        if (context.is_null()) return decode_resource_;
+        if (!context.is_object()) LOG(FATAL) << "context must be a JSON object";
+        auto phrases = context.contains("phrases") ? context.at("phrases").get<std::vector<std::string>>() : std::vector<std::string>();
+        auto score = context.contains("score") ? context.at("score").get<float>() : context_score_;
+        return ResourceWithContext(phrases, score);
+    }
+
+    // Returns how long each phase of loading took, or null if not yet loaded.
+    nlohmann::json GetLoadTimings() {
+        std::lock_guard<std::mutex> lock(load_mutex_);
+        return load_timings_;
+    }
+
+    // Decodes a complete utterance, returning the hypothesis, and placing the n-best results into results and statistics into stats if given. Uses the given decode resource (e.g. biased by a context), or the default.
+    template <typename T>
+    std::string DecodeUtterance(SampleSpan<T> wav_samples, UtteranceStats *stats = nullptr, std::vector<wenet::DecodeResult> *results = nullptr,
+            std::shared_ptr<wenet::DecodeResource> resource = nullptr) {
+        EnsureLoaded();
+        ThreadConfigScope thread_config_scope(thread_config_);
+        if (!resource) resource = decode_resource_;
+        UtteranceStats utterance_stats;
+        utterance_stats.audio_ms = 1000.0 * wav_samples.size / sample_rate();
+        auto start = Clock::now();
+        std::vector<float> wav_buffer;
         auto feature_pipeline = std::make_shared<wenet::FeaturePipeline>(*feature_config_);
-        feature_pipeline->AcceptWaveform(wav_samples);
+        auto vad = AcceptUtterance(*feature_pipeline, wav_samples.ConvertTo(wav_buffer), vad_config_, sample_rate(), utterance_stats);
         feature_pipeline->set_input_finished();
+        utterance_stats.feature_ms = ElapsedMs(start);
         LOG(INFO) << "Num frames: " << feature_pipeline->num_frames();
-        wenet::TorchAsrDecoder decoder(feature_pipeline, decode_resource_, *decode_config_);
+        wenet::TorchAsrDecoder decoder(feature_pipeline, resource, *decode_config_);
 
-        int wav_duration = wav_samples.size() / sample_rate();
-        int decode_time = 0;
+        std::string hypothesis;
+        std::vector<wenet::DecodeResult> utterance_results;
         while (true) {
-            wenet::Timer timer;
+            start = Clock::now();
             wenet::DecodeState state = decoder.Decode();
-            if (state == wenet::DecodeState::kEndFeats) {
+            auto chunk_decode_ms = ElapsedMs(start);
+            utterance_stats.AddChunk(chunk_decode_ms, decoder.num_frames_in_current_chunk());
+            metrics_->RecordChunk(chunk_decode_ms);
+            bool segment_ended = (state == wenet::DecodeState::kEndFeats) || (continuous_ && state == wenet::DecodeState::kEndpoint);
+            if (segment_ended) {
+                start = Clock::now();
                 decoder.Rescoring();
+                utterance_stats.rescoring_ms += ElapsedMs(start);
             }
-            int chunk_decode_time = timer.Elapsed();
-            decode_time += chunk_decode_time;
             if (decoder.DecodedSomething()) {
                 LOG(INFO) << "Partial result: " << decoder.result()[0].sentence;
             }
-            if (state == wenet::DecodeState::kEndFeats) {
-                break;
+            if (segment_ended) {
+                // In continuous mode, join the text of all segments.
+                if (decoder.DecodedSomething()) {
+                    auto segment_text = StripTrailingWhitespace(decoder.result()[0].sentence);
+                    hypothesis += (hypothesis.empty() || segment_text.empty()) ? segment_text : (" " + segment_text);
+                    if (utterance_results.empty()) {
+                        utterance_results = decoder.result();
+                    } else {
+                        // Only the best hypothesis can be joined across segments.
+                        utterance_results.resize(1);
+                        auto& best = utterance_results[0];
+                        const auto& segment_best = decoder.result()[0];
+                        best.sentence = hypothesis;
+                        best.score += segment_best.score;
+                        best.word_pieces.insert(best.word_pieces.end(), segment_best.word_pieces.begin(), segment_best.word_pieces.end());
+                    }
+                }
+                if (state == wenet::DecodeState::kEndFeats) {
+                    break;
+                }
+                decoder.ResetContinuousDecoding();
             }
         }
-        std::string hypothesis;
-        if (decoder.DecodedSomething()) {
-            hypothesis = decoder.result()[0].sentence;
-        }
+        utterance_stats.final = true;
+        metrics_->RecordUtterance(utterance_stats);
         LOG(INFO) << "Final result: " << hypothesis;
-        LOG(INFO) << "Decoded " << wav_duration << "ms audio taking " << decode_time << "ms. RTF: " << std::setprecision(4) << static_cast<float>(decode_time) / wav_duration;
+        LOG(INFO) << "Decoded " << utterance_stats.audio_ms << "ms audio taking " << utterance_stats.processing_ms() << "ms. RTF: " << std::setprecision(4)
+            << ((utterance_stats.audio_ms > 0) ? utterance_stats.processing_ms() / utterance_stats.audio_ms : 0.0);
+        if (stats) *stats = std::move(utterance_stats);
+        if (vad) MapResultTimes(*vad, utterance_results);
+        if (results) *results = std::move(utterance_results);
 
-        // Strip any trailing whitespace
-        auto last_pos = hypothesis.find_last_not_of(' ');
-        hypothesis = hypothesis.substr(0, last_pos + 1);
+        return StripTrailingWhitespace(hypothesis);
+    }
 
-        return hypothesis;
+    // Decodes many complete utterances, running the encoder over padded batches of up to max_batch_size utterances at once, then searching and rescoring each utterance individually. Returns the hypotheses in input order.
+    template <typename T>
+    std::vector<std::string> DecodeUtterances(const std::vector<SampleSpan<T>>& utterances, int max_batch_size) {
+        EnsureLoaded();
+        ThreadConfigScope thread_config_scope(thread_config_);
+        std::vector<std::string> hypotheses(utterances.size());
+        if (decode_resource_->fst != nullptr) {
+            // WFST search is only reachable through TorchAsrDecoder, so decode one utterance at a time.
+            for (size_t i = 0; i < utterances.size(); ++i) {
+                hypotheses[i] = DecodeUtterance(utterances[i]);
+            }
+            return hypotheses;
+        }
+        if (max_batch_size <= 0) max_batch_size = utterances.size();
+
+        // Compute all features up front, and batch utterances of similar length together to minimize padding.
+        wenet::Timer timer;
+        std::vector<float> wav_buffer;
+        std::vector<std::vector<std::vector<float>>> features(utterances.size());
+        std::vector<UtteranceStats> stats(utterances.size());
+        for (size_t i = 0; i < utterances.size(); ++i) {
+            auto start = Clock::now();
+            wenet::FeaturePipeline feature_pipeline(*feature_config_);
+            AcceptUtterance(feature_pipeline, utterances[i].ConvertTo(wav_buffer), vad_config_, sample_rate(), stats[i]);
+            feature_pipeline.set_input_finished();
+            feature_pipeline.Read(std::numeric_limits<int>::max(), &features[i]);
+            stats[i].feature_ms = ElapsedMs(start);
+            stats[i].audio_ms = 1000.0 * utterances[i].size / sample_rate();
+            stats[i].frames = features[i].size();
+        }
+        std::vector<size_t> order(utterances.size());
+        std::iota(order.begin(), order.end(), 0);
+        std::stable_sort(order.begin(), order.end(), [&](size_t a, size_t b) { return features[a].size() < features[b].size(); });
+
+        for (size_t batch_begin = 0; batch_begin < order.size(); batch_begin += max_batch_size) {
+            std::vector<size_t> batch(order.begin() + batch_begin, order.begin() + std::min(order.size(), batch_begin + max_batch_size));
+            auto batch_results = DecodeFeatureBatch(features, batch, stats);
+            for (size_t b = 0; b < batch.size(); ++b) {
+                if (!batch_results[b].empty()) {
+                    hypotheses[batch[b]] = StripTrailingWhitespace(batch_results[b][0].sentence);
+                }
+            }
+        }
+        for (auto& utterance_stats : stats) {
+            utterance_stats.final = true;
+            metrics_->RecordUtterance(utterance_stats);
+        }
+
+        LOG(INFO) << "Decoded " << utterances.size() << " utterances in batches of up to " << max_batch_size << " taking " << timer.Elapsed() << "ms";
+        return hypotheses;
+    }
+
+protected:
+
+    // Runs a single padded encoder forward over the given utterances' features, then searches and rescores each utterance. Returns the n-best results for each, in the given order, and adds timings to their stats (splitting the encoder time evenly across the batch).
+    std::vector<std::vector<wenet::DecodeResult>> DecodeFeatureBatch(const std::vector<std::vector<std::vector<float>>>& features, const std::vector<size_t>& batch, std::vector<UtteranceStats>& stats) {
+        torch::NoGradGuard no_grad;
+        const auto& model = decode_resource_->model;
+        int feature_dim = feature_config_->num_bins;
+        int batch_size = batch.size();
+        int max_num_frames = 0;
+        for (auto i : batch) max_num_frames = std::max(max_num_frames, static_cast<int>(features[i].size()));
+
+        std::vector<std::vector<wenet::DecodeResult>> results(batch_size);
+        if (max_num_frames == 0) return results;
+
+        torch::Tensor feats = torch::zeros({batch_size, max_num_frames, feature_dim}, torch::kFloat);
+        torch::Tensor feats_lens = torch::zeros({batch_size}, torch::kInt);
+        for (int b = 0; b < batch_size; ++b) {
+            const auto& utterance_features = features[batch[b]];
+            for (size_t t = 0; t < utterance_features.size(); ++t) {
+                memcpy(feats[b][t].data_ptr<float>(), utterance_features[t].data(), sizeof(float) * feature_dim);
+            }
+            feats_lens[b] = static_cast<int>(utterance_features.size());
+        }
+
+        // Use the same chunk masking as streaming decoding, so results match those of DecodeUtterance().
+        auto start = Clock::now();
+        int decoding_chunk_size = (decode_config_->chunk_size > 0) ? decode_config_->chunk_size : -1;
+        auto encoder = model->torch_model()->attr("encoder").toModule();
+        auto encoder_outputs = encoder.forward({feats, feats_lens, decoding_chunk_size, decode_config_->num_left_chunks}).toTuple()->elements();
+        auto encoder_out = encoder_outputs[0].toTensor();
+        auto encoder_mask = encoder_outputs[1].toTensor();
+        auto ctc_log_probs = model->torch_model()->run_method("ctc_activation", encoder_out).toTensor();
+        auto encoder_ms = ElapsedMs(start);
+
+        int frame_shift_in_ms = model->subsampling_rate() * feature_config_->frame_shift * 1000 / feature_config_->sample_rate;
+        for (int b = 0; b < batch_size; ++b) {
+            int num_encoder_frames = encoder_mask[b].sum().item<int64_t>();
+            auto& utterance_stats = stats[batch[b]];
+            start = Clock::now();
+            wenet::CtcPrefixBeamSearch searcher(decode_config_->ctc_prefix_search_opts, decode_resource_->context_graph);
+            searcher.Search(ctc_log_probs[b].narrow(0, 0, num_encoder_frames));
+            utterance_stats.encoder_ms = encoder_ms / batch_size;
+            utterance_stats.search_ms = ElapsedMs(start);
+            utterance_stats.decode_ms = utterance_stats.encoder_ms + utterance_stats.search_ms;
+            utterance_stats.chunks = 1;
+            start = Clock::now();
+            results[b] = FinishUtteranceSearch(searcher, encoder_out[b].narrow(0, 0, num_encoder_frames).unsqueeze(0),
+                *decode_resource_, *decode_config_, frame_shift_in_ms);
+            utterance_stats.rescoring_ms = ElapsedMs(start);
+        }
+        return results;
     }
 };
 
+typedef void (*ResultCallback)(void *user_data, bool final);
+
 class WenetSTTDecoder {
 public:
     WenetSTTDecoder(std::shared_ptr<const WenetSTTModel> model) :
         model_(model),
+        scheduler_(model_->decode_scheduler_),
+        decode_options_(*model_->decode_config_),
         feature_pipeline_(std::make_shared<wenet::FeaturePipeline>(*model_->feature_config_)),
-        decoder_(std::make_shared<wenet::TorchAsrDecoder>(feature_pipeline_, model_->decode_resource_, *model_->decode_config_)),
-        decode_thread_(std::make_unique<std::thread>(&WenetSTTDecoder::DecodeThreadFunc, this)) {}
+        decoder_(std::make_shared<wenet::TorchAsrDecoder>(feature_pipeline_, model_->decode_resource_, decode_options_)),
+        decode_resource_(model_->decode_resource_),
+        vad_(model_->vad_config_.enabled ? std::make_unique<EnergyVad>(model_->vad_config_, model_->sample_rate()) : nullptr) {
+        if (scheduler_) scheduler_->RegisterDecoder();
+        StartDecoding();
+    }
 
     ~WenetSTTDecoder() {
-        if (decode_thread_->joinable()) {
+        StopDecoding();
+        if (scheduler_) {
+            scheduler_->UnregisterDecoder();
+        } else if (decode_thread_) {
+            {
+                std::lock_guard<std::mutex> lock(thread_mutex_);
+                thread_exiting_ = true;
+            }
+            thread_cv_.notify_all();
             decode_thread_->join();
         }
     }
 
     // Decodes given audio block, and finalizes if passed true. Must not be called again after finalizing without having called Reset().
-    void Decode(const std::vector<float>& wav_samples, bool finalize) {
+    template <typename T>
+    void Decode(SampleSpan<T> wav_samples, bool finalize) {
         CHECK(!finalized_);
         started_ = true;
-        if (!wav_samples.empty()) {
-            feature_pipeline_->AcceptWaveform(wav_samples);
+        auto start = Clock::now();
+        if (vad_) {
+            // Pass only the audio the VAD keeps on to the feature pipeline.
+            vad_buffer_.clear();
+            if (!wav_samples.empty()) vad_->Process(wav_samples.ConvertTo(wav_buffer_), vad_buffer_);
+            if (finalize) vad_->Flush(vad_buffer_);
+            if (!vad_buffer_.empty()) feature_pipeline_->AcceptWaveform(vad_buffer_);
+        } else if (!wav_samples.empty()) {
+            feature_pipeline_->AcceptWaveform(wav_samples.ConvertTo(wav_buffer_));
         }
         if (finalize) {
             feature_pipeline_->set_input_finished();
             finalized_ = true;
         }
+        auto feature_ms = ElapsedMs(start);
+        std::lock_guard<std::mutex> lock(schedule_mutex_);
+        utterance_stats_.feature_ms += feature_ms;
+        utterance_stats_.audio_ms += 1000.0 * wav_samples.size / model_->sample_rate();
+        if (vad_) utterance_stats_.vad_skipped_ms = vad_->skipped_ms();
+        feed_times_.emplace_back(feature_pipeline_->num_frames(), Clock::now());
+        if (scheduler_) ScheduleIfReady();
     }
 
     // Places current result into given string, and returns true if it was final.
@@ -290,96 +1279,610 @@ public:
         return result_is_final_;
     }
 
-    // Reset decoder for decoding a new utterance.
-    void Reset() {
+    // Blocks until the result is final (if wait_final) or until the result revision differs from since_revision (otherwise; if negative, from the revision when called), or until timeout_ms elapses (never, if negative). Places current result into given string, whether it was final into final, and its revision into revision, and returns false if timed out.
+    bool WaitForResult(bool wait_final, int64_t since_revision, int64_t timeout_ms, std::string& result, bool& final, uint64_t& revision) {
+        std::unique_lock<std::mutex> lock(result_mutex_);
+        uint64_t baseline = (since_revision < 0) ? result_revision_.load() : static_cast<uint64_t>(since_revision);
+        auto predicate = [&]() { return result_is_final_ || (!wait_final && result_revision_ != baseline); };
+        bool satisfied = true;
+        if (timeout_ms < 0) {
+            result_cv_.wait(lock, predicate);
+        } else {
+            satisfied = result_cv_.wait_for(lock, std::chrono::milliseconds(timeout_ms), predicate);
+        }
+        result = result_;
+        final = result_is_final_;
+        revision = result_revision_;
+        return satisfied;
+    }
+
+    // Returns the current result as JSON, including the optional fields selected by fields (see ResultFields).
+    std::string GetResultJson(int32_t fields) {
+        std::lock_guard<std::mutex> lock(result_mutex_);
+        return ResultToJson(result_, result_is_final_, results_, fields).dump();
+    }
+
+    // Returns the current result revision, without locking.
+    uint64_t GetResultRevision() const { return result_revision_; }
+
+    // Returns the current result revision, and if it differs from since_revision, places the current result into final, prefix_len, and suffix: the current text is the first prefix_len characters (Unicode code points) of the text at since_revision, followed by suffix. If since_revision is too old to still be known, prefix_len is 0 and suffix is the entire text.
+    uint64_t GetResultDelta(uint64_t since_revision, bool& final, int32_t& prefix_len, std::string& suffix) {
+        if (since_revision == result_revision_) return since_revision;  // Unchanged: skip locking and copying
+        std::lock_guard<std::mutex> lock(result_mutex_);
+        const auto& text = result_history_.back().second;
+        final = result_is_final_;
+        size_t prefix_bytes = 0;
+        for (const auto& entry : result_history_) {
+            if (entry.first == since_revision) {
+                const auto& old_text = entry.second;
+                while (prefix_bytes < text.size() && prefix_bytes < old_text.size() && text[prefix_bytes] == old_text[prefix_bytes]) ++prefix_bytes;
+                // Back off to a UTF-8 character boundary.
+                while (prefix_bytes > 0 && prefix_bytes < text.size() && (text[prefix_bytes] & 0xC0) == 0x80) --prefix_bytes;
+                break;
+            }
+        }
+        prefix_len = std::count_if(text.begin(), text.begin() + prefix_bytes, [](char c) { return (c & 0xC0) != 0x80; });
+        suffix = text.substr(prefix_bytes);
+        return result_history_.back().first;
+    }
+
+    // Sets a function to be called (from the decode thread) whenever the result changes, or nullptr to clear it. Returns only once no call of the previous function is in flight (other than one this is called from), so the caller may then free it.
+    void SetResultCallback(ResultCallback callback, void *user_data) {
+        std::unique_lock<std::mutex> lock(callback_mutex_);
+        result_callback_ = callback;
+        result_callback_user_data_ = user_data;
+        int own_calls = (invoking_callback_of_ == this) ? 1 : 0;
+        callback_cv_.wait(lock, [&]() { return callbacks_in_flight_ <= own_calls; });
+    }
+
+    // Removes and returns all segments finalized at endpoints (in continuous mode) since last called, as a JSON array, if it fits in the given buffer. Always sets the length needed.
+    bool PopSegments(char *json, int32_t json_max_len, int32_t *json_len_p) {
+        std::lock_guard<std::mutex> lock(result_mutex_);
+        nlohmann::json segments_json = nlohmann::json::array();
+        for (const auto& segment : segments_) {
+            auto words = nlohmann::json::array();
+            for (const auto& word_piece : segment.words) {
+                words.push_back({{"word", word_piece.word}, {"start_ms", word_piece.start}, {"end_ms", word_piece.end}});
+            }
+            segments_json.push_back({
+                {"text", segment.text},
+                {"start_ms", segment.start_ms},
+                {"end_ms", segment.end_ms},
+                {"words", std::move(words)},
+            });
+        }
+        if (!CopyToBuffer(segments_json.dump(), json, json_max_len, json_len_p)) return false;
+        segments_.clear();
+        return true;
+    }
+
+    // Reset decoder for decoding a new utterance, abandoning any current unfinalized utterance. Returns the statistics for the previous utterance.
+    nlohmann::json Reset() {
+        StopDecoding();
         started_ = false;
         finalized_ = false;
-        result_.clear();
-        result_is_final_ = false;
+        abandoned_ = false;
+        done_ = false;
+        frames_decoded_ = 0;
+        chunks_decoded_in_utterance_ = 0;
+        segment_start_frame_ = 0;
+        nlohmann::json stats;
+        {
+            std::lock_guard<std::mutex> lock(schedule_mutex_);
+            stats = utterance_stats_.ToJson();
+            utterance_stats_ = UtteranceStats();
+            feed_times_.clear();
+        }
+        {
+            std::lock_guard<std::mutex> lock(result_mutex_);
+            result_.clear();
+            results_.clear();
+            result_is_final_ = false;
+            segments_.clear();
+            BumpResultRevision();
+        }
+        result_cv_.notify_all();
         feature_pipeline_->Reset();
-        decoder_->Reset();
-        CHECK(!decode_thread_->joinable());
-        decode_thread_ = std::make_unique<std::thread>(&WenetSTTDecoder::DecodeThreadFunc, this);
+        if (pending_resource_) {
+            // The context changed, which TorchAsrDecoder only reads on construction.
+            decode_resource_ = std::move(pending_resource_);
+            pending_resource_.reset();
+            decoder_ = std::make_shared<wenet::TorchAsrDecoder>(feature_pipeline_, decode_resource_, decode_options_);
+            ++context_rebuilds_;
+        } else {
+            decoder_->Reset();
+        }
+        if (vad_) vad_->Reset();
+        StartDecoding();
+        return stats;
+    }
+
+    // Sets the context (see WenetSTTModel::ResourceForContext) to bias decoding toward, starting with the next utterance, or immediately if the current one has not started.
+    void SetContext(const nlohmann::json& context) {
+        auto resource = model_->ResourceForContext(context);
+        // Each call builds a new resource, so compare the (cached, thus shared) context graphs, to avoid needlessly rebuilding decoder_ for the same context.
+        if (resource->context_graph == decode_resource_->context_graph) {
+            pending_resource_.reset();
+            return;
+        }
+        pending_resource_ = std::move(resource);
+        if (!started_) Reset();
+    }
+
+    // Returns statistics for decoding the current utterance so far.
+    nlohmann::json GetUtteranceStats() {
+        std::lock_guard<std::mutex> lock(schedule_mutex_);
+        return utterance_stats_.ToJson();
+    }
+
+    // Returns statistics about this decoder's scheduling and decoding.
+    nlohmann::json GetStats() {
+        std::lock_guard<std::mutex> lock(schedule_mutex_);
+        return {
+            {"chunks_decoded", chunks_decoded_},
+            {"chunks_coalesced", chunks_coalesced_},
+            {"context_rebuilds", context_rebuilds_.load()},
+            {"times_scheduled", times_scheduled_},
+            {"queue_wait_ms_total", queue_wait_ms_total_},
+            {"queue_wait_ms_max", queue_wait_ms_max_},
+            {"decode_ms_total", decode_ms_total_},
+            {"frames_queued", feature_pipeline_->num_frames() - frames_decoded_},
+            {"scheduled", scheduled_},
+            {"chunk_latency_ms", utterance_stats_.chunk_latency_ms},
+        };
+    }
+
+    // Called by a DecodeScheduler worker thread to decode one chunk.
+    void RunScheduledStep() {
+        auto start = Clock::now();
+        {
+            std::lock_guard<std::mutex> lock(schedule_mutex_);
+            auto wait_ms = ElapsedMs(enqueue_time_, start);
+            queue_wait_ms_total_ += wait_ms;
+            queue_wait_ms_max_ = std::max(queue_wait_ms_max_, wait_ms);
+            utterance_stats_.queue_wait_ms += wait_ms;
+            utterance_stats_.queue_wait_ms_max = std::max(utterance_stats_.queue_wait_ms_max, wait_ms);
+            model_->metrics_->RecordQueueWait(wait_ms);
+            // If this decoder has fallen behind by several chunks, catch up by decoding them in a single larger encoder forward. TorchAsrDecoder reads the chunk size from decode_options_ anew for each chunk.
+            // This only merges chunks of this one stream, not across streams, and gives the earlier frames more right context than chunk by chunk decoding, so hypotheses and scores may differ slightly.
+            int num_chunks = 1;
+            while (num_chunks < model_->max_coalesced_chunks_
+                    && feature_pipeline_->num_frames() - frames_decoded_ >= RequiredFramesForNextChunk(num_chunks + 1)) {
+                ++num_chunks;
+            }
+            decode_options_.chunk_size = model_->decode_config_->chunk_size * num_chunks;
+            chunks_coalesced_ += num_chunks - 1;
+        }
+        bool done = DecodeStep();
+        std::lock_guard<std::mutex> lock(schedule_mutex_);
+        decode_ms_total_ += ElapsedMs(start);
+        done_ = done || abandoned_;
+        scheduled_ = false;
+        ScheduleIfReady();
+        // Notify while holding the lock, since a waiting destructor may destroy this decoder as soon as it can acquire it.
+        schedule_cv_.notify_all();
     }
 
 protected:
 
-    // Decode in separate thread.
+    // Starts decoding the current utterance: in this decoder's thread (started once, and reused for every utterance), or as scheduled by the shared DecodeScheduler once enough features are ready.
+    void StartDecoding() {
+        if (!scheduler_) {
+            {
+                std::lock_guard<std::mutex> lock(thread_mutex_);
+                thread_decoding_ = true;
+            }
+            thread_cv_.notify_all();
+            if (!decode_thread_) {
+                decode_thread_ = std::make_unique<std::thread>(&WenetSTTDecoder::DecodeThreadFunc, this);
+            }
+        }
+    }
+
+    // Waits for decoding of the current utterance to stop, abandoning it if it was not finalized.
+    void StopDecoding() {
+        if (!finalized_) {
+            abandoned_ = true;
+            feature_pipeline_->set_input_finished();
+        }
+        if (scheduler_) {
+            std::unique_lock<std::mutex> lock(schedule_mutex_);
+            if (abandoned_) done_ = true;
+            schedule_cv_.wait(lock, [this]() { return !scheduled_; });
+        } else {
+            std::unique_lock<std::mutex> lock(thread_mutex_);
+            thread_cv_.wait(lock, [this]() { return !thread_decoding_; });
+        }
+    }
+
+    // Decode in separate thread, which idles between utterances until the next StartDecoding() (or destruction).
     void DecodeThreadFunc() {
+        ThreadConfigScope thread_config_scope(model_->thread_config_, true);
         while (true) {
-            wenet::DecodeState state = decoder_->Decode();
-            CHECK(started_);
-            if (state == wenet::DecodeState::kEndFeats) {
-                CHECK(finalized_);
-                decoder_->Rescoring();
-                if (decoder_->DecodedSomething()) {
-                    VLOG(1) << "Final result: " << decoder_->result()[0].sentence;
-                    std::lock_guard<std::mutex> lock(result_mutex_);
-                    result_ = decoder_->result()[0].sentence;
-                    result_is_final_ = true;
-                }
-                break;
-            } else if (state == wenet::DecodeState::kEndpoint) {
-                CHECK(false) << "Endpoint reached";
-                decoder_->ResetContinuousDecoding();
+            {
+                std::unique_lock<std::mutex> lock(thread_mutex_);
+                thread_cv_.wait(lock, [this]() { return thread_decoding_ || thread_exiting_; });
+                if (!thread_decoding_) return;
+            }
+            while (!DecodeStep()) {}
+            {
+                std::lock_guard<std::mutex> lock(thread_mutex_);
+                thread_decoding_ = false;
+            }
+            thread_cv_.notify_all();
+        }
+    }
+
+    // Decodes one chunk of features, blocking until they are available, and publishes the result. Returns true once the utterance is finished.
+    bool DecodeStep() {
+        auto start = Clock::now();
+        wenet::DecodeState state = decoder_->Decode();
+        RecordChunkDecoded(ElapsedMs(start), decoder_->num_frames_in_current_chunk());
+        ++chunks_decoded_in_utterance_;
+        if (state == wenet::DecodeState::kEndFeats) {
+            if (abandoned_) {
+                return true;
+            }
+            CHECK(finalized_);
+            Rescore();
+            {
+                std::lock_guard<std::mutex> lock(schedule_mutex_);
+                utterance_stats_.final = true;
+                model_->metrics_->RecordUtterance(utterance_stats_);
+            }
+            // Always publish a final result, even if nothing was decoded, so waiters are released.
+            auto results = decoder_->DecodedSomething() ? decoder_->result() : std::vector<wenet::DecodeResult>();
+            VLOG(1) << "Final result: " << (results.empty() ? std::string() : results[0].sentence);
+            if (model_->continuous_) {
+                EndSegment(std::move(results), true);
             } else {
-                if (decoder_->DecodedSomething()) {
-                    VLOG(1) << "Partial result: " << decoder_->result()[0].sentence;
-                    std::lock_guard<std::mutex> lock(result_mutex_);
-                    result_ = decoder_->result()[0].sentence;
-                }
+                UpdateResult(std::move(results), true);
             }
+            return true;
+        } else if (state == wenet::DecodeState::kEndpoint && model_->continuous_) {
+            Rescore();
+            auto results = decoder_->DecodedSomething() ? decoder_->result() : std::vector<wenet::DecodeResult>();
+            VLOG(1) << "Segment result: " << (results.empty() ? std::string() : results[0].sentence);
+            EndSegment(std::move(results), false);
+            decoder_->ResetContinuousDecoding();
+            chunks_decoded_in_utterance_ = 0;  // The next chunk is once again a first chunk
+        } else {
+            if (decoder_->DecodedSomething()) {
+                VLOG(1) << "Partial result: " << decoder_->result()[0].sentence;
+                UpdateResult(decoder_->result(), false);
+            }
+        }
+        return false;
+    }
+
+    // Records a decoded chunk, including its latency: the time since the audio it completed was fed to Decode().
+    void RecordChunkDecoded(double decode_ms, int chunk_frames) {
+        std::lock_guard<std::mutex> lock(schedule_mutex_);
+        frames_decoded_ += chunk_frames;
+        ++chunks_decoded_;
+        utterance_stats_.AddChunk(decode_ms, chunk_frames);
+        model_->metrics_->RecordChunk(decode_ms);
+        // Drop feeds whose audio was entirely decoded by previous chunks.
+        while (feed_times_.size() > 1 && feed_times_.front().first < frames_decoded_) {
+            feed_times_.pop_front();
+        }
+        if (feed_times_.empty()) return;
+        auto latency_ms = ElapsedMs(feed_times_.front().second);
+        utterance_stats_.AddChunkLatency(latency_ms);
+        model_->metrics_->RecordChunkLatency(latency_ms);
+    }
+
+    // Rescores the current utterance or segment, recording the time taken.
+    void Rescore() {
+        auto start = Clock::now();
+        decoder_->Rescoring();
+        std::lock_guard<std::mutex> lock(schedule_mutex_);
+        utterance_stats_.rescoring_ms += ElapsedMs(start);
+    }
+
+    // Number of features TorchAsrDecoder::Decode() will read for the next chunk (coalescing num_chunks chunks), mirroring TorchAsrDecoder::AdvanceDecoding().
+    int RequiredFramesForNextChunk(int num_chunks = 1) const {
+        const auto& asr_model = *model_->decode_resource_->model;
+        int chunk_size = model_->decode_config_->chunk_size * num_chunks;
+        if (chunk_size <= 0) {
+            return std::numeric_limits<int>::max();
+        } else if (chunks_decoded_in_utterance_ == 0) {
+            return (chunk_size - 1) * asr_model.subsampling_rate() + asr_model.right_context() + 1;
+        } else {
+            return chunk_size * asr_model.subsampling_rate();
+        }
+    }
+
+    // Queues this decoder on the scheduler if it has enough features to decode a chunk without blocking, and is not already queued or running. Must be called with schedule_mutex_ held.
+    void ScheduleIfReady() {
+        if (scheduled_ || done_) return;
+        bool ready = feature_pipeline_->input_finished()
+            || (feature_pipeline_->num_frames() - frames_decoded_ >= RequiredFramesForNextChunk());
+        if (ready) {
+            scheduled_ = true;
+            ++times_scheduled_;
+            enqueue_time_ = Clock::now();
+            scheduler_->Enqueue(this);
+        }
+    }
+
+    // Finalizes the current segment with the given n-best results (if any) in continuous mode, and publishes it as a (final) result, waking any waiters and calling any callback.
+    void EndSegment(std::vector<wenet::DecodeResult> results, bool final) {
+        int frame_shift_in_ms = decoder_->feature_frame_shift_in_ms();
+        int start_ms = segment_start_frame_ * frame_shift_in_ms;
+        int end_ms = frames_decoded_ * frame_shift_in_ms;
+        if (vad_) {
+            start_ms = vad_->MapToOriginalMs(start_ms);
+            end_ms = vad_->MapToOriginalMs(end_ms);
+            MapResultTimes(*vad_, results);
         }
+        Segment segment{results.empty() ? std::string() : StripTrailingWhitespace(results[0].sentence),
+            start_ms, end_ms, results.empty() ? std::vector<wenet::WordPiece>() : results[0].word_pieces};
+        segment_start_frame_ = frames_decoded_;
+        {
+            std::lock_guard<std::mutex> lock(result_mutex_);
+            if (!segment.text.empty()) segments_.push_back(std::move(segment));
+            if (final) {
+                result_ = results.empty() ? std::string() : results[0].sentence;
+                results_ = std::move(results);
+            } else {
+                result_.clear();
+                results_.clear();
+            }
+            result_is_final_ = final;
+            BumpResultRevision();
+        }
+        result_cv_.notify_all();
+        InvokeResultCallback(final);
+    }
+
+    // Calls the result callback, if any, tracking the call as in flight so SetResultCallback() can wait for it. Must be called without result_mutex_ held, so the callback may itself get the result.
+    void InvokeResultCallback(bool final) {
+        ResultCallback callback;
+        void *user_data;
+        {
+            std::lock_guard<std::mutex> lock(callback_mutex_);
+            callback = result_callback_;
+            user_data = result_callback_user_data_;
+            if (callback == nullptr) return;
+            ++callbacks_in_flight_;
+        }
+        auto previous_invoking = invoking_callback_of_;
+        invoking_callback_of_ = this;
+        callback(user_data, final);
+        invoking_callback_of_ = previous_invoking;
+        {
+            std::lock_guard<std::mutex> lock(callback_mutex_);
+            --callbacks_in_flight_;
+        }
+        callback_cv_.notify_all();
+    }
+
+    // Increments the result revision after the result has changed, recording its text for computing deltas. Must be called with result_mutex_ held.
+    void BumpResultRevision() {
+        result_history_.emplace_back(result_revision_ + 1, StripTrailingWhitespace(result_));
+        if (result_history_.size() > kResultHistorySize) result_history_.pop_front();
+        ++result_revision_;
+    }
+
+    // Publishes new n-best results, waking any waiters and calling any callback if the best result changed.
+    void UpdateResult(std::vector<wenet::DecodeResult> results, bool final) {
+        if (vad_) MapResultTimes(*vad_, results);
+        {
+            std::lock_guard<std::mutex> lock(result_mutex_);
+            auto result = results.empty() ? std::string() : results[0].sentence;
+            results_ = std::move(results);  // Keep details (e.g. times) current, even if the text is unchanged
+            if (result == result_ && final == result_is_final_) return;
+            result_ = std::move(result);
+            result_is_final_ = final;
+            BumpResultRevision();
+        }
+        result_cv_.notify_all();
+        InvokeResultCallback(final);
     }
 
     std::shared_ptr<const WenetSTTModel> model_;
+    std::shared_ptr<DecodeScheduler> scheduler_;
+    wenet::DecodeOptions decode_options_;  // Per-decoder copy, referenced by decoder_, so the chunk size can vary when coalescing.
     std::shared_ptr<wenet::FeaturePipeline> feature_pipeline_;
     std::shared_ptr<wenet::TorchAsrDecoder> decoder_;
-    std::unique_ptr<std::thread> decode_thread_;
+    std::shared_ptr<wenet::DecodeResource> decode_resource_;  // Used by decoder_, which may be biased by a context.
+    std::shared_ptr<wenet::DecodeResource> pending_resource_;  // Set by SetContext(), to use from the next utterance.
+    std::unique_ptr<std::thread> decode_thread_;  // Only used without a scheduler.
+    std::mutex thread_mutex_;
+    std::condition_variable thread_cv_;  // Notified whenever thread_decoding_ or thread_exiting_ changes.
+    bool thread_decoding_ = false;  // decode_thread_ is decoding the current utterance, rather than idle.
+    bool thread_exiting_ = false;
+    std::vector<float> wav_buffer_;  // Reused across Decode() calls to avoid reallocating.
+    std::unique_ptr<EnergyVad> vad_;  // If enabled, gates audio before feature_pipeline_.
+    std::vector<float> vad_buffer_;  // Reused across Decode() calls to avoid reallocating.
+
+    std::atomic<bool> started_{false};
+    std::atomic<bool> finalized_{false};
+    std::atomic<bool> abandoned_{false};
+    std::atomic<int> frames_decoded_{0};
+    int chunks_decoded_in_utterance_ = 0;  // Since the start of the utterance or segment.
+    int segment_start_frame_ = 0;
 
-    bool started_ = false;
-    bool finalized_ = false;
+    std::mutex schedule_mutex_;
+    std::condition_variable schedule_cv_;  // Notified whenever scheduled_ becomes false.
+    bool scheduled_ = false;  // Queued on or being run by the scheduler.
+    bool done_ = false;  // Finished decoding the current utterance.
+    Clock::time_point enqueue_time_;
+    uint64_t times_scheduled_ = 0;
+    uint64_t chunks_decoded_ = 0;
+    uint64_t chunks_coalesced_ = 0;
+    std::atomic<uint64_t> context_rebuilds_{0};  // Times decoder_ was rebuilt for a changed context.
+    double queue_wait_ms_total_ = 0;
+    double queue_wait_ms_max_ = 0;
+    double decode_ms_total_ = 0;
+    std::deque<std::pair<int, Clock::time_point>> feed_times_;  // Total features available after each Decode() call not yet entirely decoded, and when.
+    UtteranceStats utterance_stats_;
 
     std::mutex result_mutex_;
+    std::condition_variable result_cv_;  // Notified whenever result_ or result_is_final_ changes.
     std::string result_;
+    std::vector<wenet::DecodeResult> results_;  // N-best, of which result_ is the best's text.
     bool result_is_final_ = false;
+    std::atomic<uint64_t> result_revision_{0};  // Incremented whenever result_ or result_is_final_ changes. Only modified with result_mutex_ held.
+    static constexpr size_t kResultHistorySize = 16;
+    std::deque<std::pair<uint64_t, std::string>> result_history_{{0, std::string()}};  // Text of the most recent revisions, for computing deltas.
+    std::mutex callback_mutex_;  // Guards the result callback and its in flight calls, separately from result_mutex_ (which the callback may need).
+    std::condition_variable callback_cv_;  // Notified whenever a callback call finishes.
+    ResultCallback result_callback_ = nullptr;
+    void *result_callback_user_data_ = nullptr;
+    int callbacks_in_flight_ = 0;
+    static thread_local const WenetSTTDecoder *invoking_callback_of_;  // Decoder whose callback the current thread is inside, if any.
+
+    struct Segment {
+        std::string text;
+        int start_ms;
+        int end_ms;
+        std::vector<wenet::WordPiece> words;
+    };
+    std::deque<Segment> segments_;  // Finalized in continuous mode, but not yet popped.
 };
 
+thread_local const WenetSTTDecoder *WenetSTTDecoder::invoking_callback_of_ = nullptr;
+
+void DecodeScheduler::WorkerFunc() {
+    ThreadConfigScope thread_config_scope(thread_config_, true);
+    while (true) {
+        WenetSTTDecoder *decoder;
+        {
+            std::unique_lock<std::mutex> lock(mutex_);
+            cv_.wait(lock, [this]() { return stopping_ || !queue_.empty(); });
+            if (stopping_) return;
+            decoder = queue_.front();
+            queue_.pop_front();
+            ++active_workers_;
+        }
+        auto start = Clock::now();
+        decoder->RunScheduledStep();  // Decoder may be destroyed as soon as this returns.
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            --active_workers_;
+            ++chunks_decoded_;
+            busy_ms_ += ElapsedMs(start);
+        }
+    }
+}
+
 
 extern "C" {
 #include "wenet_stt_lib.h"
 }
 
+// Model handles passed across the C interface point to a shared_ptr, so decoders can share ownership of the model rather than copying it.
+using ModelHandle = std::shared_ptr<WenetSTTModel>;
+
+inline const ModelHandle& GetModel(void *model_vp) {
+    return *static_cast<ModelHandle*>(model_vp);
+}
+
 void *wenet_stt__construct_model(const char *config_json_cstr) {
     BEGIN_INTERFACE_CATCH_HANDLER
-    auto model = new WenetSTTModel(config_json_cstr);
+    auto model = new ModelHandle(std::make_shared<WenetSTTModel>(config_json_cstr));
     return model;
     END_INTERFACE_CATCH_HANDLER(nullptr)
 }
 
 bool wenet_stt__destruct_model(void *model_vp) {
     BEGIN_INTERFACE_CATCH_HANDLER
-    auto model = static_cast<WenetSTTModel*>(model_vp);
+    auto model = static_cast<ModelHandle*>(model_vp);
     delete model;
     return true;
     END_INTERFACE_CATCH_HANDLER(false)
 }
 
-bool wenet_stt__decode_utterance(void *model_vp, float *wav_samples, int32_t wav_samples_len, char *text, int32_t text_max_len) {
+bool wenet_stt__get_metrics(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto& model = GetModel(model_vp);
+    CopyToBuffer(model->metrics_->ToJson().dump(), json, json_max_len, json_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__get_load_timings(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto& model = GetModel(model_vp);
+    CopyToBuffer(model->GetLoadTimings().dump(), json, json_max_len, json_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__get_context_stats(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto& model = GetModel(model_vp);
+    CopyToBuffer(model->context_graph_cache_->GetStats().dump(), json, json_max_len, json_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__get_scheduler_stats(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto& model = GetModel(model_vp);
+    auto stats = model->decode_scheduler_ ? model->decode_scheduler_->GetStats() : nlohmann::json();
+    CopyToBuffer(stats.dump(), json, json_max_len, json_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+template <typename T>
+bool DecodeUtteranceInterface(void *model_vp, const T *wav_samples, int32_t wav_samples_len, int32_t result_fields, const char *context_json, char **result_json_p, char **stats_json_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto& model = GetModel(model_vp);
+    model->EnsureLoaded();
+    auto resource = context_json ? model->ResourceForContext(nlohmann::json::parse(context_json)) : nullptr;
+    UtteranceStats stats;
+    std::vector<wenet::DecodeResult> results;
+    auto hypothesis = model->DecodeUtterance(SampleSpan<T>(wav_samples, wav_samples_len), &stats, &results, resource);
+    *result_json_p = AllocateCString(ResultToJson(hypothesis, true, results, result_fields).dump());
+    if (stats_json_p) *stats_json_p = AllocateCString(stats.ToJson().dump());
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__decode_utterance(void *model_vp, const float *wav_samples, int32_t wav_samples_len, int32_t result_fields, const char *context_json, char **result_json_p, char **stats_json_p) {
+    return DecodeUtteranceInterface(model_vp, wav_samples, wav_samples_len, result_fields, context_json, result_json_p, stats_json_p);
+}
+
+bool wenet_stt__decode_utterance_int16(void *model_vp, const int16_t *wav_samples, int32_t wav_samples_len, int32_t result_fields, const char *context_json, char **result_json_p, char **stats_json_p) {
+    return DecodeUtteranceInterface(model_vp, wav_samples, wav_samples_len, result_fields, context_json, result_json_p, stats_json_p);
+}
+
+template <typename T>
+bool DecodeUtterancesInterface(void *model_vp, const T **wav_samples_list, const int32_t *wav_samples_lens, int32_t num_utterances, int32_t max_batch_size, char **results_json_p) {
     BEGIN_INTERFACE_CATCH_HANDLER
-    auto model = static_cast<WenetSTTModel*>(model_vp);
-    auto hypothesis = model->DecodeUtterance(std::vector<float>(wav_samples, wav_samples + wav_samples_len));
-    auto cstr = hypothesis.c_str();
-    strncpy(text, cstr, text_max_len);
-    text[text_max_len - 1] = 0;  // Just in case.
+    auto& model = GetModel(model_vp);
+    std::vector<SampleSpan<T>> utterances;
+    utterances.reserve(num_utterances);
+    for (int32_t i = 0; i < num_utterances; ++i) {
+        utterances.emplace_back(wav_samples_list[i], wav_samples_lens[i]);
+    }
+    auto hypotheses = model->DecodeUtterances(utterances, max_batch_size);
+    *results_json_p = AllocateCString(nlohmann::json(hypotheses).dump());
     return true;
     END_INTERFACE_CATCH_HANDLER(false)
 }
 
+bool wenet_stt__decode_utterances(void *model_vp, const float **wav_samples_list, const int32_t *wav_samples_lens, int32_t num_utterances, int32_t max_batch_size, char **results_json_p) {
+    return DecodeUtterancesInterface(model_vp, wav_samples_list, wav_samples_lens, num_utterances, max_batch_size, results_json_p);
+}
+
+bool wenet_stt__decode_utterances_int16(void *model_vp, const int16_t **wav_samples_list, const int32_t *wav_samples_lens, int32_t num_utterances, int32_t max_batch_size, char **results_json_p) {
+    return DecodeUtterancesInterface(model_vp, wav_samples_list, wav_samples_lens, num_utterances, max_batch_size, results_json_p);
+}
+
+void wenet_stt__free_string(char *str) {
+    free(str);
+}
+
 void *wenet_stt__construct_decoder(void *model_vp) {
     BEGIN_INTERFACE_CATCH_HANDLER
-    auto model = static_cast<WenetSTTModel*>(model_vp);
-    auto decoder = new WenetSTTDecoder(std::make_shared<const WenetSTTModel>(*model));
+    auto& model = GetModel(model_vp);
+    model->EnsureLoaded();
+    auto decoder = new WenetSTTDecoder(model);
     return decoder;
     END_INTERFACE_CATCH_HANDLER(nullptr)
 }
@@ -392,29 +1895,114 @@ bool wenet_stt__destruct_decoder(void *decoder_vp) {
     END_INTERFACE_CATCH_HANDLER(false)
 }
 
-bool wenet_stt__decode(void *decoder_vp, float *wav_samples, int32_t wav_samples_len, bool finalize) {
+template <typename T>
+bool DecodeInterface(void *decoder_vp, const T *wav_samples, int32_t wav_samples_len, bool finalize) {
     BEGIN_INTERFACE_CATCH_HANDLER
     auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
-    decoder->Decode(std::vector<float>(wav_samples, wav_samples + wav_samples_len), finalize);
+    decoder->Decode(SampleSpan<T>(wav_samples, wav_samples_len), finalize);
     return true;
     END_INTERFACE_CATCH_HANDLER(false)
 }
 
-bool wenet_stt__get_result(void *decoder_vp, char *text, int32_t text_max_len, bool *final_p) {
+bool wenet_stt__decode(void *decoder_vp, const float *wav_samples, int32_t wav_samples_len, bool finalize) {
+    return DecodeInterface(decoder_vp, wav_samples, wav_samples_len, finalize);
+}
+
+bool wenet_stt__decode_int16(void *decoder_vp, const int16_t *wav_samples, int32_t wav_samples_len, bool finalize) {
+    return DecodeInterface(decoder_vp, wav_samples, wav_samples_len, finalize);
+}
+
+bool wenet_stt__get_result(void *decoder_vp, char *text, int32_t text_max_len, int32_t *text_len_p, bool *final_p) {
     BEGIN_INTERFACE_CATCH_HANDLER
     auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
     std::string result;
     *final_p = decoder->GetResult(result);
-    strncpy(text, result.c_str(), text_max_len);
-    text[text_max_len - 1] = 0;  // Just in case.
+    CopyToBuffer(StripTrailingWhitespace(result), text, text_max_len, text_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__wait_for_result(void *decoder_vp, bool wait_final, int64_t since_revision, int32_t timeout_ms, char *text, int32_t text_max_len, int32_t *text_len_p, bool *final_p, bool *timed_out_p, uint64_t *revision_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
+    std::string result;
+    *timed_out_p = !decoder->WaitForResult(wait_final, since_revision, timeout_ms, result, *final_p, *revision_p);
+    CopyToBuffer(StripTrailingWhitespace(result), text, text_max_len, text_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+uint64_t wenet_stt__get_result_revision(void *decoder_vp) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    return static_cast<WenetSTTDecoder*>(decoder_vp)->GetResultRevision();
+    END_INTERFACE_CATCH_HANDLER(0)
+}
+
+bool wenet_stt__get_result_delta(void *decoder_vp, uint64_t since_revision, uint64_t *revision_p, bool *final_p, int32_t *prefix_len_p, char *suffix, int32_t suffix_max_len, int32_t *suffix_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
+    std::string suffix_str;
+    *final_p = false;
+    *prefix_len_p = 0;
+    *revision_p = decoder->GetResultDelta(since_revision, *final_p, *prefix_len_p, suffix_str);
+    CopyToBuffer(suffix_str, suffix, suffix_max_len, suffix_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__get_result_json(void *decoder_vp, int32_t result_fields, char *json, int32_t json_max_len, int32_t *json_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
+    CopyToBuffer(decoder->GetResultJson(result_fields), json, json_max_len, json_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__set_result_callback(void *decoder_vp, void (*callback)(void *user_data, bool final), void *user_data) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
+    decoder->SetResultCallback(callback, user_data);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__set_context(void *decoder_vp, const char *context_json) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
+    decoder->SetContext(context_json ? nlohmann::json::parse(context_json) : nlohmann::json());
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__pop_segments(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
+    decoder->PopSegments(json, json_max_len, json_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__get_decoder_stats(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
+    CopyToBuffer(decoder->GetStats().dump(), json, json_max_len, json_len_p);
+    return true;
+    END_INTERFACE_CATCH_HANDLER(false)
+}
+
+bool wenet_stt__get_utterance_stats(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p) {
+    BEGIN_INTERFACE_CATCH_HANDLER
+    auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
+    CopyToBuffer(decoder->GetUtteranceStats().dump(), json, json_max_len, json_len_p);
     return true;
     END_INTERFACE_CATCH_HANDLER(false)
 }
 
-bool wenet_stt__reset(void *decoder_vp) {
+bool wenet_stt__reset(void *decoder_vp, char **stats_json_p) {
     BEGIN_INTERFACE_CATCH_HANDLER
     auto decoder = static_cast<WenetSTTDecoder*>(decoder_vp);
-    decoder->Reset();
+    auto stats = decoder->Reset();
+    if (stats_json_p) *stats_json_p = AllocateCString(stats.dump());
     return true;
     END_INTERFACE_CATCH_HANDLER(false)
 }
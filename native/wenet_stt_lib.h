@@ -24,10 +24,28 @@
 
 WENET_STT_API void *wenet_stt__construct_model(const char *config_json_cstr);
 WENET_STT_API bool wenet_stt__destruct_model(void *model_vp);
-WENET_STT_API bool wenet_stt__decode_utterance(void *model_vp, float *wav_samples, int32_t wav_samples_len, char *text, int32_t text_max_len);
+WENET_STT_API bool wenet_stt__get_metrics(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+WENET_STT_API bool wenet_stt__get_load_timings(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+WENET_STT_API bool wenet_stt__decode_utterance(void *model_vp, const float *wav_samples, int32_t wav_samples_len, int32_t result_fields, const char *context_json, char **result_json_p, char **stats_json_p);
+WENET_STT_API bool wenet_stt__decode_utterance_int16(void *model_vp, const int16_t *wav_samples, int32_t wav_samples_len, int32_t result_fields, const char *context_json, char **result_json_p, char **stats_json_p);
+WENET_STT_API bool wenet_stt__decode_utterances(void *model_vp, const float **wav_samples_list, const int32_t *wav_samples_lens, int32_t num_utterances, int32_t max_batch_size, char **results_json_p);
+WENET_STT_API bool wenet_stt__decode_utterances_int16(void *model_vp, const int16_t **wav_samples_list, const int32_t *wav_samples_lens, int32_t num_utterances, int32_t max_batch_size, char **results_json_p);
+WENET_STT_API bool wenet_stt__get_context_stats(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+WENET_STT_API bool wenet_stt__get_scheduler_stats(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+WENET_STT_API void wenet_stt__free_string(char *str);
 
 WENET_STT_API void *wenet_stt__construct_decoder(void *model_vp);
 WENET_STT_API bool wenet_stt__destruct_decoder(void *decoder_vp);
-WENET_STT_API bool wenet_stt__decode(void *decoder_vp, float *wav_samples, int32_t wav_samples_len, bool finalize);
-WENET_STT_API bool wenet_stt__get_result(void *decoder_vp, char *text, int32_t text_max_len, bool *final_p);
-WENET_STT_API bool wenet_stt__reset(void *decoder_vp);
+WENET_STT_API bool wenet_stt__decode(void *decoder_vp, const float *wav_samples, int32_t wav_samples_len, bool finalize);
+WENET_STT_API bool wenet_stt__decode_int16(void *decoder_vp, const int16_t *wav_samples, int32_t wav_samples_len, bool finalize);
+WENET_STT_API bool wenet_stt__get_result(void *decoder_vp, char *text, int32_t text_max_len, int32_t *text_len_p, bool *final_p);
+WENET_STT_API bool wenet_stt__wait_for_result(void *decoder_vp, bool wait_final, int64_t since_revision, int32_t timeout_ms, char *text, int32_t text_max_len, int32_t *text_len_p, bool *final_p, bool *timed_out_p, uint64_t *revision_p);
+WENET_STT_API uint64_t wenet_stt__get_result_revision(void *decoder_vp);
+WENET_STT_API bool wenet_stt__get_result_delta(void *decoder_vp, uint64_t since_revision, uint64_t *revision_p, bool *final_p, int32_t *prefix_len_p, char *suffix, int32_t suffix_max_len, int32_t *suffix_len_p);
+WENET_STT_API bool wenet_stt__get_result_json(void *decoder_vp, int32_t result_fields, char *json, int32_t json_max_len, int32_t *json_len_p);
+WENET_STT_API bool wenet_stt__set_result_callback(void *decoder_vp, void (*callback)(void *user_data, bool final), void *user_data);
+WENET_STT_API bool wenet_stt__set_context(void *decoder_vp, const char *context_json);
+WENET_STT_API bool wenet_stt__pop_segments(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+WENET_STT_API bool wenet_stt__get_decoder_stats(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+WENET_STT_API bool wenet_stt__get_utterance_stats(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+WENET_STT_API bool wenet_stt__reset(void *decoder_vp, char **stats_json_p);
@@ -15,3 +15,5 @@ MODEL_DOWNLOADS = {
 }
 
 from .wrapper import WenetSTTModel, WenetSTTDecoder
+from .aio import AsyncWenetSTTDecoder
+from .pool import DecoderPool
@@ -4,28 +4,118 @@
 # Licensed under the AGPL-3.0; see LICENSE file.
 #
 
-import argparse
+import argparse, json, sys, time
 
 from . import _name, WenetSTTModel, MODEL_DOWNLOADS
-from .utils import download_model
+from .utils import download_model, fetch_model
 
 def main():
     parser = argparse.ArgumentParser(prog='python -m %s' % _name)
     subparsers = parser.add_subparsers(dest='command', help='sub-command')
-    subparser = subparsers.add_parser('decode', help='Decode one or more WAV files')
+    subparser = subparsers.add_parser('decode', help='Decode one or more audio files (WAV, FLAC, or raw PCM), converting their sample rate and channels as needed')
     subparser.add_argument('model_dir', help='Model directory to use')
-    subparser.add_argument('wav_file', nargs='+', help='WAV file(s) to decode')
+    subparser.add_argument('wav_file', nargs='*', help='Audio file(s) to decode, or directories to search for WAV/FLAC files')
+    subparser.add_argument('--file-list', help='File listing audio files to decode, one per line')
+    subparser.add_argument('--jobs', type=int, default=1, help='Number of files to decode in parallel, sharing one model')
+    subparser.add_argument('--threads-per-job', type=int, help='Number of threads each decode may use')
+    subparser.add_argument('--quantized', action='store_true', help='Use the int8-quantized variant of the model')
+    subparser.add_argument('--continuous', action='store_true', help='Split long audio into segments at endpoints while decoding, streaming files from disk to keep memory bounded')
+    subparser.add_argument('--channel', default=None, help='Channel index to decode from multi-channel audio, or "all" to decode each channel separately (default: mix all channels)')
+    subparser.add_argument('--raw-sample-rate', type=int, help='Treat input files as headerless PCM at this sample rate')
+    subparser.add_argument('--raw-channels', type=int, default=1, help='Number of interleaved channels in raw PCM input')
+    subparser.add_argument('--raw-dtype', default='<i2', help='Numpy dtype of raw PCM samples (default: <i2, 16 bit little-endian)')
+    subparser.add_argument('--output', help='Write results as JSONL to this file ("-" for stdout) as each file completes, rather than printing texts in order')
+    subparser.add_argument('--resume', action='store_true', help='Skip files already decoded in the --output file, and append to it')
+    subparser = subparsers.add_parser('benchmark', help='Benchmark offline, streaming, and CLI decoding, reporting JSON')
+    from .benchmark import add_arguments as add_benchmark_arguments
+    add_benchmark_arguments(subparser)
+    subparser = subparsers.add_parser('serve', help='Serve streaming decoding over HTTP on localhost, with admission control and backpressure')
+    from .server import add_arguments as add_serve_arguments
+    add_serve_arguments(subparser)
+    subparser = subparsers.add_parser('loadgen', help='Generate load against a running server, reporting JSON')
+    from .loadgen import add_arguments as add_loadgen_arguments
+    add_loadgen_arguments(subparser)
     subparser = subparsers.add_parser('download', help='Download a model to decode with')
     subparser.add_argument('model', nargs='*', help='Model name(s) to download (will also be the output directory)')
+    subparser.add_argument('--cache', action='store_true', help='Install into the shared model cache ($WENET_STT_CACHE, default ~/.cache/wenet_stt) rather than the current directory, printing the model directory')
+    subparser.add_argument('--cache-dir', help='Shared model cache directory to install into (implies --cache)')
+    subparser.add_argument('--sha256', help='Expected sha256 of the downloaded archive (with a single model)')
+    subparser.add_argument('--segments', type=int, default=4, help='Number of byte ranges to download in parallel')
+    subparser = subparsers.add_parser('quantize', help='Add an int8-quantized variant to a model directory, from its training checkpoint')
+    from .quantize import add_arguments as add_quantize_arguments
+    add_quantize_arguments(subparser)
     args = parser.parse_args()
 
     if args.command == 'decode':
-        import wave
-        wenet_stt = WenetSTTModel(WenetSTTModel.build_config(args.model_dir))
-        for wave_file_path in args.wav_file:
-            with wave.open(wave_file_path, 'rb') as wav_file:
-                wav_data = wav_file.readframes(wav_file.getnframes())
-                print(wenet_stt.decode(wav_data))
+        from .corpus import find_audio_files, read_completed_paths, decode_files
+        paths = find_audio_files(args.wav_file, file_list=args.file_list)
+        if not paths:
+            parser.error("no audio files to decode")
+        channel = args.channel
+        if channel not in (None, 'all'):
+            try:
+                channel = int(channel)
+            except ValueError:
+                parser.error("--channel must be an integer or 'all'")
+        decode_kwargs = dict(channel=channel, streaming=args.continuous)
+        if args.raw_sample_rate:
+            decode_kwargs['audio_options'] = dict(raw_sample_rate=args.raw_sample_rate, raw_channels=args.raw_channels, raw_dtype=args.raw_dtype)
+        if args.resume:
+            if not args.output or args.output == '-':
+                parser.error("--resume requires an --output file")
+            completed = read_completed_paths(args.output)
+            paths = [path for path in paths if path not in completed]
+        config = dict()
+        if args.threads_per_job:
+            config['num_threads'] = args.threads_per_job
+        if args.continuous:
+            config['continuous'] = True
+        wenet_stt = WenetSTTModel(WenetSTTModel.build_config(args.model_dir, config=config, quantized=args.quantized))
+        jobs = max(1, args.jobs)
+        failed = False
+
+        if args.output:
+            start = time.perf_counter()
+            output_file = sys.stdout if args.output == '-' else open(args.output, 'a' if args.resume else 'w', encoding='utf-8')
+            try:
+                for index, record in decode_files(wenet_stt, paths, jobs=jobs, **decode_kwargs):
+                    failed = failed or ('error' in record)
+                    output_file.write(json.dumps(record) + '\n')
+                    output_file.flush()
+            finally:
+                if output_file is not sys.stdout:
+                    output_file.close()
+            print("Decoded %d files in %.2fs" % (len(paths), time.perf_counter() - start), file=sys.stderr)
+        else:
+            # Print texts in input order, buffering any results that complete early.
+            pending = dict()
+            next_index = 0
+            for index, record in decode_files(wenet_stt, paths, jobs=jobs, **decode_kwargs):
+                pending[index] = record
+                while next_index in pending:
+                    record = pending.pop(next_index)
+                    if 'error' in record:
+                        failed = True
+                        print("%s: %s" % (record['path'], record['error']), file=sys.stderr)
+                    elif isinstance(record['text'], list):
+                        print('\t'.join(record['text']), flush=True)  # One text per channel
+                    else:
+                        print(record['text'], flush=True)
+                    next_index += 1
+        if failed:
+            sys.exit(1)
+
+    elif args.command == 'benchmark':
+        from .benchmark import run as run_benchmark
+        run_benchmark(args)
+
+    elif args.command == 'serve':
+        from .server import run as run_server
+        run_server(args)
+
+    elif args.command == 'loadgen':
+        from .loadgen import run as run_loadgen
+        run_loadgen(args)
 
     elif args.command == 'download':
         if not args.model:
@@ -33,11 +123,20 @@ def main():
             for name in MODEL_DOWNLOADS:
                 print(name)
         else:
+            if args.sha256 and len(args.model) > 1:
+                parser.error("--sha256 requires a single model")
             for name in args.model:
                 if name not in MODEL_DOWNLOADS:
                     print("Model '%s' not found" % name)
                     continue
-                download_model(name, verbose=True)
+                if args.cache or args.cache_dir:
+                    print(fetch_model(name, cache_dir=args.cache_dir, sha256=args.sha256, segments=args.segments, verbose=True))
+                else:
+                    download_model(name, verbose=True, sha256=args.sha256, segments=args.segments)
+
+    elif args.command == 'quantize':
+        from .quantize import run as run_quantize
+        run_quantize(args)
 
     else:
         parser.print_help()
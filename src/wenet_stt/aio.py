@@ -0,0 +1,107 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+import asyncio
+
+from .wrapper import WenetSTTDecoder
+
+class AsyncWenetSTTDecoder(object):
+    """
+    asyncio interface to a streaming WenetSTTDecoder. Audio is fed to the native decoder in the default executor, so the event loop is never blocked, and results are delivered by the native decode thread's result callback rather than by polling.
+    """
+
+    def __init__(self, model, executor=None):
+        self._decoder = WenetSTTDecoder(model)
+        self._executor = executor
+        self._loop = None
+        self._changed = None
+
+    def _ensure_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._changed = asyncio.Event()
+            self._decoder.set_result_callback(self._on_result_changed)
+        return loop
+
+    def _on_result_changed(self, final):
+        # Called from the native decode thread.
+        try:
+            self._loop.call_soon_threadsafe(self._changed.set)
+        except RuntimeError:
+            pass  # Event loop already closed
+
+    async def decode(self, wav_samples, finalize):
+        """ Feed a block of audio to the decoder, finalizing the utterance if finalize is true. """
+        loop = self._ensure_loop()
+        await loop.run_in_executor(self._executor, self._decoder.decode, wav_samples, finalize)
+
+    def get_result(self):
+        """ Return (text, final) for the current result, without waiting. """
+        return self._decoder.get_result()
+
+    async def results(self):
+        """ Asynchronously iterate over (text, final) results as they change, ending with the final result. """
+        self._ensure_loop()
+        async for result in self._results():
+            yield result
+
+    async def _results(self, feed_task=None):
+        last = None
+        while True:
+            self._changed.clear()
+            if feed_task is not None and feed_task.done() and not feed_task.cancelled() and feed_task.exception() is not None:
+                raise feed_task.exception()
+            text, final = self._decoder.get_result()
+            if (text, final) != last:
+                last = (text, final)
+                yield text, final
+                if final:
+                    return
+            else:
+                await self._changed.wait()
+
+    async def get_final_result(self):
+        """ Wait for and return the final text. """
+        async for text, final in self.results():
+            if final:
+                return text
+
+    async def stream(self, audio_iter):
+        """ Decode audio blocks from the given (async or regular) iterable as a single utterance, finalizing once it is exhausted, while asynchronously iterating over (text, final) results as they change. """
+        loop = self._ensure_loop()
+
+        async def feed():
+            if hasattr(audio_iter, '__aiter__'):
+                async for wav_samples in audio_iter:
+                    await self.decode(wav_samples, False)
+            else:
+                for wav_samples in audio_iter:
+                    await self.decode(wav_samples, False)
+            await self.decode(b'', True)
+
+        feed_task = loop.create_task(feed())
+        feed_task.add_done_callback(lambda task: self._changed.set())  # Wake up to notice any feeding error
+        try:
+            async for result in self._results(feed_task):
+                yield result
+        finally:
+            if not feed_task.done():
+                feed_task.cancel()
+            try:
+                await feed_task
+            except asyncio.CancelledError:
+                pass
+
+    async def reset(self):
+        """ Reset the decoder for decoding a new utterance. Returns the stats dict for the previous utterance. """
+        loop = self._ensure_loop()
+        return await loop.run_in_executor(self._executor, self._decoder.reset)
+
+    def close(self):
+        """ Stop delivering result notifications to the event loop. """
+        self._decoder.set_result_callback(None)
+        self._loop = None
@@ -0,0 +1,265 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+"""
+Audio front end: streaming readers for WAV, FLAC, and raw PCM files, plus channel mixing/selection and resampling, converting audio in chunks to the mono int16 samples the model expects.
+FLAC (and WAV encodings the stdlib `wave` module can't read) requires the optional `soundfile` package.
+"""
+
+import math, os, wave
+
+import numpy as np
+
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_CHUNK_MS = 1000
+AUDIO_EXTENSIONS = ('.wav', '.flac')
+RAW_EXTENSIONS = ('.raw', '.pcm')
+
+
+class AudioReader(object):
+    """ Base class for streaming readers, which yield blocks of float32 samples (shape [frames, channels], scaled to [-1, 1)) without reading the whole file. """
+
+    sample_rate = None
+    channels = None
+    frames = None  # Total frames, if known
+
+    def blocks(self, block_frames):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def duration(self):
+        return (self.frames / self.sample_rate) if self.frames is not None else None
+
+
+class WavReader(AudioReader):
+    """ Reads integer PCM WAV files (8, 16, 24, or 32 bit) with the stdlib `wave` module. """
+
+    def __init__(self, path):
+        self._file = wave.open(path, 'rb')
+        self.sample_rate = self._file.getframerate()
+        self.channels = self._file.getnchannels()
+        self.frames = self._file.getnframes()
+        self._sample_width = self._file.getsampwidth()
+        if self._sample_width not in (1, 2, 3, 4):
+            self._file.close()
+            raise ValueError("unsupported WAV sample width: %d bytes" % self._sample_width)
+
+    def blocks(self, block_frames):
+        while True:
+            data = self._file.readframes(block_frames)
+            if not data:
+                break
+            yield pcm_to_float(data, self._sample_width).reshape(-1, self.channels)
+
+    def close(self):
+        self._file.close()
+
+
+class SoundFileReader(AudioReader):
+    """ Reads any format supported by the optional `soundfile` package (libsndfile), including FLAC. """
+
+    def __init__(self, path):
+        try:
+            import soundfile
+        except ImportError:
+            raise ImportError("reading %r requires the soundfile package (pip install soundfile)" % path)
+        self._file = soundfile.SoundFile(path, 'r')
+        self.sample_rate = self._file.samplerate
+        self.channels = self._file.channels
+        self.frames = self._file.frames
+
+    def blocks(self, block_frames):
+        for block in self._file.blocks(block_frames, dtype='float32', always_2d=True):
+            yield block
+
+    def close(self):
+        self._file.close()
+
+
+class RawReader(AudioReader):
+    """ Reads headerless PCM files of interleaved samples of the given numpy dtype (for example '<i2' for 16 bit little-endian, or '<f4' for float). """
+
+    def __init__(self, path, sample_rate, channels=1, dtype='<i2'):
+        self._file = open(path, 'rb')
+        self._dtype = np.dtype(dtype)
+        if self._dtype.kind not in 'iuf':
+            self._file.close()
+            raise ValueError("unsupported raw PCM dtype: %s" % dtype)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = os.fstat(self._file.fileno()).st_size // (self._dtype.itemsize * channels)
+
+    def blocks(self, block_frames):
+        frame_bytes = self._dtype.itemsize * self.channels
+        while True:
+            data = self._file.read(block_frames * frame_bytes)
+            data = data[:len(data) - len(data) % frame_bytes]
+            if not data:
+                break
+            samples = np.frombuffer(data, self._dtype)
+            if self._dtype.kind == 'f':
+                samples = samples.astype(np.float32)
+            elif self._dtype.kind == 'u':
+                samples = (samples.astype(np.float32) - 2 ** (8 * self._dtype.itemsize - 1)) / 2 ** (8 * self._dtype.itemsize - 1)
+            else:
+                samples = samples.astype(np.float32) / 2 ** (8 * self._dtype.itemsize - 1)
+            yield samples.reshape(-1, self.channels)
+
+    def close(self):
+        self._file.close()
+
+
+def pcm_to_float(data, sample_width):
+    """ Convert little-endian integer PCM bytes (as stored in WAV files; 8 bit is unsigned) to float32 samples in [-1, 1). """
+    if sample_width == 1:
+        return (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+    if sample_width == 3:
+        # Widen 24 bit samples to 32 bit by placing them in the upper 3 bytes.
+        raw = np.frombuffer(data, np.uint8).reshape(-1, 3)
+        wide = np.zeros((len(raw), 4), np.uint8)
+        wide[:, 1:] = raw
+        return wide.view('<i4').ravel().astype(np.float32) / 2 ** 31
+    dtype = dict([(2, '<i2'), (4, '<i4')])[sample_width]
+    return np.frombuffer(data, dtype).astype(np.float32) / 2 ** (8 * sample_width - 1)
+
+
+def open_audio(path, raw_sample_rate=None, raw_channels=1, raw_dtype='<i2'):
+    """
+    Open a streaming AudioReader for the given file, chosen by extension: WAV (falling back to soundfile for encodings `wave` can't read), raw PCM (.raw/.pcm, or any file if raw_sample_rate is given), or anything else soundfile supports (such as FLAC).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if raw_sample_rate is not None or extension in RAW_EXTENSIONS:
+        if raw_sample_rate is None:
+            raise ValueError("reading raw PCM file %r requires raw_sample_rate" % path)
+        return RawReader(path, raw_sample_rate, channels=raw_channels, dtype=raw_dtype)
+    if extension == '.wav':
+        try:
+            return WavReader(path)
+        except (wave.Error, ValueError):
+            return SoundFileReader(path)  # For example float or WAVE_FORMAT_EXTENSIBLE
+    return SoundFileReader(path)
+
+
+def mix_channels(samples, channel=None):
+    """ Convert samples of shape [frames, channels] to mono, either selecting the given channel index or averaging all channels if channel is None. """
+    if samples.ndim == 1:
+        return samples
+    if channel is not None:
+        if not -samples.shape[1] <= channel < samples.shape[1]:
+            raise ValueError("channel %d out of range for audio with %d channels" % (channel, samples.shape[1]))
+        return samples[:, channel]
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+class Resampler(object):
+    """
+    Streaming windowed-sinc resampler between any two integer sample rates, vectorized with numpy.
+    Since the ratio is rational (up/down), the filter taps repeat with period up, so they are precomputed once per phase; each output sample is then a dot product of the input window around it with its phase's taps.
+    Input history is carried between calls to process(), so chunked output is identical to resampling all at once.
+    """
+
+    def __init__(self, from_rate, to_rate, zero_crossings=16, block_size=8192):
+        if from_rate <= 0 or to_rate <= 0:
+            raise ValueError("sample rates must be positive")
+        divisor = math.gcd(int(from_rate), int(to_rate))
+        self.up, self.down = int(to_rate) // divisor, int(from_rate) // divisor
+        self.block_size = block_size
+        # Low-pass at the lower of the two Nyquist frequencies, so downsampling doesn't alias.
+        scale = min(1.0, self.up / self.down)
+        self._half_width = int(math.ceil(zero_crossings / scale))
+        self._offsets = np.arange(-self._half_width + 1, self._half_width + 1)
+        distances = (np.arange(self.up) / self.up)[:, None] - self._offsets[None, :]
+        window = 0.5 + 0.5 * np.cos(np.pi * np.clip(distances / self._half_width, -1, 1))
+        self._taps = (scale * np.sinc(scale * distances) * window).astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        # The buffer starts with zeros standing in for the input before the first sample.
+        self._buffer = np.zeros(self._half_width - 1, np.float32)
+        self._buffer_start = -(self._half_width - 1)  # Input index of _buffer[0]
+        self._input_len = 0
+        self._output_len = 0
+
+    def process(self, samples, final=False):
+        """ Resample the next chunk of 1-D float samples, returning as many output samples as can be computed so far (or all remaining ones, if final). """
+        samples = np.asarray(samples, np.float32)
+        if self.up == self.down:
+            return samples
+        self._input_len += len(samples)
+        buffer = np.concatenate((self._buffer, samples))
+        if final:
+            # Produce outputs up to the end of the input, treating the input after it as zeros.
+            output_end = -(-self._input_len * self.up // self.down)
+            buffer = np.concatenate((buffer, np.zeros(self._half_width, np.float32)))
+        else:
+            # Produce outputs whose whole input window has arrived.
+            last_base = self._input_len - 1 - self._half_width
+            output_end = (last_base * self.up) // self.down + 1 if last_base >= 0 else 0
+        outputs = []
+        for block_start in range(self._output_len, output_end, self.block_size):
+            positions = np.arange(block_start, min(block_start + self.block_size, output_end), dtype=np.int64) * self.down
+            bases, phases = np.divmod(positions, self.up)
+            windows = buffer[bases[:, None] + self._offsets[None, :] - self._buffer_start]
+            outputs.append(np.einsum('ij,ij->i', windows, self._taps[phases]))
+        if final:
+            self.reset()
+        else:
+            # Keep only the input still needed by the next output's window.
+            self._output_len = max(self._output_len, output_end)
+            keep_start = (self._output_len * self.down) // self.up + self._offsets[0]
+            self._buffer = buffer[keep_start - self._buffer_start:]
+            self._buffer_start = keep_start
+        return np.concatenate(outputs) if outputs else np.zeros(0, np.float32)
+
+
+def resample(samples, from_rate, to_rate):
+    """ Resample a whole 1-D array of float samples at once. """
+    return Resampler(from_rate, to_rate).process(samples, final=True)
+
+
+def float_to_int16(samples):
+    """ Convert float samples in [-1, 1) to int16, clipping any that overflow. """
+    return np.clip(np.rint(samples * 32768), -32768, 32767).astype(np.int16)
+
+
+def read_audio_chunks(path, sample_rate=DEFAULT_SAMPLE_RATE, channel=None, chunk_ms=DEFAULT_CHUNK_MS, **open_kwargs):
+    """
+    Stream an audio file as chunks of mono int16 samples at sample_rate (about chunk_ms each), ready to pass to a model or decoder, without reading the whole file into memory.
+    Multi-channel audio is averaged to mono, unless channel selects a single channel index. open_kwargs are passed to open_audio(), for reading raw PCM.
+    """
+    with open_audio(path, **open_kwargs) as reader:
+        resampler = Resampler(reader.sample_rate, sample_rate)
+        block_frames = max(1, reader.sample_rate * chunk_ms // 1000)
+        for block in reader.blocks(block_frames):
+            chunk = resampler.process(mix_channels(block, channel))
+            if len(chunk):
+                yield float_to_int16(chunk)
+        chunk = resampler.process(np.zeros(0, np.float32), final=True)
+        if len(chunk):
+            yield float_to_int16(chunk)
+
+
+def read_audio(path, sample_rate=DEFAULT_SAMPLE_RATE, channel=None, **open_kwargs):
+    """ Read a whole audio file as mono int16 samples at sample_rate, converting it chunk by chunk. """
+    chunks = list(read_audio_chunks(path, sample_rate=sample_rate, channel=channel, **open_kwargs))
+    return np.concatenate(chunks) if chunks else np.zeros(0, np.int16)
+
+
+def audio_info(path, **open_kwargs):
+    """ Return a dict of the sample_rate, channels, frames, and duration (in seconds) of an audio file, reading only its header. """
+    with open_audio(path, **open_kwargs) as reader:
+        return dict(sample_rate=reader.sample_rate, channels=reader.channels, frames=reader.frames, duration=reader.duration)
@@ -0,0 +1,304 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+"""
+Benchmark suite for offline decoding, streaming decoding, and CLI corpus throughput, sweeping model variant (float or int8-quantized), configuration, and concurrency.
+If reference transcripts are given, each case also reports its word error rate, so the accuracy cost of a variant or configuration can be weighed against its speed.
+
+Each benchmark case runs in a fresh process, so its model load time and peak RSS are measured independently of the others. Results are reported as JSON, for comparison across builds.
+"""
+
+import concurrent.futures, datetime, hashlib, itertools, json, multiprocessing, os, platform, subprocess, sys, tempfile, threading, time
+
+import numpy as np
+
+from . import _name, __version__
+from .audio import DEFAULT_SAMPLE_RATE, read_audio
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+MODES = ('offline', 'streaming', 'cli')
+VARIANTS = ('float', 'quantized')
+
+def percentiles(values, points=(50, 90, 99)):
+    """ Return a dict of the given percentiles of values (plus the max), or None if there are no values. """
+    if not len(values):
+        return None
+    summary = {'p%d' % point: round(float(np.percentile(values, point)), 3) for point in points}
+    summary['max'] = round(float(np.max(values)), 3)
+    return summary
+
+def peak_rss_mb(children=False):
+    """ Return the peak resident set size of this process (or of its terminated children) in MB, or None if unavailable. """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return round(max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)  # Bytes on macOS, KB elsewhere
+
+def word_errors(reference, hypothesis):
+    """ Return the word-level edit distance (substitutions, insertions, and deletions) between reference and hypothesis texts, compared case-insensitively. """
+    reference, hypothesis = reference.lower().split(), hypothesis.lower().split()
+    distances = list(range(len(hypothesis) + 1))
+    for i, reference_word in enumerate(reference, 1):
+        previous_diagonal, distances[0] = distances[0], i
+        for j, hypothesis_word in enumerate(hypothesis, 1):
+            previous_diagonal, distances[j] = distances[j], min(distances[j] + 1, distances[j-1] + 1, previous_diagonal + (reference_word != hypothesis_word))
+    return distances[-1]
+
+def score_texts(references, texts):
+    """ Return a dict of word error rate (plus total errors and reference words) for the given decoded texts, keyed like references (dicts of path to text), or None without references. """
+    if not references:
+        return None
+    errors = words = 0
+    for path, text in texts.items():
+        if path in references:
+            errors += word_errors(references[path], text)
+            words += len(references[path].split())
+    return dict(wer=round(errors / words, 4) if words else None, errors=errors, words=words)
+
+def load_references(wav_paths, references_path=None):
+    """
+    Return a dict of reference transcripts for the given audio files: from references_path (lines of an utterance id, which is the file name without extension, then its text, as in a Kaldi `text` file) if given, otherwise from a .txt file alongside each audio file, where present.
+    """
+    references = dict()
+    if references_path is not None:
+        with open(references_path, 'r', encoding='utf-8') as f:
+            texts = dict((line.split(None, 1) + [''])[:2] for line in f if line.strip())
+        for path in wav_paths:
+            utterance_id = os.path.splitext(os.path.basename(path))[0]
+            if utterance_id in texts:
+                references[path] = texts[utterance_id].strip()
+    else:
+        for path in wav_paths:
+            text_path = os.path.splitext(path)[0] + '.txt'
+            if os.path.exists(text_path):
+                with open(text_path, 'r', encoding='utf-8') as f:
+                    references[path] = f.read().strip()
+    return references
+
+def read_wav(path, sample_rate=DEFAULT_SAMPLE_RATE):
+    return read_audio(path, sample_rate=sample_rate), sample_rate
+
+def build_info():
+    """ Return a dict identifying the build and machine being benchmarked. """
+    from .wrapper import _library_binary_path
+    info = dict(version=__version__, library=_library_binary_path, python=platform.python_version(), platform=platform.platform(),
+        machine=platform.machine(), cpu_count=os.cpu_count(), timestamp=datetime.datetime.now().isoformat(timespec='seconds'))
+    if os.path.exists(_library_binary_path):
+        with open(_library_binary_path, 'rb') as f:
+            info['library_sha256'] = hashlib.sha256(f.read()).hexdigest()
+    return info
+
+def load_model(model_dir, config, variant='float'):
+    from .wrapper import WenetSTTModel
+    start = time.perf_counter()
+    model = WenetSTTModel(WenetSTTModel.build_config(model_dir, config=dict(config, model_cache=False), quantized=(variant == 'quantized')))
+    load_ms = (time.perf_counter() - start) * 1000
+    return model, dict(load_ms=round(load_ms, 1), load_timings=model.get_load_timings())
+
+def bench_offline(model_dir, wav_paths, config, variant='float', concurrency=1, repeats=1, references=None):
+    """ Decode each WAV file repeats times with WenetSTTModel.decode(), on concurrency threads sharing one model. """
+    model, result = load_model(model_dir, config, variant=variant)
+    utterances = [(path,) + read_wav(path) for path in wav_paths] * repeats
+    latencies, rtfs = [], []
+    texts = dict()
+    def decode(utterance):
+        path, wav_samples, sample_rate = utterance
+        start = time.perf_counter()
+        texts[path] = model.decode(wav_samples)
+        elapsed = time.perf_counter() - start
+        latencies.append(elapsed * 1000)
+        rtfs.append(elapsed / (len(wav_samples) / sample_rate))
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(decode, utterances))
+    elapsed = time.perf_counter() - start
+    audio_seconds = sum(len(wav_samples) / sample_rate for path, wav_samples, sample_rate in utterances)
+    result.update(utterances=len(utterances), audio_seconds=round(audio_seconds, 3), wall_seconds=round(elapsed, 3),
+        rtf=round(elapsed / audio_seconds, 4), utterance_rtf=percentiles(rtfs), utterance_latency_ms=percentiles(latencies),
+        accuracy=score_texts(references, texts), metrics=model.get_metrics())
+    return result
+
+def bench_streaming(model_dir, wav_paths, config, variant='float', concurrency=1, chunk_ms=100, speed=0, references=None):
+    """
+    Stream each WAV file through its own WenetSTTDecoder, with concurrency streams at once sharing one model, feeding chunk_ms chunks at speed times real time (or as fast as possible if 0).
+    Reports per-chunk latency (from the audio being fed until the chunk decoding it completes), first partial result latency, and final result latency.
+    """
+    from .wrapper import WenetSTTDecoder
+    model, result = load_model(model_dir, config, variant=variant)
+    utterances = [(path,) + read_wav(path) for path in wav_paths]
+    chunk_latencies, first_partial_latencies, final_latencies = [], [], []
+    texts = dict()
+    lock = threading.Lock()
+
+    def stream(path, wav_samples, sample_rate):
+        decoder = WenetSTTDecoder(model)
+        first_partial = []
+        decoder.set_result_callback(lambda final: first_partial or first_partial.append(time.perf_counter()))
+        chunk_len = max(1, sample_rate * chunk_ms // 1000)
+        chunks = [wav_samples[i:i+chunk_len] for i in range(0, len(wav_samples), chunk_len)] or [wav_samples]
+        start = time.perf_counter()
+        for i, chunk in enumerate(chunks):
+            if speed > 0:
+                # Feed at the given pace, catching up rather than drifting if we fall behind.
+                delay = start + i * chunk_ms / 1000 / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            decoder.decode(chunk, i == len(chunks) - 1)
+        finalized = time.perf_counter()
+        text, final = decoder.get_result(True)
+        final_latency = (time.perf_counter() - finalized) * 1000
+        stats = decoder.get_stats()
+        decoder.set_result_callback(None)
+        with lock:
+            chunk_latencies.extend(stats['chunk_latency_ms'])
+            final_latencies.append(final_latency)
+            texts[path] = text
+            if first_partial:
+                first_partial_latencies.append((first_partial[0] - start) * 1000)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(stream, *utterance) for utterance in utterances for _ in range(concurrency)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    audio_seconds = concurrency * sum(len(wav_samples) / sample_rate for path, wav_samples, sample_rate in utterances)
+    result.update(streams=len(futures), audio_seconds=round(audio_seconds, 3), wall_seconds=round(elapsed, 3), rtf=round(elapsed / audio_seconds, 4),
+        chunk_latency_ms=percentiles(chunk_latencies), first_partial_latency_ms=percentiles(first_partial_latencies), final_latency_ms=percentiles(final_latencies),
+        accuracy=score_texts(references, texts), scheduler_stats=model.get_scheduler_stats(), metrics=model.get_metrics())
+    return result
+
+def bench_cli(model_dir, wav_paths, config, variant='float', concurrency=1, references=None):
+    """ Decode all WAV files with the `decode` CLI subcommand, using concurrency jobs. """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, 'output.jsonl')
+        command = [sys.executable, '-m', _name, 'decode', model_dir] + list(wav_paths) + ['--jobs', str(concurrency), '--output', output_path]
+        if 'num_threads' in config:
+            command += ['--threads-per-job', str(config['num_threads'])]
+        if variant == 'quantized':
+            command += ['--quantized']
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        with open(output_path, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+    audio_seconds = sum(record.get('duration', 0) for record in records)
+    return dict(utterances=len(records), errors=sum('error' in record for record in records), audio_seconds=round(audio_seconds, 3),
+        wall_seconds=round(elapsed, 3), rtf=round(elapsed / audio_seconds, 4) if audio_seconds else None,
+        decode_rtf=percentiles([record['rtf'] for record in records if record.get('rtf') is not None]),
+        accuracy=score_texts(references, {record['path']: record['text'] for record in records if 'text' in record}))
+
+def run_case(case):
+    """ Run a single benchmark case (as produced by expand_cases()), returning its result dict. """
+    mode, model_dir, wav_paths, config = case['mode'], case['model_dir'], case['wav_paths'], case['config']
+    variant, references = case.get('variant', 'float'), case.get('references')
+    if mode == 'offline':
+        result = bench_offline(model_dir, wav_paths, config, variant=variant, concurrency=case['concurrency'], repeats=case['repeats'], references=references)
+    elif mode == 'streaming':
+        result = bench_streaming(model_dir, wav_paths, config, variant=variant, concurrency=case['concurrency'], chunk_ms=case['chunk_ms'], speed=case['speed'], references=references)
+    elif mode == 'cli':
+        result = bench_cli(model_dir, wav_paths, config, variant=variant, concurrency=case['concurrency'], references=references)
+    else:
+        raise ValueError("unknown benchmark mode: %r" % mode)
+    result['peak_rss_mb'] = peak_rss_mb(children=(mode == 'cli'))
+    return dict({key: value for key, value in case.items() if key not in ('model_dir', 'wav_paths', 'references')}, **result)
+
+def expand_cases(model_dir, wav_paths, modes=MODES, variants=('float',), num_threads=(1,), chunk_sizes=(16,), beam_sizes=(10,), concurrency=(1,), decoder_threads=0,
+        inter_op_threads=None, cpu_affinity=None, repeats=1, chunk_ms=100, speed=0, references=None):
+    """
+    Return the list of benchmark cases for the cartesian product of the given sweeps. The CLI only sweeps variants, num_threads, and concurrency.
+    inter_op_threads and cpu_affinity apply to every case (except CLI ones). references (a dict of path to transcript) are used to score each case's accuracy.
+    """
+    cases = []
+    for mode, variant in itertools.product(modes, variants):
+        if mode == 'cli':
+            sweep = itertools.product(num_threads, [None], [None], concurrency)
+        else:
+            sweep = itertools.product(num_threads, chunk_sizes, beam_sizes, concurrency)
+        for threads, chunk_size, beam_size, streams in sweep:
+            if mode == 'streaming' and chunk_size <= 0:
+                continue  # Streaming requires a positive chunk size
+            config = dict(num_threads=threads)
+            if mode != 'cli':
+                if inter_op_threads:
+                    config['inter_op_threads'] = inter_op_threads
+                if cpu_affinity:
+                    config['cpu_affinity'] = list(cpu_affinity)
+            if chunk_size is not None:
+                config['chunk_size'] = chunk_size
+            if beam_size is not None:
+                config.update(first_beam_size=beam_size, second_beam_size=beam_size)
+            if mode == 'streaming' and decoder_threads:
+                config['decoder_threads'] = decoder_threads
+            case = dict(mode=mode, variant=variant, model_dir=model_dir, wav_paths=wav_paths, config=config, concurrency=streams, references=references)
+            if mode == 'offline':
+                case['repeats'] = repeats
+            elif mode == 'streaming':
+                case.update(chunk_ms=chunk_ms, speed=speed)
+            cases.append(case)
+    return cases
+
+def run_benchmarks(cases, isolate=True):
+    """ Run the given benchmark cases, each in a fresh process if isolate, yielding each result dict as it completes. """
+    for case in cases:
+        if isolate:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                yield executor.submit(run_case, case).result()
+        else:
+            yield run_case(case)
+
+def format_result(result):
+    """ Return a one-line human-readable summary of a benchmark result. """
+    def latency(name):
+        summary = result.get(name)
+        return '%7.1f/%7.1f' % (summary['p50'], summary['p99']) if summary else '%15s' % '-'
+    accuracy = result.get('accuracy')
+    return '%-9s %-9s %-60s %4d  load %8.1fms  rss %7.1fMB  rtf %7.4f  wer %6s  chunk p50/p99 %s  final p50/p99 %s' % (
+        result['mode'], result.get('variant', 'float'), json.dumps(result['config'], sort_keys=True), result['concurrency'], result.get('load_ms', float('nan')),
+        result['peak_rss_mb'] or float('nan'), result['rtf'] or float('nan'), '%.4f' % accuracy['wer'] if accuracy and accuracy['wer'] is not None else '-',
+        latency('chunk_latency_ms'), latency('final_latency_ms'))
+
+def add_arguments(parser):
+    parser.add_argument('model_dir', help='Model directory to use')
+    parser.add_argument('wav_file', nargs='+', help='WAV file(s) to decode, or directories to search for WAV files')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='What to benchmark')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=['float'], help='Model variants to sweep (quantized requires running `quantize` first)')
+    parser.add_argument('--references', help='Reference transcripts to score accuracy against, as lines of utterance id (file name without extension) and text (default: a .txt file alongside each audio file)')
+    parser.add_argument('--num-threads', type=int, nargs='+', default=[1], help='num_threads (intra-op) values to sweep')
+    parser.add_argument('--inter-op-threads', type=int, help='inter_op_threads for every case')
+    parser.add_argument('--cpu-affinity', type=int, nargs='+', help='CPU ids to run decoding threads on for every case (Linux only)')
+    parser.add_argument('--chunk-size', type=int, nargs='+', default=[16], help='chunk_size values to sweep (<= 0 for full attention, offline only)')
+    parser.add_argument('--beam-size', type=int, nargs='+', default=[10], help='CTC prefix beam search beam sizes to sweep')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1], help='Concurrent decodes/streams/jobs to sweep')
+    parser.add_argument('--decoder-threads', type=int, default=0, help='Use a shared decoder thread pool of this size for streaming')
+    parser.add_argument('--repeats', type=int, default=1, help='Times to decode each file offline')
+    parser.add_argument('--chunk-ms', type=int, default=100, help='Audio chunk size fed to streaming decoders')
+    parser.add_argument('--speed', type=float, default=0, help='Streaming feeding speed relative to real time (0 for as fast as possible)')
+    parser.add_argument('--no-isolate', action='store_true', help='Run all cases in this process, rather than each in a fresh one (load time and RSS are then not independent)')
+    parser.add_argument('--output', help='Write the JSON report to this file, rather than stdout')
+
+def run(args):
+    from .corpus import find_audio_files
+    wav_paths = [os.path.abspath(path) for path in find_audio_files(args.wav_file)]
+    references = load_references(wav_paths, args.references)
+    cases = expand_cases(os.path.abspath(args.model_dir), wav_paths, modes=args.modes, variants=args.variants, num_threads=args.num_threads, chunk_sizes=args.chunk_size,
+        beam_sizes=args.beam_size, concurrency=args.concurrency, decoder_threads=args.decoder_threads, inter_op_threads=args.inter_op_threads,
+        cpu_affinity=args.cpu_affinity, repeats=args.repeats, chunk_ms=args.chunk_ms, speed=args.speed, references=references)
+    report = dict(build=build_info(), wav_files=wav_paths, references=len(references), results=[])
+    for result in run_benchmarks(cases, isolate=not args.no_isolate):
+        print(format_result(result), file=sys.stderr, flush=True)
+        report['results'].append(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return report
@@ -0,0 +1,102 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+import concurrent.futures, json, os, time
+
+import numpy as np
+
+from .audio import AUDIO_EXTENSIONS, audio_info, read_audio_chunks
+from .wrapper import WenetSTTDecoder
+
+def find_audio_files(inputs, file_list=None, extensions=AUDIO_EXTENSIONS):
+    """ Expand the given files and directories (searched recursively for files with the given extensions), plus any paths listed one per line in file_list, into a list of audio file paths. """
+    paths = []
+    if file_list is not None:
+        with open(file_list, 'r', encoding='utf-8') as f:
+            inputs = list(inputs) + [line.strip() for line in f if line.strip()]
+    for path in inputs:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames) if filename.lower().endswith(tuple(extensions)))
+        else:
+            paths.append(path)
+    return paths
+
+def read_completed_paths(output_path):
+    """ Return the set of paths successfully decoded in a previous run's JSONL output file, ignoring a truncated last line. """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'text' in record:
+                completed.add(record['path'])
+    return completed
+
+def decode_audio(model, path, channel=None, streaming=False, audio_options=None):
+    """
+    Decode one channel (or the mix of all channels, if channel is None) of an audio file, converted to the model's sample rate as it is read. Returns (text, number of samples decoded).
+    If streaming, feed it chunk by chunk through a decoder (which should use a continuous model, joining its segments), so the whole file is never held in memory.
+    """
+    chunks = read_audio_chunks(path, sample_rate=model.sample_rate, channel=channel, **(audio_options or {}))
+    if not streaming:
+        chunks = list(chunks)
+        return model.decode(np.concatenate(chunks) if chunks else np.zeros(0, np.int16)), sum(len(chunk) for chunk in chunks)
+    decoder = WenetSTTDecoder(model)
+    num_samples = 0
+    for chunk in chunks:
+        decoder.decode(chunk, False)
+        num_samples += len(chunk)
+    decoder.decode(b'', True)
+    decoder.get_result(True)
+    return ' '.join(segment['text'] for segment in decoder.get_segments() if segment['text']), num_samples
+
+def decode_file(model, path, channel=None, streaming=False, audio_options=None):
+    """
+    Decode a single audio file, returning a result record dict including timing information.
+    If channel is 'all', decode each channel separately, and the record's text is a list of texts per channel.
+    """
+    start = time.perf_counter()
+    try:
+        if channel == 'all':
+            channels = audio_info(path, **(audio_options or {}))['channels']
+            results = [decode_audio(model, path, channel=index, streaming=streaming, audio_options=audio_options) for index in range(channels)]
+            text = [text for text, num_samples in results]
+            num_samples = max([num_samples for text, num_samples in results] or [0])
+        else:
+            text, num_samples = decode_audio(model, path, channel=channel, streaming=streaming, audio_options=audio_options)
+    except Exception as e:
+        return dict(path=path, error='%s: %s' % (type(e).__name__, e))
+    decode_time = time.perf_counter() - start
+    duration = num_samples / model.sample_rate
+    return dict(path=path, text=text, duration=round(duration, 3), decode_time=round(decode_time, 4),
+        rtf=round(decode_time / duration, 4) if duration else None)
+
+def decode_files(model, paths, jobs=1, **kwargs):
+    """
+    Decode the given audio files on a pool of jobs worker threads all sharing the given model, yielding (index, result record) as each file completes, where index is the file's position in paths (which may repeat a path).
+    kwargs are passed to decode_file().
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Keep only a bounded number of files in flight, so huge corpora don't queue up all at once.
+        paths = enumerate(paths)
+        futures = dict()
+        for index, path in paths:
+            futures[executor.submit(decode_file, model, path, **kwargs)] = index
+            if len(futures) >= 2 * jobs:
+                break
+        while futures:
+            done, pending = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield futures.pop(future), future.result()
+                index, path = next(paths, (None, None))
+                if path is not None:
+                    futures[executor.submit(decode_file, model, path, **kwargs)] = index
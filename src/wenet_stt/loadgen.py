@@ -0,0 +1,220 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+"""
+Load generator for the decode server (`python -m wenet_stt serve`): streams audio files to it over concurrent keep-alive connections, paced relative to real time, and reports throughput, latency percentiles, and rejections as JSON.
+"""
+
+import asyncio, json, sys, time, urllib.parse
+
+import numpy as np
+
+from .audio import read_audio
+from .benchmark import percentiles
+
+
+class HttpConnection(object):
+    """ Minimal HTTP/1.1 client connection, reused across requests while the server keeps it alive. """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = self._writer = None
+        self.connects = 0
+
+    async def _connect(self):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            self.connects += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def request(self, method, path, body_chunks=None, on_line=None):
+        """
+        Send a request, streaming body_chunks (an iterable or async iterable of bytes) with chunked transfer encoding, while concurrently reading the response.
+        Returns (status, headers, body). If on_line is given, it is called with each line of the response body as it arrives.
+        """
+        await self._connect()
+        head = ['%s %s HTTP/1.1' % (method, path), 'Host: %s:%d' % (self.host, self.port)]
+        if body_chunks is not None:
+            head.append('Transfer-Encoding: chunked')
+        self._writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        response_task = asyncio.get_running_loop().create_task(self._read_response(on_line))
+        try:
+            if body_chunks is not None:
+                await self._send_body(body_chunks, response_task)
+            await self._writer.drain()
+            status, headers, body = await response_task
+        except BaseException:
+            response_task.cancel()
+            self.close()
+            raise
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, headers, body
+
+    async def _send_body(self, body_chunks, response_task):
+        async def send(data):
+            if data:
+                self._writer.write(b'%x\r\n' % len(data) + data + b'\r\n')
+                await self._writer.drain()
+        try:
+            if hasattr(body_chunks, '__aiter__'):
+                async for data in body_chunks:
+                    if response_task.done():
+                        return  # Server responded early (e.g. rejected), so stop sending
+                    await send(data)
+            else:
+                for data in body_chunks:
+                    if response_task.done():
+                        return
+                    await send(data)
+            self._writer.write(b'0\r\n\r\n')
+        except ConnectionError:
+            if not response_task.done():
+                raise
+
+    async def _read_response(self, on_line):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = dict()
+        while True:
+            line = (await self._reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if status == 100:
+            return await self._read_response(on_line)
+        body = b''
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            pending = b''
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                data = await self._reader.readexactly(size)
+                await self._reader.readexactly(2)
+                body += data
+                pending += data
+                while on_line is not None and b'\n' in pending:
+                    line, pending = pending.split(b'\n', 1)
+                    on_line(line)
+        else:
+            body = await self._reader.readexactly(int(headers.get('content-length', 0)))
+            if on_line is not None:
+                for line in body.splitlines():
+                    on_line(line)
+        return status, headers, body
+
+
+async def stream_audio(wav_samples, sample_rate, chunk_ms, speed):
+    """ Asynchronously yield int16 PCM byte blocks of chunk_ms, at speed times real time (or as fast as possible if 0). """
+    chunk_len = max(1, sample_rate * chunk_ms // 1000)
+    start = time.perf_counter()
+    for i, offset in enumerate(range(0, len(wav_samples), chunk_len)):
+        if speed > 0:
+            delay = start + i * chunk_ms / 1000 / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield wav_samples[offset:offset + chunk_len].astype('<i2').tobytes()
+
+
+async def run_load(host, port, utterances, sample_rate=16000, concurrency=1, requests=None, chunk_ms=100, speed=1.0, partial=False, context=None):
+    """
+    Decode the given utterances (int16 sample arrays) through the server at host:port, with concurrency workers each reusing one connection, for the given total number of requests (default: each utterance once).
+    Returns a report dict of counts, throughput, latency percentiles (final: from the end of audio until the final result; first partial: from the start of audio), and the server's metrics afterward.
+    """
+    requests = len(utterances) if requests is None else requests
+    query = [('sample_rate', sample_rate)] + ([('partial', 1)] if partial else []) + [('context', phrase) for phrase in (context or ())]
+    path = '/decode?' + urllib.parse.urlencode(query)
+    next_request = iter(range(requests))
+    records = []
+    connections = []
+
+    async def worker():
+        connection = HttpConnection(host, port)
+        connections.append(connection)
+        for index in next_request:
+            wav_samples = utterances[index % len(utterances)]
+            record = dict(audio_s=len(wav_samples) / sample_rate)
+            start = time.perf_counter()
+            sent = []
+
+            async def body():
+                async for data in stream_audio(wav_samples, sample_rate, chunk_ms, speed):
+                    yield data
+                sent.append(time.perf_counter())
+
+            def on_line(line):
+                if 'first_partial_ms' not in record and line.strip():
+                    record['first_partial_ms'] = (time.perf_counter() - start) * 1000
+
+            try:
+                status, headers, response_body = await connection.request('POST', path, body(), on_line=on_line if partial else None)
+                record['status'] = status
+                if status == 200:
+                    record['text'] = json.loads(response_body.splitlines()[-1])['text']
+                    record['final_ms'] = (time.perf_counter() - sent[0]) * 1000 if sent else None
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                record['error'] = '%s: %s' % (type(e).__name__, e)
+            records.append(record)
+        connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    metrics_connection = HttpConnection(host, port)
+    status, headers, body = await metrics_connection.request('GET', '/metrics')
+    metrics_connection.close()
+    succeeded = [record for record in records if record.get('status') == 200]
+    audio_seconds = sum(record['audio_s'] for record in succeeded)
+    return dict(
+        requests=len(records),
+        succeeded=len(succeeded),
+        rejected=sum(record.get('status') == 503 for record in records),
+        errors=sum('error' in record or record.get('status') not in (200, 503) for record in records),
+        connections=sum(connection.connects for connection in connections),
+        audio_seconds=round(audio_seconds, 3),
+        wall_seconds=round(elapsed, 3),
+        throughput=round(audio_seconds / elapsed, 3) if elapsed else None,  # Seconds of audio decoded per second
+        final_latency_ms=percentiles([record['final_ms'] for record in succeeded if record.get('final_ms') is not None]),
+        first_partial_latency_ms=percentiles([record['first_partial_ms'] for record in succeeded if 'first_partial_ms' in record]),
+        texts=sorted(set(record['text'] for record in succeeded)),
+        server_metrics=json.loads(body) if status == 200 else None,
+    )
+
+
+def add_arguments(parser):
+    parser.add_argument('wav_file', nargs='+', help='Audio file(s) to send, or directories to search for WAV/FLAC files')
+    parser.add_argument('--url', default='http://127.0.0.1:8086', help='Server to load')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent streams, each over its own reused connection')
+    parser.add_argument('--requests', type=int, help='Total requests to send (default: each file once per stream)')
+    parser.add_argument('--chunk-ms', type=int, default=100, help='Audio chunk size to send')
+    parser.add_argument('--speed', type=float, default=1.0, help='Sending speed relative to real time (0 for as fast as possible)')
+    parser.add_argument('--sample-rate', type=int, default=16000, help='Sample rate to convert audio to before sending')
+    parser.add_argument('--partial', action='store_true', help='Request streamed partial results, and measure first partial latency')
+    parser.add_argument('--context', nargs='+', help='Phrases to bias decoding toward')
+
+def run(args):
+    from .corpus import find_audio_files
+    url = urllib.parse.urlsplit(args.url)
+    utterances = [read_audio(path, sample_rate=args.sample_rate) for path in find_audio_files(args.wav_file)]
+    if not utterances:
+        raise SystemExit("no audio files to send")
+    requests = args.requests if args.requests is not None else len(utterances) * args.concurrency
+    report = asyncio.run(run_load(url.hostname or '127.0.0.1', url.port or 80, utterances, sample_rate=args.sample_rate, concurrency=args.concurrency,
+        requests=requests, chunk_ms=args.chunk_ms, speed=args.speed, partial=args.partial, context=args.context))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return report
@@ -0,0 +1,132 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+import contextlib, threading, time
+
+from .wrapper import WenetSTTModel, WenetSTTDecoder
+
+class DecoderPool(object):
+    """
+    Pool of pre-warmed streaming decoders for one model, handed out with acquire() (or the decoder() context manager) and returned with release(), which cheaply resets them for the next utterance.
+    Avoids the per-utterance cost of constructing a decoder, for workloads of many short utterances. The pool (and every decoder, even after the pool is closed) keeps the native model alive.
+    """
+
+    def __init__(self, model, size=1, max_size=None, warmup=True):
+        """
+        Pre-warm size decoders. If all are in use, acquire() creates more up to max_size (default: size), and then waits for one to be released.
+        If warmup, decode a short silence with the first decoder, so the first real utterance doesn't pay one-time model initialization costs.
+        """
+        if not isinstance(model, WenetSTTModel):
+            raise TypeError("model must be a WenetSTTModel")
+        if size < 0 or (max_size is not None and max_size < max(size, 1)):
+            raise ValueError("invalid pool size")
+        self.model = model
+        self.max_size = max_size if max_size is not None else max(size, 1)
+        self._condition = threading.Condition()
+        self._idle = [WenetSTTDecoder(model) for _ in range(size)]
+        self._size = size  # Decoders created and not yet destroyed, whether idle or in use
+        self._closed = False
+        self._acquires = self._hits = self._waits = 0
+        self._wait_ms_total = self._wait_ms_max = self._reset_ms_total = 0.0
+        if warmup and self._idle:
+            decoder = self._idle[0]
+            decoder.decode(bytes(model.sample_rate), True)  # Half a second of int16 silence
+            decoder.get_result(True)
+            decoder.reset()
+
+    def acquire(self, timeout=None):
+        """ Return an idle decoder, ready for a new utterance, waiting up to timeout seconds (forever if None) for one to be released if the pool is at max_size. Raises TimeoutError if none became available. """
+        start = time.perf_counter()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("DecoderPool is closed")
+            self._acquires += 1
+            if self._idle:
+                self._hits += 1
+                return self._idle.pop()
+            if self._size < self.max_size:
+                self._size += 1  # Reserve the slot, and construct outside the lock
+                reserved = True
+            else:
+                reserved = False
+                self._waits += 1
+                available = self._condition.wait_for(lambda: self._idle or self._closed, timeout)
+                wait_ms = (time.perf_counter() - start) * 1000
+                self._wait_ms_total += wait_ms
+                self._wait_ms_max = max(self._wait_ms_max, wait_ms)
+                if self._closed:
+                    raise RuntimeError("DecoderPool is closed")
+                if not available:
+                    raise TimeoutError("no decoder available within %s seconds" % timeout)
+                return self._idle.pop()
+        if reserved:
+            try:
+                return WenetSTTDecoder(self.model)
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+
+    def release(self, decoder):
+        """ Reset the given decoder (abandoning any unfinalized utterance) and return it to the pool. Returns the stats dict for its last utterance. """
+        start = time.perf_counter()
+        decoder.set_result_callback(None)
+        try:
+            stats = decoder.reset()
+        except Exception:
+            with self._condition:
+                self._size -= 1  # Drop the broken decoder, freeing its slot
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._reset_ms_total += (time.perf_counter() - start) * 1000
+            if self._closed:
+                self._size -= 1  # Destroyed once dereferenced
+            else:
+                self._idle.append(decoder)
+                self._condition.notify()
+        return stats
+
+    @contextlib.contextmanager
+    def decoder(self, timeout=None):
+        """ Context manager acquiring a decoder, and releasing it back to the pool afterward. """
+        decoder = self.acquire(timeout=timeout)
+        try:
+            yield decoder
+        finally:
+            self.release(decoder)
+
+    def get_stats(self):
+        """ Return a dict of the pool's size (decoders created, idle, and in use), acquires, hit rate (acquires served by an idle decoder without creating or waiting), and waits for a released decoder (count, and total/max ms), plus total ms spent resetting. """
+        with self._condition:
+            return dict(
+                size=self._size,
+                max_size=self.max_size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                acquires=self._acquires,
+                hits=self._hits,
+                hit_rate=(self._hits / self._acquires) if self._acquires else None,
+                waits=self._waits,
+                wait_ms_total=round(self._wait_ms_total, 3),
+                wait_ms_max=round(self._wait_ms_max, 3),
+                reset_ms_total=round(self._reset_ms_total, 3),
+            )
+
+    def close(self):
+        """ Destroy idle decoders, and any in use as they are released. Waiting and future acquires raise RuntimeError. """
+        with self._condition:
+            self._closed = True
+            self._size -= len(self._idle)
+            self._idle = []
+            self._condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
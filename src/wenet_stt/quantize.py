@@ -0,0 +1,64 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+"""
+Converter producing a dynamically int8-quantized variant of a model, for faster decoding on CPU at a small cost in accuracy, selected at load time with `WenetSTTModel.build_config(model_dir, quantized=True)`.
+
+Dynamic quantization has to be applied to the PyTorch model before it is exported to TorchScript, so this needs the model's training checkpoint (for example final.pt from the matching WeNet experiment release) and train.yaml, plus `torch`, `pyyaml`, and the WeNet training package on PYTHONPATH. None of these are needed to decode with the result.
+"""
+
+import os, sys, time
+
+from .wrapper import QUANTIZED_MODEL_FILENAME
+
+def quantize_model(checkpoint_path, train_config_path, output_path, cmvn_path=None, verbose=False):
+    """
+    Load the WeNet model trained with train_config_path from checkpoint_path, quantize the weights of its linear layers to int8 (activations are quantized dynamically, per batch), and save it as a TorchScript runtime model to output_path.
+    cmvn_path overrides the config's (usually relative) cmvn_file. Returns a dict of the input and output sizes in bytes, and the time taken.
+    """
+    try:
+        import torch, yaml
+    except ImportError as e:
+        raise ImportError("quantizing a model requires torch and pyyaml (%s)" % e)
+    try:
+        from wenet.transformer.asr_model import init_asr_model
+    except ImportError as e:
+        raise ImportError("quantizing a model requires the WeNet training package (of the release matching the model, providing wenet.transformer.asr_model.init_asr_model) on PYTHONPATH (%s)" % e)
+
+    start = time.perf_counter()
+    with open(train_config_path, 'r', encoding='utf-8') as f:
+        train_config = yaml.safe_load(f)
+    if cmvn_path is not None:
+        train_config['cmvn_file'] = cmvn_path
+    model = init_asr_model(train_config)
+    model.load_state_dict(torch.load(checkpoint_path, map_location='cpu'), strict=True)  # A checkpoint not matching the config fails, rather than leaving weights uninitialized
+    model.eval()
+    if verbose:
+        print("Quantizing %s..." % checkpoint_path, file=sys.stderr)
+    quantized_model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    script_model = torch.jit.script(quantized_model)
+    temp_path = output_path + '.tmp'
+    script_model.save(temp_path)
+    os.replace(temp_path, output_path)  # Never leave a partial model where it would be loaded
+    result = dict(checkpoint_bytes=os.path.getsize(checkpoint_path), output_bytes=os.path.getsize(output_path), seconds=round(time.perf_counter() - start, 3))
+    if verbose:
+        print("Saved %s (%.1fMB, from %.1fMB checkpoint)" % (output_path, result['output_bytes'] / 1e6, result['checkpoint_bytes'] / 1e6), file=sys.stderr)
+    return result
+
+def add_arguments(parser):
+    parser.add_argument('model_dir', help='Model directory to add the quantized variant to (as %s)' % QUANTIZED_MODEL_FILENAME)
+    parser.add_argument('--checkpoint', required=True, help='Training checkpoint of the model (e.g. final.pt)')
+    parser.add_argument('--train-config', help='Training config of the model (default: train.yaml in model_dir)')
+    parser.add_argument('--cmvn', help='Global CMVN stats file (default: global_cmvn in model_dir, if present, else as in the training config)')
+    parser.add_argument('--output', help='Path to write the quantized model to (default: %s in model_dir)' % QUANTIZED_MODEL_FILENAME)
+
+def run(args):
+    train_config_path = args.train_config or os.path.join(args.model_dir, 'train.yaml')
+    cmvn_path = args.cmvn
+    if cmvn_path is None and os.path.exists(os.path.join(args.model_dir, 'global_cmvn')):
+        cmvn_path = os.path.join(args.model_dir, 'global_cmvn')
+    output_path = args.output or os.path.join(args.model_dir, QUANTIZED_MODEL_FILENAME)
+    return quantize_model(args.checkpoint, train_config_path, output_path, cmvn_path=cmvn_path, verbose=True)
@@ -0,0 +1,456 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+"""
+Local decode server, which holds one loaded model and multiplexes many streaming sessions onto it over HTTP/1.1, using only the stdlib. Connections are kept alive for reuse across requests.
+
+Endpoints:
+    POST /decode    Decode an utterance streamed as the request body (chunked, or with Content-Length) of raw mono int16 little-endian PCM.
+                    Query parameters: sample_rate (default: the model's; otherwise resampled), partial=1 (respond with NDJSON lines of partial results as they change, ending with the final result), fields (comma-separated optional result fields), context (repeatable phrase to bias toward).
+                    Responds with the final result as JSON, including the utterance's stats.
+    GET /health     200 if accepting sessions, otherwise 503, with a JSON status.
+    GET /metrics    JSON of server, decoder pool, model, scheduler, and context cache stats.
+
+Admission control: at most max_sessions decode at once; more wait up to queue_timeout seconds for a slot (with at most max_queued waiting), and are otherwise rejected with 503 and Retry-After. New sessions are also rejected while the average decode lag exceeds max_lag_ms.
+Backpressure: while a session's decode lag (audio fed but not yet decoded) exceeds max_lag_ms, the server stops reading its request body, so TCP flow control slows down the client.
+"""
+
+import asyncio, json, sys, time, urllib.parse
+
+import numpy as np
+
+from . import _name, __version__
+from .wrapper import WenetSTTModel, result_fields_mask
+
+FRAME_SHIFT_MS = 10  # Of features, to convert queued frames into decode lag
+READ_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 64 * 1024
+
+_reasons = {100: 'Continue', 200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HttpError(Exception):
+
+    def __init__(self, status, message=None, headers=None):
+        super().__init__(message or _reasons.get(status, ''))
+        self.status = status
+        self.headers = headers or {}
+
+
+class Request(object):
+    """ A parsed HTTP request, whose body is read incrementally with body_chunks(). """
+
+    def __init__(self, method, target, version, headers, reader, writer):
+        url = urllib.parse.urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = urllib.parse.parse_qs(url.query)
+        self.version = version
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+        self.body_consumed = not ('content-length' in headers or 'chunked' in headers.get('transfer-encoding', '').lower())
+
+    @classmethod
+    async def read(cls, reader, writer):
+        """ Read the next request's head from the connection, or return None if it was closed cleanly. """
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise HttpError(400, "incomplete request head")
+        except asyncio.LimitOverrunError:
+            raise HttpError(431)
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise HttpError(400, "malformed request line")
+        headers = dict()
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        return cls(method.upper(), target, version, headers, reader, writer)
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def query_value(self, name, default=None):
+        values = self.query.get(name)
+        return values[-1] if values else default
+
+    async def body_chunks(self):
+        """ Asynchronously iterate over blocks of the request body as they arrive. """
+        if self.body_consumed:
+            return
+        if self.headers.get('expect', '').lower() == '100-continue':
+            self._writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await self._writer.drain()
+        if 'chunked' in self.headers.get('transfer-encoding', '').lower():
+            while True:
+                size_line = await self._reader.readline()
+                try:
+                    size = int(size_line.split(b';')[0].strip(), 16)
+                except ValueError:
+                    raise HttpError(400, "malformed chunk size")
+                if size == 0:
+                    while (await self._reader.readline()) not in (b'\r\n', b''):
+                        pass  # Skip any trailers
+                    break
+                async for data in self._read_exactly(size):
+                    yield data
+                await self._reader.readexactly(2)  # Chunk's trailing CRLF
+        else:
+            try:
+                remaining = int(self.headers['content-length'])
+            except ValueError:
+                raise HttpError(400, "malformed Content-Length")
+            async for data in self._read_exactly(remaining):
+                yield data
+        self.body_consumed = True
+
+    async def _read_exactly(self, size):
+        while size > 0:
+            data = await self._reader.read(min(size, READ_SIZE))
+            if not data:
+                raise ConnectionError("connection closed during request body")
+            size -= len(data)
+            yield data
+
+
+class Response(object):
+    """ Writes an HTTP response, either all at once with send(), or streamed with start() and write_chunk() (chunked transfer encoding) and end(). """
+
+    def __init__(self, writer, keep_alive=True):
+        self._writer = writer
+        self.keep_alive = keep_alive
+        self.started = False
+
+    def _head(self, status, headers):
+        headers = dict(headers)
+        headers.setdefault('Server', '%s/%s' % (_name, __version__))
+        headers['Connection'] = 'keep-alive' if self.keep_alive else 'close'
+        lines = ['HTTP/1.1 %d %s' % (status, _reasons.get(status, ''))] + ['%s: %s' % item for item in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = (json.dumps(body) + '\n').encode('utf-8')
+        headers = dict(headers or {}, **{'Content-Type': content_type, 'Content-Length': len(body)})
+        self.started = True
+        self._writer.write(self._head(status, headers) + body)
+        await self._writer.drain()
+
+    async def start(self, status, content_type='application/x-ndjson'):
+        self.started = True
+        self._writer.write(self._head(status, {'Content-Type': content_type, 'Transfer-Encoding': 'chunked'}))
+        await self._writer.drain()
+
+    async def write_chunk(self, data):
+        if not isinstance(data, bytes):
+            data = (json.dumps(data) + '\n').encode('utf-8')
+        if data:
+            self._writer.write(b'%x\r\n' % len(data) + data + b'\r\n')
+            await self._writer.drain()
+
+    async def end(self):
+        self._writer.write(b'0\r\n\r\n')
+        await self._writer.drain()
+
+
+class DecodeServer(object):
+    """ Serves decoding with one model over HTTP (see module docstring), with admission control and backpressure. """
+
+    def __init__(self, model, max_sessions=16, max_queued=None, queue_timeout=5.0, max_lag_ms=2000, prewarm=None):
+        if not isinstance(model, WenetSTTModel):
+            raise TypeError("model must be a WenetSTTModel")
+        self.model = model
+        self.max_sessions = max_sessions
+        self.max_queued = max_queued if max_queued is not None else max_sessions
+        self.queue_timeout = queue_timeout
+        self.max_lag_ms = max_lag_ms
+        self.pool = model.create_decoder_pool(size=min(max_sessions, 4) if prewarm is None else prewarm, max_size=max_sessions)
+        self._slots = None  # Created on the event loop by start()
+        self._session_lags = dict()  # Decode lag (ms) per active session
+        self._queued = 0
+        self._next_session_id = 0
+        self._started = time.time()
+        self._counters = dict(connections=0, connections_active=0, requests=0, sessions_admitted=0, sessions_rejected=0, sessions_completed=0, sessions_failed=0,
+            backpressure_pauses=0, backpressure_ms=0.0, audio_ms=0.0)
+
+    async def start(self, host='127.0.0.1', port=8086):
+        """ Start listening, returning the asyncio Server. """
+        self._slots = asyncio.Semaphore(self.max_sessions)
+        return await asyncio.start_server(self._handle_connection, host, port, limit=MAX_HEADER_SIZE)
+
+    def overloaded(self):
+        """ Whether new sessions should be rejected, because the average decode lag of active sessions exceeds max_lag_ms, or the admission queue is full. """
+        if self._queued >= self.max_queued and self._slots.locked():
+            return True
+        lags = list(self._session_lags.values())
+        return bool(lags) and (sum(lags) / len(lags)) > self.max_lag_ms
+
+    def get_stats(self):
+        """ Return a dict of the server's counters and current sessions, queue, and decode lag. """
+        lags = list(self._session_lags.values())
+        return dict(self._counters,
+            uptime_s=round(time.time() - self._started, 3),
+            sessions_active=len(self._session_lags),
+            sessions_queued=self._queued,
+            max_sessions=self.max_sessions,
+            lag_ms_mean=round(sum(lags) / len(lags), 3) if lags else 0.0,
+            lag_ms_max=max(lags) if lags else 0.0,
+            overloaded=self.overloaded(),
+        )
+
+    async def _handle_connection(self, reader, writer):
+        self._counters['connections'] += 1
+        self._counters['connections_active'] += 1
+        try:
+            while True:
+                response = Response(writer)
+                try:
+                    request = await Request.read(reader, writer)
+                    if request is None:
+                        break
+                    self._counters['requests'] += 1
+                    response.keep_alive = request.keep_alive
+                    await self._dispatch(request, response)
+                except HttpError as e:
+                    if response.started:
+                        raise
+                    response.keep_alive = False  # The request body may not have been consumed
+                    await response.send(e.status, dict(error=str(e)), headers=e.headers)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    print("%s: error handling request: %s: %s" % (_name, type(e).__name__, e), file=sys.stderr)
+                    if not response.started:
+                        response.keep_alive = False
+                        await response.send(500, dict(error='%s: %s' % (type(e).__name__, e)))
+                    break
+                if not (response.keep_alive and request.body_consumed):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # Client went away
+        except Exception as e:
+            print("%s: error handling connection: %s: %s" % (_name, type(e).__name__, e), file=sys.stderr)
+        finally:
+            self._counters['connections_active'] -= 1
+            writer.close()
+
+    async def _dispatch(self, request, response):
+        if request.path == '/decode':
+            if request.method != 'POST':
+                raise HttpError(405)
+            if request.body_consumed:
+                raise HttpError(411)
+            await self._handle_decode(request, response)
+        elif request.path == '/health':
+            overloaded = self.overloaded()
+            await response.send(503 if overloaded else 200, dict(status='overloaded' if overloaded else 'ok', sessions_active=len(self._session_lags),
+                sessions_queued=self._queued, max_sessions=self.max_sessions))
+        elif request.path == '/metrics':
+            loop = asyncio.get_running_loop()
+            model_metrics = await loop.run_in_executor(None, self.model.get_metrics)
+            await response.send(200, dict(server=self.get_stats(), pool=self.pool.get_stats(), model=model_metrics,
+                scheduler=self.model.get_scheduler_stats(), context_cache=self.model.get_context_stats()))
+        else:
+            raise HttpError(404)
+
+    async def _admit(self):
+        """ Wait for a session slot, or raise a 503 HttpError if overloaded or none frees up within queue_timeout. """
+        reject = HttpError(503, "server overloaded", headers={'Retry-After': max(1, int(self.queue_timeout))})
+        if self.overloaded():
+            self._counters['sessions_rejected'] += 1
+            raise reject
+        if not self._slots.locked():
+            await self._slots.acquire()  # Immediately, even if queue_timeout is 0
+        else:
+            self._queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._counters['sessions_rejected'] += 1
+                raise reject
+            finally:
+                self._queued -= 1
+        self._counters['sessions_admitted'] += 1
+
+    async def _handle_decode(self, request, response):
+        try:
+            sample_rate = int(request.query_value('sample_rate', self.model.sample_rate))
+            fields = [field for field in request.query_value('fields', '').split(',') if field]
+            result_fields_mask(fields)  # Validate
+            context = request.query.get('context')
+            partial = request.query_value('partial', '0') not in ('0', '')
+        except ValueError:
+            raise HttpError(400, "invalid query parameters")
+        await self._admit()
+        loop = asyncio.get_running_loop()
+        session_id = self._next_session_id
+        self._next_session_id += 1
+        self._session_lags[session_id] = 0.0
+        decoder = None
+        try:
+            decoder = await loop.run_in_executor(None, self.pool.acquire)
+            changed, partial_changed = asyncio.Event(), asyncio.Event()  # Separate events for separate waiters
+
+            def set_changed():
+                changed.set()
+                partial_changed.set()
+
+            def on_result_changed(final):
+                # Called from the native decode thread.
+                try:
+                    loop.call_soon_threadsafe(set_changed)
+                except RuntimeError:
+                    pass  # Event loop already closed
+            decoder.set_result_callback(on_result_changed)
+            try:
+                decoder.set_context(context)
+            except Exception:
+                raise HttpError(400, "invalid context")
+            resampler = None
+            if sample_rate != self.model.sample_rate:
+                from .audio import Resampler
+                resampler = Resampler(sample_rate, self.model.sample_rate)
+
+            partial_task = None
+            if partial:
+                await response.start(200)
+                partial_task = loop.create_task(self._send_partials(decoder, response, partial_changed))
+            try:
+                await self._feed(request, decoder, session_id, changed, resampler)
+                while not decoder.get_result()[1]:
+                    changed.clear()
+                    if not decoder.get_result()[1]:
+                        await changed.wait()
+            finally:
+                if partial_task is not None:
+                    partial_task.cancel()
+                    try:
+                        await partial_task
+                    except asyncio.CancelledError:
+                        pass
+
+            result = decoder.get_result_details(fields)
+            segments = decoder.get_segments()
+            if segments:
+                result['segments'] = segments  # In continuous mode, the result is only the last segment
+            result['stats'] = decoder.get_utterance_stats()
+            self._counters['audio_ms'] += result['stats'].get('audio_ms', 0)
+            self._counters['sessions_completed'] += 1
+            if partial:
+                await response.write_chunk(result)
+                await response.end()
+            else:
+                await response.send(200, result)
+        except BaseException:
+            self._counters['sessions_failed'] += 1
+            raise
+        finally:
+            del self._session_lags[session_id]
+            self._slots.release()
+            if decoder is not None:
+                loop.run_in_executor(None, self.pool.release, decoder)  # Resetting may wait for decoding to stop, so don't hold up the response
+
+    async def _feed(self, request, decoder, session_id, changed, resampler):
+        """ Feed the request body to the decoder as it arrives, pausing while the decoder lags too far behind, and then finalize. """
+        from .audio import float_to_int16
+        loop = asyncio.get_running_loop()
+        leftover = b''
+        async for data in request.body_chunks():
+            data = leftover + data
+            leftover = data[len(data) & ~1:]  # Odd trailing byte of a sample split across blocks
+            samples = np.frombuffer(data[:len(data) & ~1], '<i2')
+            if resampler is not None:
+                samples = float_to_int16(resampler.process(samples.astype(np.float32) / 32768))
+            if len(samples):
+                await loop.run_in_executor(None, decoder.decode, samples, False)
+            lag_ms = self._update_lag(decoder, session_id)
+            if lag_ms > self.max_lag_ms:
+                # Backpressure: stop reading this session's audio until decoding catches up.
+                self._counters['backpressure_pauses'] += 1
+                start = time.perf_counter()
+                while lag_ms > self.max_lag_ms:
+                    changed.clear()
+                    try:
+                        await asyncio.wait_for(changed.wait(), 0.05)
+                    except asyncio.TimeoutError:
+                        pass
+                    lag_ms = self._update_lag(decoder, session_id)
+                self._counters['backpressure_ms'] += (time.perf_counter() - start) * 1000
+        final_samples = np.zeros(0, np.int16)
+        if resampler is not None:
+            final_samples = float_to_int16(resampler.process(np.zeros(0, np.float32), final=True))
+        await loop.run_in_executor(None, decoder.decode, final_samples, True)
+
+    def _update_lag(self, decoder, session_id):
+        lag_ms = float(decoder.get_stats()['frames_queued'] * FRAME_SHIFT_MS)
+        self._session_lags[session_id] = lag_ms
+        return lag_ms
+
+    async def _send_partials(self, decoder, response, changed):
+        """ Stream each new partial result as an NDJSON line, until cancelled. """
+        last_text = None
+        while True:
+            text, final = decoder.get_result()
+            if final:
+                return
+            if text != last_text:
+                last_text = text
+                await response.write_chunk(dict(text=text, final=False))
+            await changed.wait()
+            changed.clear()
+
+
+def add_arguments(parser):
+    parser.add_argument('model_dir', help='Model directory to use')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: localhost only)')
+    parser.add_argument('--port', type=int, default=8086, help='Port to listen on')
+    parser.add_argument('--max-sessions', type=int, default=16, help='Maximum concurrent decoding sessions')
+    parser.add_argument('--max-queued', type=int, help='Maximum sessions waiting for a slot (default: --max-sessions)')
+    parser.add_argument('--queue-timeout', type=float, default=5.0, help='Seconds a session may wait for a slot before being rejected')
+    parser.add_argument('--max-lag-ms', type=float, default=2000, help='Decode lag beyond which sessions are throttled and new ones rejected')
+    parser.add_argument('--decoder-threads', type=int, help='Size of the shared decoder thread pool (default: --max-sessions / 4, at least 1)')
+    parser.add_argument('--num-threads', type=int, help='Number of intra-op threads each decode may use')
+    parser.add_argument('--inter-op-threads', type=int, help='Number of inter-op threads for the process')
+    parser.add_argument('--cpu-affinity', type=int, nargs='+', help='CPU ids the decoder threads may run on (Linux only), to isolate servers sharing a host')
+    parser.add_argument('--quantized', action='store_true', help='Use the int8-quantized variant of the model')
+    parser.add_argument('--continuous', action='store_true', help='Split long audio into segments at endpoints while decoding')
+
+def run(args):
+    config = dict(decoder_threads=args.decoder_threads or max(1, args.max_sessions // 4))
+    if args.num_threads:
+        config['num_threads'] = args.num_threads
+    if args.inter_op_threads:
+        config['inter_op_threads'] = args.inter_op_threads
+    if args.cpu_affinity:
+        config['cpu_affinity'] = args.cpu_affinity
+    if args.continuous:
+        config['continuous'] = True
+    model = WenetSTTModel(WenetSTTModel.build_config(args.model_dir, config=config, quantized=args.quantized))
+    server = DecodeServer(model, max_sessions=args.max_sessions, max_queued=args.max_queued, queue_timeout=args.queue_timeout, max_lag_ms=args.max_lag_ms)
+
+    async def main():
+        listener = await server.start(args.host, args.port)
+        address = listener.sockets[0].getsockname()
+        print("Listening on http://%s:%d" % (address[0], address[1]), file=sys.stderr, flush=True)
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
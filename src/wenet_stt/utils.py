@@ -4,46 +4,278 @@
 # Licensed under the AGPL-3.0; see LICENSE file.
 #
 
+import concurrent.futures, contextlib, hashlib, http.client, json, os, shutil, sys, tempfile, threading, time, zipfile
+from urllib.request import Request, urlopen
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt  # Windows
+
 from . import MODEL_DOWNLOADS
 
 DOWNLOAD_CHUNK_SIZE = 1 * 1024 * 1024
+DOWNLOAD_SEGMENTS = 4
+DOWNLOAD_MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_TIMEOUT = 60
+MANIFEST_FILENAME = '.wenet_stt_download.json'  # Written into each installed model directory
+
+def default_cache_dir():
+    """ Return the shared model cache directory: $WENET_STT_CACHE if set, otherwise wenet_stt under $XDG_CACHE_HOME (default ~/.cache). """
+    if os.environ.get('WENET_STT_CACHE'):
+        return os.environ['WENET_STT_CACHE']
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'wenet_stt')
+
+@contextlib.contextmanager
+def file_lock(path):
+    """ Hold an exclusive lock on the file at path (created if needed), serializing processes (and threads) that download or install the same model. """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after 10 seconds, so keep waiting
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class _Progress(object):
+    """ Thread-safe download progress, printed to file as dots and percentages if verbose. """
+
+    def __init__(self, total, done=0, verbose=False, file=None):
+        self.total = total
+        self.done = done
+        self.verbose = verbose
+        self.file = file or sys.stdout
+        self._lock = threading.Lock()
+        self._report_percentages = [percentage for percentage in range(10, 101, 10) if not total or done < percentage * total / 100]
+
+    def update(self, length):
+        with self._lock:
+            self.done += length
+            if self.verbose:
+                print('.', end='', flush=True, file=self.file)
+                while self.total and self._report_percentages and self.done >= self._report_percentages[0] * self.total / 100:
+                    print(' %d%% ' % self._report_percentages.pop(0), end='', flush=True, file=self.file)
+
+def _probe(url, timeout):
+    """ Return the size of the resource at url (or None if unknown), whether the server supports byte ranges for it, and its validator (ETag or Last-Modified, to detect changes between resumes). """
+    with urlopen(Request(url, headers={'Range': 'bytes=0-0'}), timeout=timeout) as response:
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        if response.status == 206:
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            return (int(total) if total.isdigit() else None), total.isdigit(), validator
+        length = response.headers.get('Content-Length')  # Don't trust response.length!
+        return (int(length) if length and length.isdigit() else None), False, validator
 
-def download_model(name, url=None, parent_dir='.', verbose=False):
-    import os, zipfile
-    from urllib.request import urlopen
+def _read_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
+def _write_state(state_path, state):
+    """ Atomically replace the saved download state, so a crash never leaves it half written. """
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(state_path + '.tmp', state_path)
+
+def _retrying(function, retries):
+    """ Call function until it succeeds, retrying up to retries times (with backoff) on network errors. It must resume from wherever the previous attempt got to. """
+    for attempt in range(retries + 1):
+        try:
+            return function()
+        except (OSError, http.client.HTTPException):
+            if attempt == retries:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+def _download_segment(url, part_path, segment, save_state, progress, timeout):
+    """ Download the byte range [segment[0], segment[1]) of url into the same range of part_path, starting from segment[2] and advancing it (and saving state) as each block is written. """
+    start, end = segment[2], segment[1]
+    if start >= end:
+        return
+    with urlopen(Request(url, headers={'Range': 'bytes=%d-%d' % (start, end - 1)}), timeout=timeout) as response, open(part_path, 'r+b') as f:
+        if response.status != 206:
+            raise IOError("server ignored byte range request for %s" % url)
+        f.seek(start)
+        while segment[2] < end:
+            data = response.read(min(DOWNLOAD_CHUNK_SIZE, end - segment[2]))
+            if not data:
+                raise ConnectionError("connection closed with %d bytes of segment remaining" % (end - segment[2]))
+            f.write(data)
+            f.flush()  # Before the state claims these bytes
+            segment[2] += len(data)
+            progress.update(len(data))
+            save_state()
+
+def _download_stream(url, part_path, progress, timeout):
+    """ Download all of url into part_path in a single request, for servers without byte range support. """
+    with urlopen(url, timeout=timeout) as response, open(part_path, 'wb') as f:
+        progress.done = 0
+        for data in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+            f.write(data)
+            progress.update(len(data))
+
+def file_sha256(path):
+    """ Return the sha256 hex digest of the file at path. """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+def download_file(url, path, sha256=None, segments=DOWNLOAD_SEGMENTS, min_segment_size=DOWNLOAD_MIN_SEGMENT_SIZE, retries=DOWNLOAD_RETRIES, timeout=DOWNLOAD_TIMEOUT, verbose=False, progress_file=None):
+    """
+    Download url to path, in up to segments parallel byte ranges (each at least min_segment_size) if the server supports them, otherwise in a single stream.
+    An interrupted ranged download (left as path + '.part', with its progress in path + '.part.json') is resumed rather than restarted, unless the remote file has changed.
+    The file only appears at path once complete, and verified against sha256 if given (raising ValueError on a mismatch). Returns its sha256 hex digest.
+    If verbose, progress is printed to progress_file (default stdout).
+    """
+    progress_file = progress_file or sys.stdout
+    part_path, state_path = path + '.part', path + '.part.json'
+    size, ranges, validator = _probe(url, timeout)
+    state = _read_state(state_path)
+    resumable = ranges and size is not None
+    if not (resumable and state and os.path.exists(part_path) and state.get('url') == url and state.get('size') == size and state.get('validator') == validator):
+        state = None
+        if resumable:
+            count = max(1, min(segments, size // max(1, min_segment_size)))
+            bounds = [size * i // count for i in range(count + 1)]
+            state = dict(url=url, size=size, validator=validator, segments=[[bounds[i], bounds[i+1], bounds[i]] for i in range(count)])
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+            _write_state(state_path, state)
+    elif verbose:
+        print("Resuming download...", end='', flush=True, file=progress_file)
+
+    if state is None:
+        progress = _Progress(size, verbose=verbose, file=progress_file)
+        _retrying(lambda: _download_stream(url, part_path, progress, timeout), retries)
+    else:
+        progress = _Progress(size, done=sum(position - start for start, end, position in state['segments']), verbose=verbose, file=progress_file)
+        state_lock = threading.Lock()
+        def save_state():
+            with state_lock:
+                _write_state(state_path, state)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(state['segments'])) as executor:
+            futures = [executor.submit(_retrying, lambda segment=segment: _download_segment(url, part_path, segment, save_state, progress, timeout), retries)
+                for segment in state['segments']]
+            for future in futures:
+                future.result()  # Completed segments are kept for a later resume, even if another failed
+    if verbose:
+        print(file=progress_file)
+
+    if size is not None and os.path.getsize(part_path) != size:
+        raise IOError("downloaded %d bytes of %s, but expected %d" % (os.path.getsize(part_path), url, size))
+    digest = file_sha256(part_path)
+    if sha256 is not None and digest != sha256.lower():
+        os.remove(part_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        raise ValueError("checksum mismatch for %s: expected sha256 %s, got %s" % (url, sha256.lower(), digest))
+    os.replace(part_path, path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return digest
+
+def install_archive(archive_path, target_dir, manifest=None):
+    """
+    Extract a model zip archive to target_dir atomically: into a temporary sibling directory first, which is only renamed to target_dir once complete, so a model directory is never seen half extracted.
+    An archive of a single top-level directory (as released models are) has that directory's contents installed. If manifest is given, it is written into target_dir as JSON.
+    """
+    parent_dir = os.path.dirname(os.path.abspath(target_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix='.%s.' % os.path.basename(target_dir), dir=parent_dir)
+    try:
+        with zipfile.ZipFile(archive_path, 'r') as zip_file:
+            zip_file.extractall(temp_dir)  # Checks each member's CRC
+        entries = os.listdir(temp_dir)
+        source_dir = os.path.join(temp_dir, entries[0]) if len(entries) == 1 and os.path.isdir(os.path.join(temp_dir, entries[0])) else temp_dir
+        if manifest is not None:
+            with open(os.path.join(source_dir, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+        os.rename(source_dir, target_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def read_manifest(model_dir):
+    """ Return the manifest (name, url, sha256) of a model installed by download_model() or fetch_model(), or None if it has none. """
+    return _read_state(os.path.join(model_dir, MANIFEST_FILENAME))
+
+def download_model(name, url=None, parent_dir='.', verbose=False, sha256=None, segments=DOWNLOAD_SEGMENTS):
+    """
+    Download the named model (or the zip archive at url) and install it as the directory parent_dir/name, verifying it against sha256 if given. Resumes a previously interrupted download.
+    Raises FileExistsError if the model directory already exists.
+    """
     if url is None:
         url = MODEL_DOWNLOADS[name]
-
+    target_dir = os.path.join(parent_dir, name)
+    if os.path.exists(target_dir):
+        raise FileExistsError(target_dir)
     filename = os.path.join(parent_dir, name + '.zip')
     if os.path.exists(filename):
         raise FileExistsError(filename)
-    if os.path.exists(name):
-        raise FileExistsError(name)
 
     if verbose:
         print("Downloading model '%s'..." % name)
-    with urlopen(url) as response:
-        with open(filename, 'wb') as f:
-            response_length = int(response.getheader('Content-Length'))  # Don't trust response.length!
-            bytes_read = 0
-            report_percentages = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
-            for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
-                f.write(chunk)
-                bytes_read += len(chunk)
-                if verbose:
-                    print('.', end='', flush=True)
-                    while report_percentages and bytes_read >= report_percentages[0] * response_length / 100:
-                        print(' %d%% ' % report_percentages.pop(0), end='', flush=True)
-
+    digest = download_file(url, filename, sha256=sha256, segments=segments, verbose=verbose)
     if verbose:
-        print("Done!")
+        print("Done! sha256: %s" % digest)
         print("Extracting...")
-    with zipfile.ZipFile(filename, 'r') as zip_file:
-        zip_file.extractall(parent_dir)
-    if verbose:
-        print("Done!")
-        print("Removing zip file...")
-    os.remove(filename)
+    try:
+        install_archive(filename, target_dir, manifest=dict(name=name, url=url, sha256=digest))
+    finally:
+        os.remove(filename)
     if verbose:
         print("Done!")
+    return target_dir
+
+def fetch_model(name, url=None, cache_dir=None, sha256=None, segments=DOWNLOAD_SEGMENTS, verbose=False):
+    """
+    Return the directory of the named model (or the zip archive at url) in the shared model cache (default: default_cache_dir()), downloading and installing it there first if needed.
+    Many processes may share the cache: one downloads (resuming any interrupted download), while the others wait for it and then reuse the result.
+    If sha256 is given, the download is verified against it, and an already cached model must have been installed with it (or ValueError is raised).
+    """
+    if url is None:
+        url = MODEL_DOWNLOADS[name]
+    cache_dir = cache_dir or default_cache_dir()
+    model_dir = os.path.join(cache_dir, 'models', name)
+    downloads_dir = os.path.join(cache_dir, 'downloads')
+
+    def installed():
+        manifest = read_manifest(model_dir)
+        if manifest is not None and sha256 is not None and manifest.get('sha256') != sha256.lower():
+            raise ValueError("cached model %s has sha256 %s, not %s" % (model_dir, manifest.get('sha256'), sha256.lower()))
+        return manifest is not None
+
+    if installed():
+        return model_dir
+    os.makedirs(downloads_dir, exist_ok=True)
+    with file_lock(os.path.join(downloads_dir, name + '.lock')):
+        if installed():
+            return model_dir  # Installed by another process while we waited
+        if verbose:
+            print("Downloading model '%s' to cache %s..." % (name, cache_dir), file=sys.stderr)
+        filename = os.path.join(downloads_dir, name + '.zip')
+        digest = download_file(url, filename, sha256=sha256, segments=segments, verbose=verbose, progress_file=sys.stderr)
+        try:
+            if os.path.exists(model_dir):
+                shutil.rmtree(model_dir)  # Left incomplete by some other means, since it has no manifest
+            install_archive(filename, model_dir, manifest=dict(name=name, url=url, sha256=digest))
+        finally:
+            os.remove(filename)
+    return model_dir
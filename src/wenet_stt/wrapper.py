@@ -4,7 +4,7 @@
 # Licensed under the AGPL-3.0; see LICENSE file.
 #
 
-import json, os, re, sys, time
+import json, os, re, sys, threading, time
 
 from cffi import FFI
 import numpy as np
@@ -28,11 +28,50 @@ def encode(text):
 def decode(binary):
     """ For C interop: decode binary utf-8 -> unicode text. """
     return binary.decode('utf-8')
+def as_wav_samples(wav_samples):
+    """
+    For C interop: view audio samples as a contiguous float32 or int16 ndarray, without copying if they already are one (or are a buffer of float32 or int16 samples, or of raw bytes of int16 PCM).
+    Buffers of any other sample type (e.g. array('d'), array('i')) are converted to float32.
+    """
+    if not isinstance(wav_samples, np.ndarray):
+        wav_samples = memoryview(wav_samples)
+        if wav_samples.format in ('B', 'b', 'c'):
+            wav_samples = np.frombuffer(wav_samples, np.int16)  # Raw bytes of int16 PCM
+        else:
+            wav_samples = np.asarray(wav_samples)  # Typed by the buffer's format
+    if wav_samples.dtype not in (np.float32, np.int16):
+        wav_samples = wav_samples.astype(np.float32)
+    return np.ascontiguousarray(wav_samples)
+
+MODEL_FILENAME = 'final.zip'
+QUANTIZED_MODEL_FILENAME = 'final_quant.zip'
+
+_result_field_flags = dict(nbest=1, scores=2, words=4)  # Matches ResultFields in the native library
+def result_fields_mask(fields):
+    """ For C interop: convert an iterable of optional result field names ('nbest', 'scores', 'words') into the native bitmask. """
+    mask = 0
+    for field in (fields or ()):
+        if field not in _result_field_flags:
+            raise ValueError("unknown result field: %r" % (field,))
+        mask |= _result_field_flags[field]
+    return mask
+
+def context_json(phrases, score=None):
+    """ For C interop: encode context phrases to bias decoding toward (None for the model's default) and optional score as JSON, or NULL. """
+    if phrases is None:
+        return _ffi.NULL
+    if isinstance(phrases, str):
+        raise TypeError("phrases must be an iterable of strings, not a string")
+    context = dict(phrases=list(phrases))
+    if score is not None:
+        context['score'] = score
+    return encode(json.dumps(context))
 
 class FFIObject(object):
 
     def __init__(self):
         self.init_ffi()
+        self._local = threading.local()  # Per-thread reusable buffers
 
     @classmethod
     def init_ffi(cls):
@@ -50,17 +89,64 @@ class FFIObject(object):
             if _platform == 'windows':
                 os.environ['PATH'] = os.pathsep.join(os.environ['PATH'].split(os.pathsep)[1:])
 
+    def _get_buffer(self, min_len=0):
+        """ For C interop: return this thread's reusable char buffer, regrown to at least min_len. """
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or len(buffer) < min_len:
+            buffer = self._local.buffer = _ffi.new('char[]', max(min_len, 4096))
+        return buffer
+
+    def _get_string(self, function, *args, trailing_args=()):
+        """ For C interop: call a native getter that fills a buffer with a string and reports the length needed (given args before the buffer, and trailing_args after), retrying with a larger buffer if it was too small. """
+        len_p = _ffi.new('int32_t *')
+        while True:
+            buffer = self._get_buffer(len_p[0])
+            if not function(*args, buffer, len(buffer), len_p, *trailing_args):
+                raise Exception("%s failed" % function.__name__)
+            if len_p[0] <= len(buffer):
+                return decode(_ffi.string(buffer))
+
+    def _get_json(self, function, *args):
+        """ For C interop: call a native getter that fills a buffer with JSON (see _get_string()), and parse it. """
+        return json.loads(self._get_string(function, *args))
+
+    def _take_json(self, json_p):
+        """ For C interop: parse JSON natively allocated into json_p[0], then free it. """
+        try:
+            return json.loads(decode(_ffi.string(json_p[0])))
+        finally:
+            self._lib.wenet_stt__free_string(json_p[0])
+
 class WenetSTTModel(FFIObject):
 
     _library_header_text = """
         WENET_STT_API void *wenet_stt__construct_model(const char *config_json_cstr);
         WENET_STT_API bool wenet_stt__destruct_model(void *model_vp);
-        WENET_STT_API bool wenet_stt__decode_utterance(void *model_vp, float *wav_samples, int32_t wav_samples_len, char *text, int32_t text_max_len);
+        WENET_STT_API bool wenet_stt__get_metrics(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+        WENET_STT_API bool wenet_stt__get_load_timings(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+        WENET_STT_API bool wenet_stt__decode_utterance(void *model_vp, const float *wav_samples, int32_t wav_samples_len, int32_t result_fields, const char *context_json, char **result_json_p, char **stats_json_p);
+        WENET_STT_API bool wenet_stt__decode_utterance_int16(void *model_vp, const int16_t *wav_samples, int32_t wav_samples_len, int32_t result_fields, const char *context_json, char **result_json_p, char **stats_json_p);
+        WENET_STT_API bool wenet_stt__decode_utterances(void *model_vp, const float **wav_samples_list, const int32_t *wav_samples_lens, int32_t num_utterances, int32_t max_batch_size, char **results_json_p);
+        WENET_STT_API bool wenet_stt__decode_utterances_int16(void *model_vp, const int16_t **wav_samples_list, const int32_t *wav_samples_lens, int32_t num_utterances, int32_t max_batch_size, char **results_json_p);
+        WENET_STT_API bool wenet_stt__get_context_stats(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+        WENET_STT_API bool wenet_stt__get_scheduler_stats(void *model_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+        WENET_STT_API void wenet_stt__free_string(char *str);
     """
 
     def __init__(self, config):
+        """
+        Load a model. Models constructed with the same resource configuration share a single loaded copy within the process, unless config['model_cache'] is False.
+        If config['lazy_load'] is True, loading is deferred until the model is first used.
+        If config['context_phrases'] is given, bias decoding toward those phrases by default (with config['context_score'] bonus per token); compiled contexts are cached, up to config['context_cache_size'] (default 64) phrase sets.
+        Each decode uses config['num_threads'] intra-op threads (set on the decoding thread, and left set there; but with MKL, libtorch also sets it process-wide, so differing values across models in one process override each other), and streaming decoding threads run only on the CPU ids in config['cpu_affinity'] if given (Linux only; offline decodes apply it to the calling thread for their duration). config['inter_op_threads'] is process-wide, so only the first model to set it takes effect.
+        If config['vad'] is True, an energy-based voice activity detector drops long silences before feature extraction (tuned by 'vad_threshold_db' and 'vad_padding_ms'); reported times still refer to the original audio.
+        """
         if not isinstance(config, dict):
             raise TypeError("config must be a dict")
+        config = config.copy()
+        for key in ('model_path', 'dict_path', 'fst_path', 'unit_path'):
+            if key in config:
+                config[key] = os.path.abspath(config[key])  # Canonical paths, so equivalent configs share the model cache
         assert 'model_path' in config
         if not os.path.exists(config['model_path']):
             raise FileNotFoundError("model_path does not exist")
@@ -73,6 +159,7 @@ class WenetSTTModel(FFIObject):
         if result == _ffi.NULL:
             raise Exception("wenet_stt__construct_model failed")
         self._model = result
+        self.sample_rate = config.get('sample_rate', 16000)  # Matches the native default
 
     def __del__(self):
         if hasattr(self, '_model'):
@@ -80,15 +167,40 @@ class WenetSTTModel(FFIObject):
             if not result:
                 raise Exception("wenet_stt__destruct_model failed")
 
+    def create_decoder_pool(self, size=1, max_size=None, warmup=True):
+        """ Return a DecoderPool of pre-warmed streaming decoders for this model (see DecoderPool). """
+        from .pool import DecoderPool
+        return DecoderPool(self, size=size, max_size=max_size, warmup=warmup)
+
+    def get_load_timings(self):
+        """ Return a dict of how long (in ms) each phase of loading the model took, and whether it was served from the process-wide cache, or None if not yet loaded. """
+        return self._get_json(self._lib.wenet_stt__get_load_timings, self._model)
+
+    def get_metrics(self):
+        """
+        Return a dict of aggregate counters (utterances, chunks, frames, and total ms of audio, feature extraction, decoding, rescoring, and queue waiting) over all decoding with this model, plus histograms.
+        Each histogram is a dict of bucket upper bounds (inclusive), counts per bucket (with a final overflow bucket), and the total count and sum.
+        """
+        return self._get_json(self._lib.wenet_stt__get_metrics, self._model)
+
+    def get_context_stats(self):
+        """ Return a dict of statistics for the cache of compiled context graphs: entries, capacity, hits, misses, hit rate, evictions, and compiles (count, and total/max ms). """
+        return self._get_json(self._lib.wenet_stt__get_context_stats, self._model)
+
+    def get_scheduler_stats(self):
+        """ Return a dict of statistics for the shared decoder thread pool (if config['decoder_threads'] > 0), or None. """
+        return self._get_json(self._lib.wenet_stt__get_scheduler_stats, self._model)
+
     @classmethod
-    def build_config(cls, model_dir=None, config=None):
+    def build_config(cls, model_dir=None, config=None, quantized=False):
+        """ Return a config for the model in model_dir, updated by config. If quantized, use its int8-quantized variant (see `python -m wenet_stt quantize`). """
         if config is None:
             config = dict()
         if not isinstance(config, dict):
             raise TypeError("config must be a dict or None")
         config = config.copy()
         if model_dir is not None:
-            config['model_path'] = os.path.join(model_dir, 'final.zip')
+            config['model_path'] = os.path.join(model_dir, QUANTIZED_MODEL_FILENAME if quantized else MODEL_FILENAME)
             config['dict_path'] = os.path.join(model_dir, 'words.txt')
         return config
 
@@ -101,30 +213,71 @@ class WenetSTTModel(FFIObject):
         download_model(name, parent_dir=parent_dir, verbose=verbose)
         return True
 
-    def decode(self, wav_samples, text_max_len=1024):
-        if not isinstance(wav_samples, np.ndarray): wav_samples = np.frombuffer(wav_samples, np.int16)
-        wav_samples = wav_samples.astype(np.float32)
-        wav_samples_char = _ffi.from_buffer(wav_samples)
-        wav_samples_float = _ffi.cast('float *', wav_samples_char)
-        text_p = _ffi.new('char[]', text_max_len)
+    def decode(self, wav_samples, text_max_len=None, with_stats=False, fields=None, context=None, context_score=None):
+        """
+        Decode a complete utterance, returning its text.
+        If context is given (a list of phrases, or [] for none), bias decoding toward it rather than the model's default (config['context_phrases']), with context_score (default config['context_score']) bonus per token.
+        If fields is given, instead return a result dict of text and final, plus a list of hypotheses (all n-best if 'nbest' is in fields, otherwise only the best) including their 'scores' and/or 'words' (each a dict of word, start_ms, end_ms) if in fields.
+        If with_stats, also return a dict of timings (in ms) and counts for the decode, as (text or result, stats).
+        text_max_len is ignored, since results are no longer limited in length.
+        """
+        wav_samples = as_wav_samples(wav_samples)
+        result_json_p = _ffi.new('char **')
+        stats_json_p = _ffi.new('char **') if with_stats else _ffi.NULL
 
-        result = self._lib.wenet_stt__decode_utterance(self._model, wav_samples_float, len(wav_samples), text_p, text_max_len)
+        if wav_samples.dtype == np.int16:
+            result = self._lib.wenet_stt__decode_utterance_int16(self._model, _ffi.from_buffer('int16_t[]', wav_samples), len(wav_samples), result_fields_mask(fields), context_json(context, context_score), result_json_p, stats_json_p)
+        else:
+            result = self._lib.wenet_stt__decode_utterance(self._model, _ffi.from_buffer('float[]', wav_samples), len(wav_samples), result_fields_mask(fields), context_json(context, context_score), result_json_p, stats_json_p)
         if not result:
             raise Exception("wenet_stt__decode_utterance failed")
+        result = self._take_json(result_json_p)
+        if fields is None:
+            result = result['text'].strip()
+        return (result, self._take_json(stats_json_p)) if with_stats else result
 
-        text = decode(_ffi.string(text_p))
-        if len(text) >= (text_max_len - 1):
-            raise Exception("text may be too long")
-        return text.strip()
+    def decode_batch(self, wav_samples_list, max_batch_size=16):
+        """ Decode a list of complete utterances, running the encoder over padded batches of them. Returns texts in input order. """
+        wav_samples_list = [as_wav_samples(wav_samples) for wav_samples in wav_samples_list]
+        if not wav_samples_list:
+            return []
+        int16 = all(wav_samples.dtype == np.int16 for wav_samples in wav_samples_list)
+        if not int16:
+            wav_samples_list = [wav_samples.astype(np.float32, copy=False) for wav_samples in wav_samples_list]
+        ctype = 'int16_t' if int16 else 'float'
+        wav_samples_buffers = [_ffi.from_buffer(ctype + '[]', wav_samples) for wav_samples in wav_samples_list]  # Must stay alive during the call
+        wav_samples_list_p = _ffi.new('const %s *[]' % ctype, wav_samples_buffers)
+        wav_samples_lens_p = _ffi.new('int32_t[]', [len(wav_samples) for wav_samples in wav_samples_list])
+        results_json_p = _ffi.new('char **')
+
+        decode_utterances = self._lib.wenet_stt__decode_utterances_int16 if int16 else self._lib.wenet_stt__decode_utterances
+        result = decode_utterances(self._model, wav_samples_list_p, wav_samples_lens_p, len(wav_samples_list), max_batch_size, results_json_p)
+        if not result:
+            raise Exception("wenet_stt__decode_utterances failed")
+
+        texts = self._take_json(results_json_p)
+        return [text.strip() for text in texts]
 
 class WenetSTTDecoder(FFIObject):
 
+    _wait_slice_ms = 1000
+
     _library_header_text = """
         WENET_STT_API void *wenet_stt__construct_decoder(void *model_vp);
         WENET_STT_API bool wenet_stt__destruct_decoder(void *decoder_vp);
-        WENET_STT_API bool wenet_stt__decode(void *decoder_vp, float *wav_samples, int32_t wav_samples_len, bool finalize);
-        WENET_STT_API bool wenet_stt__get_result(void *decoder_vp, char *text, int32_t text_max_len, bool *final_p);
-        WENET_STT_API bool wenet_stt__reset(void *decoder_vp);
+        WENET_STT_API bool wenet_stt__decode(void *decoder_vp, const float *wav_samples, int32_t wav_samples_len, bool finalize);
+        WENET_STT_API bool wenet_stt__decode_int16(void *decoder_vp, const int16_t *wav_samples, int32_t wav_samples_len, bool finalize);
+        WENET_STT_API bool wenet_stt__get_result(void *decoder_vp, char *text, int32_t text_max_len, int32_t *text_len_p, bool *final_p);
+        WENET_STT_API bool wenet_stt__wait_for_result(void *decoder_vp, bool wait_final, int64_t since_revision, int32_t timeout_ms, char *text, int32_t text_max_len, int32_t *text_len_p, bool *final_p, bool *timed_out_p, uint64_t *revision_p);
+        WENET_STT_API uint64_t wenet_stt__get_result_revision(void *decoder_vp);
+        WENET_STT_API bool wenet_stt__get_result_delta(void *decoder_vp, uint64_t since_revision, uint64_t *revision_p, bool *final_p, int32_t *prefix_len_p, char *suffix, int32_t suffix_max_len, int32_t *suffix_len_p);
+        WENET_STT_API bool wenet_stt__get_result_json(void *decoder_vp, int32_t result_fields, char *json, int32_t json_max_len, int32_t *json_len_p);
+        WENET_STT_API bool wenet_stt__set_result_callback(void *decoder_vp, void (*callback)(void *user_data, bool final), void *user_data);
+        WENET_STT_API bool wenet_stt__set_context(void *decoder_vp, const char *context_json);
+        WENET_STT_API bool wenet_stt__pop_segments(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+        WENET_STT_API bool wenet_stt__get_decoder_stats(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+        WENET_STT_API bool wenet_stt__get_utterance_stats(void *decoder_vp, char *json, int32_t json_max_len, int32_t *json_len_p);
+        WENET_STT_API bool wenet_stt__reset(void *decoder_vp, char **stats_json_p);
     """
 
     def __init__(self, model):
@@ -132,6 +285,8 @@ class WenetSTTDecoder(FFIObject):
             raise TypeError("model must be a WenetSTTModel")
 
         super().__init__()
+        self._result_callback = None
+        self._retired_result_callbacks = []  # Replaced from within themselves, so kept alive until reset() or destruction
         result = self._lib.wenet_stt__construct_decoder(model._model)
         if result == _ffi.NULL:
             raise Exception("wenet_stt__construct_decoder failed")
@@ -144,35 +299,144 @@ class WenetSTTDecoder(FFIObject):
                 raise Exception("wenet_stt__destruct_decoder failed")
 
     def decode(self, wav_samples, finalize):
-        if not isinstance(wav_samples, np.ndarray): wav_samples = np.frombuffer(wav_samples, np.int16)
-        wav_samples = wav_samples.astype(np.float32)
-        wav_samples_char = _ffi.from_buffer(wav_samples)
-        wav_samples_float = _ffi.cast('float *', wav_samples_char)
+        wav_samples = as_wav_samples(wav_samples)
         finalize = bool(finalize)
 
-        result = self._lib.wenet_stt__decode(self._decoder, wav_samples_float, len(wav_samples), finalize)
+        if wav_samples.dtype == np.int16:
+            result = self._lib.wenet_stt__decode_int16(self._decoder, _ffi.from_buffer('int16_t[]', wav_samples), len(wav_samples), finalize)
+        else:
+            result = self._lib.wenet_stt__decode(self._decoder, _ffi.from_buffer('float[]', wav_samples), len(wav_samples), finalize)
         if not result:
             raise Exception("wenet_stt__decode failed")
 
-    def get_result(self, final=None, text_max_len=1024):
-        text_p = _ffi.new('char[]', text_max_len)
-        result_final_p = _ffi.new('bool *')
+    def _wait(self, wait_final, timeout_ms, since_revision=-1):
+        """ Wait natively for the result to become final, or to differ from since_revision (see wenet_stt__wait_for_result), returning (text, final, timed_out, revision). """
+        buffer = self._get_buffer()
+        text_len_p = _ffi.new('int32_t *')
+        final_p = _ffi.new('bool *')
+        timed_out_p = _ffi.new('bool *')
+        revision_p = _ffi.new('uint64_t *')
+        result = self._lib.wenet_stt__wait_for_result(self._decoder, wait_final, since_revision, timeout_ms, buffer, len(buffer), text_len_p, final_p, timed_out_p, revision_p)
+        if not result:
+            raise Exception("wenet_stt__wait_for_result failed")
+        if text_len_p[0] > len(buffer):
+            # Too long for the buffer, so get the (possibly even newer) result again with a large enough one.
+            return self._get_text() + (bool(timed_out_p[0]), revision_p[0])
+        return decode(_ffi.string(buffer)).strip(), bool(final_p[0]), bool(timed_out_p[0]), revision_p[0]
+
+    def _get_text(self):
+        """ Return (text, final) for the current result, without waiting. """
+        final_p = _ffi.new('bool *')
+        text = self._get_string(self._lib.wenet_stt__get_result, self._decoder, trailing_args=(final_p,))
+        return text.strip(), bool(final_p[0])
 
+    def _wait_sliced(self, wait_final, timeout):
+        """ Block until the result is final (or changes, if not wait_final), or until timeout seconds elapse (if not None). Return (text, final, timed_out). """
+        # Wait natively, but in slices, so that KeyboardInterrupt is still handled. Each slice waits for a change from the same revision, so none are missed in between.
+        deadline = (time.monotonic() + timeout) if timeout is not None else None
+        revision = -1
         while True:
-            result = self._lib.wenet_stt__get_result(self._decoder, text_p, text_max_len, result_final_p)
-            if not result:
-                raise Exception("wenet_stt__get_result failed")
-            result_final = bool(result_final_p[0])
-            if not final or result_final:
-                break
-            time.sleep(0.01)
+            timeout_ms = self._wait_slice_ms if deadline is None else max(0, min(self._wait_slice_ms, int((deadline - time.monotonic()) * 1000)))
+            text, final, timed_out, revision = self._wait(wait_final, timeout_ms, revision)
+            if not timed_out or (deadline is not None and time.monotonic() >= deadline):
+                return text, final, timed_out
+
+    def _wait_final(self, timeout):
+        """ Block until the result is final, or until timeout seconds elapse (if not None). """
+        return self._wait_sliced(True, timeout)[:2]
+
+    def get_result(self, final=None, text_max_len=None, timeout=None, with_stats=False):
+        """
+        Return (text, final) for the current result. If final is true, first block until the result is final, or until timeout seconds elapse (in which case the non-final result is returned).
+        If with_stats, instead return (text, final, stats), where stats is a dict of timings (in ms) and counts for decoding the current utterance so far.
+        text_max_len is ignored, since results are no longer limited in length.
+        """
+        text, result_final = self._wait_final(timeout) if final else self._get_text()
+        if with_stats:
+            return text, result_final, self.get_utterance_stats()
+        return text, result_final
+
+    def get_result_delta(self, since_revision=0):
+        """
+        Return how the result changed since the given revision (0 being the initial empty result): None if unchanged (cheaply), otherwise (revision, prefix_len, suffix, final), where the current text is the first prefix_len characters of the text at since_revision followed by suffix.
+        Pass the returned revision to the next call. Only the most recent revisions are retained, so for older ones prefix_len is 0 and suffix is the entire text.
+        """
+        if self._lib.wenet_stt__get_result_revision(self._decoder) == since_revision:
+            return None  # Checked natively first, so polling an unchanged result allocates nothing
+        revision_p = _ffi.new('uint64_t *')
+        final_p = _ffi.new('bool *')
+        prefix_len_p = _ffi.new('int32_t *')
+        suffix = self._get_string(self._lib.wenet_stt__get_result_delta, self._decoder, since_revision, revision_p, final_p, prefix_len_p)
+        if revision_p[0] == since_revision:
+            return None
+        return revision_p[0], prefix_len_p[0], suffix, bool(final_p[0])
+
+    def get_result_details(self, fields=(), final=None, timeout=None):
+        """
+        Return a result dict of text and final for the current result, plus a list of hypotheses (all n-best if 'nbest' is in fields, otherwise only the best) including their 'scores' and/or 'words' (each a dict of word, start_ms, end_ms) if in fields.
+        If final is true, first block until the result is final, or until timeout seconds elapse.
+        """
+        if final:
+            self._wait_final(timeout)
+        return self._get_json(self._lib.wenet_stt__get_result_json, self._decoder, result_fields_mask(fields))
+
+    def wait_for_result(self, timeout=None, text_max_len=None):
+        """ Block until the result changes or becomes final, or until timeout seconds elapse. Return (text, final), or None if timed out. text_max_len is ignored. """
+        text, final, timed_out = self._wait_sliced(False, timeout)
+        if timed_out:
+            return None
+        return text, final
+
+    def set_result_callback(self, callback):
+        """ Set callback(final) to be called from the native decode thread whenever the result changes, or None to clear it. It should return quickly, and may call get_result(). """
+        previous_callback = self._result_callback
+        if callback is None:
+            c_callback = None
+            result = self._lib.wenet_stt__set_result_callback(self._decoder, _ffi.NULL, _ffi.NULL)
+        else:
+            local = self._local  # Not self, to avoid a reference cycle through the callback
+            def call(user_data, final):
+                local.in_result_callback = True
+                try:
+                    callback(bool(final))
+                finally:
+                    local.in_result_callback = False
+            c_callback = _ffi.callback('void(void *, bool)', call)
+            result = self._lib.wenet_stt__set_result_callback(self._decoder, c_callback, _ffi.NULL)
+        if not result:
+            raise Exception("wenet_stt__set_result_callback failed")
+        self._result_callback = c_callback  # Keep alive while native code may call it
+        # The native call returned only once no other call of the previous callback is in flight, so it can be freed, unless it is the one running now.
+        if previous_callback is not None and getattr(self._local, 'in_result_callback', False):
+            self._retired_result_callbacks.append(previous_callback)
+
+    def set_context(self, phrases, score=None):
+        """
+        Bias decoding toward the given list of phrases (or none, if []; or the model's default, if None), with score bonus per token (default config['context_score']).
+        Takes effect immediately if no audio has been decoded for the current utterance, otherwise from the next utterance (after reset()). Compiled contexts are cached by the model, so switching between phrase sets is cheap.
+        """
+        result = self._lib.wenet_stt__set_context(self._decoder, context_json(phrases, score))
+        if not result:
+            raise Exception("wenet_stt__set_context failed")
+
+    def get_segments(self):
+        """ In continuous mode (config['continuous']), return a list of dicts (text, start_ms, end_ms, words) of segments finalized at endpoints since last called. """
+        return self._get_json(self._lib.wenet_stt__pop_segments, self._decoder)
+
+    def get_stats(self):
+        """ Return a dict of statistics about this decoder's scheduling and decoding. """
+        return self._get_json(self._lib.wenet_stt__get_decoder_stats, self._decoder)
 
-        text = decode(_ffi.string(text_p))
-        if len(text) >= (text_max_len - 1):
-            raise Exception("text may be too long")
-        return text.strip(), result_final
+    def get_utterance_stats(self):
+        """ Return a dict of timings (in ms) and counts for decoding the current utterance so far. """
+        return self._get_json(self._lib.wenet_stt__get_utterance_stats, self._decoder)
 
     def reset(self):
-        result = self._lib.wenet_stt__reset(self._decoder)
+        """ Reset for decoding a new utterance, abandoning any current unfinalized utterance. Returns the stats dict for the previous utterance. """
+        stats_json_p = _ffi.new('char **')
+        result = self._lib.wenet_stt__reset(self._decoder, stats_json_p)
         if not result:
             raise Exception("wenet_stt__reset failed")
+        if not getattr(self._local, 'in_result_callback', False):
+            del self._retired_result_callbacks[:]
+        return self._take_json(stats_json_p)
@@ -0,0 +1,122 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+import os, wave
+
+import numpy as np
+import pytest
+
+from wenet_stt.audio import Resampler, audio_info, mix_channels, read_audio, read_audio_chunks, resample
+
+test_wav_path = os.path.join(os.path.dirname(__file__), 'test.wav')
+
+
+def sine(frequency, sample_rate, seconds=1.0, amplitude=0.5):
+    return (amplitude * np.sin(2 * np.pi * frequency * np.arange(int(sample_rate * seconds)) / sample_rate)).astype(np.float32)
+
+def write_wav(path, samples, sample_rate, sample_width=2):
+    """ Write float samples of shape [frames] or [frames, channels] as integer PCM. """
+    samples = samples.reshape(len(samples), -1)
+    with wave.open(str(path), 'wb') as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        if sample_width == 1:
+            data = np.rint(samples * 128 + 128).astype(np.uint8).tobytes()
+        elif sample_width == 3:
+            data = np.rint(samples * 2 ** 23).astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        else:
+            data = np.rint(samples * 2 ** (8 * sample_width - 1)).astype('<i%d' % sample_width).tobytes()
+        wav_file.writeframes(data)
+
+
+def test_read_wav_unchanged():
+    with wave.open(test_wav_path, 'rb') as wav_file:
+        expected = np.frombuffer(wav_file.readframes(wav_file.getnframes()), np.int16)
+    samples = read_audio(test_wav_path)
+    assert samples.dtype == np.int16
+    assert np.array_equal(samples, expected)
+
+def test_read_chunks_streamed():
+    chunks = list(read_audio_chunks(test_wav_path, chunk_ms=100))
+    assert len(chunks) > 10
+    assert all(len(chunk) <= 1600 for chunk in chunks)
+    assert np.array_equal(np.concatenate(chunks), read_audio(test_wav_path))
+
+@pytest.mark.parametrize('sample_width', [1, 2, 3, 4])
+def test_read_wav_sample_widths(tmp_path, sample_width):
+    path = tmp_path / 'test.wav'
+    write_wav(path, sine(440, 16000), 16000, sample_width=sample_width)
+    samples = read_audio(str(path))
+    tolerance = 300 if sample_width == 1 else 2
+    assert np.abs(samples.astype(np.float32) - sine(440, 16000) * 32768).max() <= tolerance
+
+def test_read_stereo(tmp_path):
+    path = tmp_path / 'stereo.wav'
+    left, right = sine(440, 16000), sine(1000, 16000, amplitude=0.25)
+    write_wav(path, np.stack([left, right], axis=1), 16000)
+    assert audio_info(str(path))['channels'] == 2
+    assert np.abs(read_audio(str(path), channel=0) / 32768 - left).max() < 1e-3
+    assert np.abs(read_audio(str(path), channel=1) / 32768 - right).max() < 1e-3
+    assert np.abs(read_audio(str(path)) / 32768 - (left + right) / 2).max() < 1e-3
+    with pytest.raises(ValueError):
+        read_audio(str(path), channel=2)
+
+def test_mix_channels():
+    samples = np.array([[1, 3], [2, 4]], np.float32)
+    assert np.array_equal(mix_channels(samples), [2, 3])
+    assert np.array_equal(mix_channels(samples, channel=1), [3, 4])
+    assert np.array_equal(mix_channels(samples[:, :1]), [1, 2])
+
+@pytest.mark.parametrize('from_rate', [8000, 11025, 22050, 44100, 48000])
+def test_resample(from_rate):
+    resampled = resample(sine(440, from_rate), from_rate, 16000)
+    assert len(resampled) == 16000
+    # Ignore the edges, where the filter window extends past the signal.
+    assert np.abs(resampled[200:-200] - sine(440, 16000)[200:-200]).max() < 1e-3
+
+def test_resample_chunked_matches_whole():
+    samples = np.random.RandomState(0).randn(44100).astype(np.float32)
+    resampler = Resampler(44100, 16000)
+    chunks = [resampler.process(samples[i:i+777]) for i in range(0, len(samples), 777)]
+    chunks.append(resampler.process(np.zeros(0, np.float32), final=True))
+    assert np.allclose(np.concatenate(chunks), resample(samples, 44100, 16000), atol=1e-6)
+
+def test_resample_antialiasing():
+    # A tone above the output Nyquist frequency must be filtered out, rather than aliased.
+    resampled = resample(sine(10000, 44100), 44100, 16000)
+    assert np.sqrt(np.mean(resampled[500:-500] ** 2)) < 0.01
+
+def test_read_resampled_wav(tmp_path):
+    path = tmp_path / 'test.wav'
+    write_wav(path, sine(440, 44100, seconds=2), 44100)
+    samples = read_audio(str(path))
+    assert len(samples) == 32000
+    assert np.abs(samples[200:-200] / 32768 - sine(440, 16000, seconds=2)[200:-200]).max() < 1e-3
+
+@pytest.mark.parametrize('dtype', ['<i2', '<f4', '|u1'])
+def test_read_raw(tmp_path, dtype):
+    path = tmp_path / 'test.raw'
+    samples = np.stack([sine(440, 8000), sine(440, 8000)], axis=1)
+    if dtype == '<i2':
+        data = np.rint(samples * 32768).astype(dtype)
+    elif dtype == '|u1':
+        data = np.rint(samples * 128 + 128).astype(dtype)
+    else:
+        data = samples.astype(dtype)
+    data.tofile(str(path))
+    with pytest.raises(ValueError):
+        read_audio(str(path))
+    read = read_audio(str(path), raw_sample_rate=8000, raw_channels=2, raw_dtype=dtype)
+    assert len(read) == 16000
+    tolerance = 0.02 if dtype == '|u1' else 1e-3
+    assert np.abs(read[200:-200] / 32768 - sine(440, 16000)[200:-200]).max() < tolerance
+
+def test_read_flac(tmp_path):
+    soundfile = pytest.importorskip('soundfile')
+    path = tmp_path / 'test.flac'
+    soundfile.write(str(path), sine(440, 16000), 16000, subtype='PCM_16')
+    assert np.abs(read_audio(str(path)) / 32768 - sine(440, 16000)).max() < 1e-3
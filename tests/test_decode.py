@@ -4,11 +4,13 @@
 # Licensed under the AGPL-3.0; see LICENSE file.
 #
 
-import os, subprocess, tempfile, wave
+import array, asyncio, gc, json, os, subprocess, tempfile, threading, time, wave
 
+import numpy as np
 import pytest
 
-from wenet_stt import WenetSTTModel, WenetSTTDecoder, MODEL_DOWNLOADS
+from wenet_stt import WenetSTTModel, WenetSTTDecoder, AsyncWenetSTTDecoder, DecoderPool, MODEL_DOWNLOADS
+from wenet_stt.wrapper import as_wav_samples
 
 test_model_path = os.path.join(os.path.dirname(__file__), 'model')
 test_missing_model_path = os.path.join(os.path.dirname(__file__), 'missing_model')
@@ -45,12 +47,177 @@ def test_init(model):
 def test_destruct(model):
     del model
 
+def test_load_timings(model_factory):
+    model = model_factory()
+    other_model = model_factory()
+    timings = other_model.get_load_timings()
+    assert timings['cache_hit'] == True
+    uncached_timings = model_factory(dict(model_cache=False)).get_load_timings()
+    assert uncached_timings['cache_hit'] == False
+    assert uncached_timings['total_ms'] >= uncached_timings['model_ms'] > 0
+
+def test_lazy_load(model_factory, wav_samples):
+    model = model_factory(dict(lazy_load=True, model_cache=False))
+    assert model.get_load_timings() is None
+    assert model.decode(wav_samples).lower() == 'it depends on the context'
+    assert model.get_load_timings()['cache_hit'] == False
+
+def test_decoder_outlives_model(model_factory, wav_samples):
+    model = model_factory()
+    decoder = WenetSTTDecoder(model)
+    del model
+    decoder.decode(wav_samples, True)
+    assert decoder.get_result(True)[0].lower() == 'it depends on the context'
+
 def test_decode(model, wav_samples):
     assert model.decode(wav_samples).lower() == 'it depends on the context'
 
+@pytest.mark.parametrize('convert', [
+    lambda data: data,
+    lambda data: bytearray(data),
+    lambda data: memoryview(data),
+    lambda data: np.frombuffer(data, np.int16),
+    lambda data: np.frombuffer(data, np.int16).astype(np.float32),
+    lambda data: memoryview(np.frombuffer(data, np.int16).astype(np.float32)),
+    lambda data: np.frombuffer(data, np.int16).astype(np.float64),
+    lambda data: array.array('d', np.frombuffer(data, np.int16).tolist()),
+    lambda data: array.array('i', np.frombuffer(data, np.int16).tolist()),
+])
+def test_decode_sample_types(model, wav_samples, convert):
+    assert model.decode(convert(wav_samples)).lower() == 'it depends on the context'
+
+@pytest.mark.parametrize('typecode', ['h', 'f', 'd', 'i', 'B'])
+def test_as_wav_samples(typecode):
+    values = [0, 1, -2, 300] if typecode != 'B' else [1, 0, 254, 255]
+    samples = as_wav_samples(array.array(typecode, values))
+    if typecode == 'B':  # Raw bytes of int16 PCM
+        assert samples.dtype == np.int16 and samples.tolist() == [1, -2]
+    else:
+        assert samples.dtype == (np.int16 if typecode == 'h' else np.float32)
+        assert samples.tolist() == values
+    assert as_wav_samples(memoryview(np.array(values, np.float64))).tolist() == values
+
 def test_decode_multithreaded(model_factory, wav_samples):
     assert model_factory(dict(num_threads=2)).decode(wav_samples).lower() == 'it depends on the context'
 
+@pytest.mark.parametrize('decoder_threads', [0, 2])
+def test_decode_thread_config(model_factory, wav_samples, decoder_threads):
+    model = model_factory(dict(num_threads=2, inter_op_threads=1, cpu_affinity=[0], decoder_threads=decoder_threads))
+    affinity = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None
+    assert model.decode(wav_samples).lower() == 'it depends on the context'
+    if affinity is not None:
+        assert os.sched_getaffinity(0) == affinity  # Restored for the calling thread
+    decoder = WenetSTTDecoder(model)
+    decoder.decode(wav_samples, True)
+    assert decoder.get_result(True)[0].lower() == 'it depends on the context'
+
+def test_missing_quantized_model():
+    with pytest.raises(FileNotFoundError):
+        WenetSTTModel(WenetSTTModel.build_config(test_model_path, quantized=True))
+
+def test_decode_with_stats(model_factory, wav_samples):
+    model = model_factory()
+    text, stats = model.decode(wav_samples, with_stats=True)
+    assert text.lower() == 'it depends on the context'
+    assert stats['final'] == True
+    assert stats['audio_ms'] == pytest.approx(len(wav_samples) / 2 / 16)
+    assert stats['frames'] > 0 and stats['chunks'] > 0
+    assert stats['feature_ms'] > 0 and stats['decode_ms'] > 0
+    assert len(stats['chunk_decode_ms']) == stats['chunks']
+    metrics = model.get_metrics()
+    assert metrics['utterances'] == 1
+    assert metrics['chunks'] == stats['chunks']
+    assert metrics['histograms']['utterance_rtf']['count'] == 1
+    assert sum(metrics['histograms']['chunk_decode_ms']['counts']) == stats['chunks']
+
+def test_decode_result_fields(model, wav_samples):
+    assert model.decode(wav_samples, fields=()) == dict(text=model.decode(wav_samples), final=True)
+    result = model.decode(wav_samples, fields=['nbest', 'scores', 'words'])
+    assert result['text'].lower() == 'it depends on the context'
+    hypotheses = result['hypotheses']
+    assert len(hypotheses) > 1
+    assert hypotheses[0]['text'] == result['text']
+    assert all('score' in hypothesis for hypothesis in hypotheses)
+    words = hypotheses[0]['words']
+    assert words and all(word['start_ms'] <= word['end_ms'] for word in words)
+    assert len(model.decode(wav_samples, fields=['words'])['hypotheses']) == 1
+    with pytest.raises(ValueError):
+        model.decode(wav_samples, fields=['bogus'])
+
+def test_decode_beam_size(model_factory, wav_samples):
+    fields = ['nbest']
+    assert len(model_factory().decode(wav_samples, fields=fields)['hypotheses']) > 1
+    result = model_factory(dict(first_beam_size=1, second_beam_size=1)).decode(wav_samples, fields=fields)
+    assert len(result['hypotheses']) == 1
+
+def test_decode_vad(model_factory, wav_samples):
+    silence = bytes(16000 * 2 * 3)
+    model = model_factory(dict(vad=True))
+    result, stats = model.decode(silence + wav_samples + silence, fields=['words'], with_stats=True)
+    assert result['text'].lower() == 'it depends on the context'
+    assert stats['vad_skipped_ms'] > 4000
+    reference = model_factory().decode(wav_samples, fields=['words'])
+    first_word, reference_first_word = result['hypotheses'][0]['words'][0], reference['hypotheses'][0]['words'][0]
+    assert abs(first_word['start_ms'] - (reference_first_word['start_ms'] + 3000)) < 300
+
+def test_decode_batch_vad(model_factory, wav_samples):
+    silence = bytes(16000 * 2 * 3)
+    model = model_factory(dict(vad=True, model_cache=False))
+    assert [text.lower() for text in model.decode_batch([silence + wav_samples + silence, wav_samples])] == ['it depends on the context'] * 2
+    assert model.get_metrics()['vad_skipped_ms'] > 4000
+
+def test_decode_context(model_factory, wav_samples):
+    model = model_factory(dict(context_cache_size=2))
+    assert model.decode(wav_samples, context=['depends', 'context']).lower() == 'it depends on the context'
+    assert model.decode(wav_samples, context=['context', 'depends', 'context']).lower() == 'it depends on the context'  # Same phrase set
+    stats = model.get_context_stats()
+    assert (stats['hits'], stats['misses'], stats['compiles'], stats['entries']) == (1, 1, 1, 1)
+    assert stats['compile_ms_total'] >= 0
+    model.decode(wav_samples, context=[])  # No biasing
+    model.decode(wav_samples, context=['other'])
+    model.decode(wav_samples, context=['another'])
+    stats = model.get_context_stats()
+    assert (stats['misses'], stats['entries'], stats['evictions']) == (3, 2, 1)
+    with pytest.raises(TypeError):
+        model.decode(wav_samples, context='context')
+
+def test_decode_streaming_context(model_factory, wav_samples):
+    model = model_factory(dict(context_phrases=['context']))
+    assert model.get_context_stats()['misses'] == 1  # Default context, compiled on load
+    decoder = WenetSTTDecoder(model)
+    for context in (['depends'], None, ['depends']):
+        decoder.set_context(context)
+        decoder.decode(wav_samples, True)
+        assert decoder.get_result(True)[0].lower() == 'it depends on the context'
+        decoder.reset()
+    stats = model.get_context_stats()
+    assert (stats['hits'], stats['misses']) == (1, 2)
+
+def test_decode_streaming_same_context(model_factory, wav_samples):
+    decoder = WenetSTTDecoder(model_factory(dict(context_phrases=['context'])))
+    decoder.set_context(['context'])  # Same as the default
+    assert decoder.get_stats()['context_rebuilds'] == 0
+    decoder.set_context(['depends'])
+    assert decoder.get_stats()['context_rebuilds'] == 1
+    for _ in range(2):
+        decoder.decode(wav_samples, True)
+        assert decoder.get_result(True)[0].lower() == 'it depends on the context'
+        decoder.set_context(['depends'])
+        decoder.reset()
+    assert decoder.get_stats()['context_rebuilds'] == 1
+
+def test_decode_batch(model, wav_samples):
+    texts = model.decode_batch([wav_samples] * 3, max_batch_size=2)
+    assert [text.lower() for text in texts] == ['it depends on the context'] * 3
+
+def test_decode_batch_mixed_lengths(model, wav_samples):
+    silence = bytes(len(wav_samples))
+    texts = model.decode_batch([wav_samples, silence + wav_samples, wav_samples])
+    assert [text.lower() for text in texts] == ['it depends on the context'] * 3
+
+def test_decode_batch_empty(model):
+    assert model.decode_batch([]) == []
+
 def test_decode_streaming(decoder_factory, wav_samples):
     chunks = [wav_samples[i:i+1024] for i in range(0, len(wav_samples), 1024)]
     assert len(chunks) > 2
@@ -69,6 +236,322 @@ def test_decode_streaming(decoder_factory, wav_samples):
     assert final == True
     assert text.lower() == 'it depends on the context'
 
+def test_decode_streaming_chunk_latency(decoder_factory, wav_samples):
+    decoder = decoder_factory()
+    decoder.decode(wav_samples, True)
+    decoder.get_result(True)
+    stats = decoder.get_stats()
+    assert len(stats['chunk_latency_ms']) == stats['chunks_decoded']
+    assert all(latency >= 0 for latency in stats['chunk_latency_ms'])
+    decoder.reset()
+    assert decoder.get_stats()['chunk_latency_ms'] == []
+
+@pytest.mark.parametrize('decoder_threads', [0, 2])
+def test_decode_streaming_stats(model_factory, wav_samples, decoder_threads):
+    model = model_factory(dict(decoder_threads=decoder_threads))
+    decoder = WenetSTTDecoder(model)
+    decoder.decode(wav_samples, True)
+    text, final, stats = decoder.get_result(True, with_stats=True)
+    assert final == True
+    assert stats['final'] == True
+    assert stats['frames'] > 0 and stats['feature_ms'] > 0 and stats['decode_ms'] > 0
+    assert model.get_metrics()['utterances'] == 1
+    assert decoder.reset() == stats
+    assert decoder.get_utterance_stats()['chunks'] == 0
+
+def test_decode_streaming_result_details(decoder_factory, wav_samples):
+    decoder = decoder_factory()
+    assert decoder.get_result_details() == dict(text='', final=False)
+    decoder.decode(wav_samples, True)
+    result = decoder.get_result_details(['nbest', 'scores', 'words'], final=True)
+    assert result['final'] == True
+    assert result['text'].lower() == 'it depends on the context'
+    assert result['hypotheses'][0]['text'] == result['text']
+    assert 'score' in result['hypotheses'][0] and result['hypotheses'][0]['words']
+    assert decoder.get_result() == (result['text'], True)
+
+def test_decode_streaming_result_delta(decoder_factory, wav_samples):
+    decoder = decoder_factory()
+    assert decoder.get_result_delta() is None
+    revision, text, final = 0, '', False
+    chunk_len = 16000 * 2 // 10
+    for i in range(0, len(wav_samples), chunk_len):
+        decoder.decode(wav_samples[i:i+chunk_len], i + chunk_len >= len(wav_samples))
+        delta = decoder.get_result_delta(revision)
+        if delta is not None:
+            assert delta[0] > revision
+            revision, prefix_len, suffix, final = delta
+            assert prefix_len <= len(text)
+            text = text[:prefix_len] + suffix
+            assert decoder.get_result_delta(revision) is None
+    while not final:
+        decoder.wait_for_result(timeout=1)
+        delta = decoder.get_result_delta(revision)
+        if delta is not None:
+            revision, prefix_len, suffix, final = delta
+            text = text[:prefix_len] + suffix
+    assert text == decoder.get_result()[0]
+    assert text.lower() == 'it depends on the context'
+    get_string, decoder._get_string = decoder._get_string, None
+    assert decoder.get_result_delta(revision) is None  # Final, so unchanged, which needs no buffers
+    decoder._get_string = get_string
+    revision, prefix_len, suffix, final = decoder.get_result_delta(0)
+    assert (prefix_len, suffix) == (0, text)
+
+def test_decode_streaming_shared_scheduler(model_factory, wav_samples):
+    model = model_factory(dict(decoder_threads=2))
+    decoders = [WenetSTTDecoder(model) for _ in range(6)]
+    chunks = [wav_samples[i:i+1024] for i in range(0, len(wav_samples), 1024)]
+    for i, chunk in enumerate(chunks):
+        for decoder in decoders:
+            decoder.decode(chunk, i == len(chunks) - 1)
+    for decoder in decoders:
+        text, final = decoder.get_result(True)
+        assert final == True
+        assert text.lower() == 'it depends on the context'
+        stats = decoder.get_stats()
+        assert stats['chunks_decoded'] > 0
+        assert stats['scheduled'] == False
+    scheduler_stats = model.get_scheduler_stats()
+    assert scheduler_stats['num_threads'] == 2
+    assert scheduler_stats['num_decoders'] == 6
+    assert scheduler_stats['queue_depth'] == 0
+
+def test_decode_streaming_coalesced_chunks(model_factory, wav_samples):
+    model = model_factory(dict(decoder_threads=1, max_coalesced_chunks=4))
+    decoder = WenetSTTDecoder(model)
+    decoder.decode(wav_samples, True)  # All at once, so the decoder starts out lagging by many chunks
+    text, final = decoder.get_result(True)
+    assert text.lower() == 'it depends on the context'
+    assert decoder.get_stats()['chunks_coalesced'] > 0
+
+def test_decode_streaming_coalesced_chunks_match(model_factory, wav_samples):
+    # Coalescing changes each chunk's attention context, so scores may differ, but the transcript should not.
+    results = {}
+    for max_coalesced_chunks in [1, 4]:
+        decoder = WenetSTTDecoder(model_factory(dict(decoder_threads=1, max_coalesced_chunks=max_coalesced_chunks)))
+        decoder.decode(wav_samples, True)
+        results[max_coalesced_chunks] = decoder.get_result_details(['words'], final=True)
+        assert (decoder.get_stats()['chunks_coalesced'] > 0) == (max_coalesced_chunks > 1)
+    assert results[4]['text'] == results[1]['text']
+    assert [word['word'] for word in results[4]['hypotheses'][0]['words']] == [word['word'] for word in results[1]['hypotheses'][0]['words']]
+
+@pytest.mark.parametrize('decoder_threads', [0, 2])
+def test_decode_streaming_reset(model_factory, wav_samples, decoder_threads):
+    decoder = WenetSTTDecoder(model_factory(dict(decoder_threads=decoder_threads)))
+    decoder.decode(wav_samples[:len(wav_samples) // 2], False)
+    decoder.reset()  # Abandon unfinalized utterance
+    for _ in range(2):
+        decoder.decode(wav_samples, True)
+        text, final = decoder.get_result(True)
+        assert text.lower() == 'it depends on the context'
+        decoder.reset()
+
+@pytest.mark.parametrize('decoder_threads', [0, 2])
+def test_decode_streaming_continuous(model_factory, wav_samples, decoder_threads):
+    model = model_factory(dict(continuous=True, decoder_threads=decoder_threads))
+    decoder = WenetSTTDecoder(model)
+    silence = bytes(16000 * 2 * 2)
+    for _ in range(3):
+        decoder.decode(wav_samples, False)
+        decoder.decode(silence, False)
+    decoder.decode(b'', True)
+    text, final = decoder.get_result(True)
+    assert final == True
+    segments = decoder.get_segments()
+    assert [segment['text'].lower() for segment in segments] == ['it depends on the context'] * 3
+    assert all(segment['start_ms'] < segment['end_ms'] for segment in segments)
+    assert [segment['start_ms'] for segment in segments] == sorted(segment['start_ms'] for segment in segments)
+    assert decoder.get_segments() == []
+
+def test_decode_streaming_vad(model_factory, wav_samples):
+    model = model_factory(dict(continuous=True, vad=True))
+    decoder = WenetSTTDecoder(model)
+    # The 3s silences are compressed, but enough is kept after speech for the 1s trailing silence endpoint rule to split the segments.
+    silence = bytes(16000 * 2 * 3)
+    for _ in range(2):
+        decoder.decode(silence, False)
+        decoder.decode(wav_samples, False)
+    decoder.decode(b'', True)
+    decoder.get_result(True)
+    segments = decoder.get_segments()
+    assert [segment['text'].lower() for segment in segments] == ['it depends on the context'] * 2
+    wav_ms = len(wav_samples) // 2 * 1000 // 16000
+    assert segments[1]['end_ms'] > 6000 + wav_ms
+    assert decoder.get_utterance_stats()['vad_skipped_ms'] > 4000
+
+def test_decode_continuous(model_factory, wav_samples):
+    silence = bytes(16000 * 2 * 2)
+    text = model_factory(dict(continuous=True)).decode((wav_samples + silence) * 2)
+    assert text.lower() == 'it depends on the context it depends on the context'
+
+def test_no_scheduler_stats(model):
+    assert model.get_scheduler_stats() is None
+
+def test_decode_streaming_get_result_timeout(decoder_factory, wav_samples):
+    decoder = decoder_factory()
+    decoder.decode(wav_samples, False)
+    text, final = decoder.get_result(True, timeout=0.05)
+    assert final == False
+    decoder.decode(b'', True)
+    text, final = decoder.get_result(True, timeout=60)
+    assert final == True
+    assert text.lower() == 'it depends on the context'
+    assert decoder.get_result(True, 1024) == (text, final)  # Positional text_max_len, as before timeout was added
+
+def test_decode_streaming_wait_for_result(decoder_factory, wav_samples):
+    decoder = decoder_factory()
+    assert decoder.wait_for_result(timeout=0.05) is None
+    decoder._wait_slice_ms = 10  # Waits span many slices, without missing changes in between
+    decoder.decode(wav_samples, True)
+    results = []
+    while not results or not results[-1][1]:
+        results.append(decoder.wait_for_result(timeout=60))
+    assert results[-1][0].lower() == 'it depends on the context'
+
+def test_decode_streaming_result_callback(decoder_factory, wav_samples):
+    decoder = decoder_factory()
+    finals = []
+    decoder.set_result_callback(lambda final: finals.append(final))
+    decoder.decode(wav_samples, True)
+    text, final = decoder.get_result(True)
+    assert text.lower() == 'it depends on the context'
+    assert finals and finals[-1] == True
+    decoder.set_result_callback(None)
+
+@pytest.mark.parametrize('decoder_threads', [0, 1])
+def test_decode_streaming_result_callback_churn(model_factory, wav_samples, decoder_threads):
+    # Setting or clearing the callback while the decode thread may be calling the previous one must not free it in use.
+    decoder = WenetSTTDecoder(model_factory(dict(decoder_threads=decoder_threads)))
+    calls = []
+    def clear_self(final):
+        calls.append(final)
+        decoder.set_result_callback(None)  # From within the callback itself
+    chunk_len = 16000 * 2 // 20
+    for utterance in range(3):
+        for i in range(0, len(wav_samples), chunk_len):
+            decoder.set_result_callback(clear_self if i % (chunk_len * 8) == 0 else (lambda final: calls.append(final)))
+            decoder.decode(wav_samples[i:i+chunk_len], i + chunk_len >= len(wav_samples))
+            decoder.set_result_callback(None)
+            gc.collect()
+        assert decoder.get_result(True)[0].lower() == 'it depends on the context'
+        decoder.reset()
+    assert calls
+
+def test_decode_streaming_silence_finalizes(decoder_factory):
+    decoder = decoder_factory()
+    decoder.decode(bytes(16000 * 2), True)
+    assert decoder.get_result(True, timeout=60) == ('', True)
+
+@pytest.mark.parametrize('decoder_threads', [0, 2])
+def test_decoder_pool(model_factory, wav_samples, decoder_threads):
+    model = model_factory(dict(decoder_threads=decoder_threads))
+    pool = model.create_decoder_pool(size=2)
+    assert pool.get_stats()['idle'] == 2
+    decoders = set()
+    for _ in range(3):
+        with pool.decoder() as decoder:
+            decoders.add(decoder)
+            decoder.decode(wav_samples, True)
+            assert decoder.get_result(True)[0].lower() == 'it depends on the context'
+    assert len(decoders) == 1  # Reused, rather than constructed anew
+    stats = pool.get_stats()
+    assert stats['size'] == 2 and stats['in_use'] == 0
+    assert stats['acquires'] == 3 and stats['hit_rate'] == 1.0
+    pool.close()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+def test_decoder_pool_waits(model_factory, wav_samples):
+    pool = DecoderPool(model_factory(), size=0, max_size=1, warmup=False)
+    decoder = pool.acquire()
+    assert pool.get_stats()['size'] == 1
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.1)
+    threading.Timer(0.1, pool.release, [decoder]).start()
+    assert pool.acquire(timeout=10) is decoder
+    stats = pool.get_stats()
+    assert stats['hits'] == 0 and stats['waits'] == 2
+    assert stats['wait_ms_max'] > 0
+
+def test_decoder_pool_outlives_model(model_factory, wav_samples):
+    pool = model_factory().create_decoder_pool(size=1)
+    decoder = pool.acquire()
+    pool.close()
+    decoder.decode(wav_samples, True)
+    assert decoder.get_result(True)[0].lower() == 'it depends on the context'
+    pool.release(decoder)
+    assert pool.get_stats()['size'] == 0
+
+def test_decode_streaming_async(model, wav_samples):
+    chunks = [wav_samples[i:i+1024] for i in range(0, len(wav_samples), 1024)]
+
+    async def audio():
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+
+    async def run():
+        decoder = AsyncWenetSTTDecoder(model)
+        results = [result async for result in decoder.stream(audio())]
+        decoder.close()
+        return results
+
+    results = asyncio.run(run())
+    assert all(not final for text, final in results[:-1])
+    assert results[-1][1] == True
+    assert results[-1][0].lower() == 'it depends on the context'
+
+def run_server_load(model, server_kwargs={}, **load_kwargs):
+    from wenet_stt.server import DecodeServer
+    from wenet_stt.loadgen import run_load
+
+    async def run():
+        server = DecodeServer(model, **server_kwargs)
+        listener = await server.start('127.0.0.1', 0)
+        async with listener:
+            return await run_load('127.0.0.1', listener.sockets[0].getsockname()[1], **load_kwargs)
+    return asyncio.run(run())
+
+def test_serve(model_factory, wav_samples):
+    model = model_factory(dict(decoder_threads=2))
+    report = run_server_load(model, dict(max_sessions=2), utterances=[np.frombuffer(wav_samples, np.int16)], concurrency=2, requests=4, speed=0, partial=True)
+    assert report['succeeded'] == 4
+    assert report['connections'] == 2  # Reused across requests
+    assert [text.lower() for text in report['texts']] == ['it depends on the context']
+    assert report['first_partial_latency_ms'] is not None
+    server_stats = report['server_metrics']['server']
+    assert server_stats['sessions_completed'] == 4 and server_stats['sessions_active'] == 0
+    assert report['server_metrics']['model']['utterances'] == 4
+
+def test_serve_admission_control(model_factory, wav_samples):
+    report = run_server_load(model_factory(), dict(max_sessions=1, queue_timeout=0), utterances=[np.frombuffer(wav_samples, np.int16)], concurrency=2, requests=2, speed=1)
+    assert (report['succeeded'], report['rejected']) == (1, 1)
+    assert report['server_metrics']['server']['sessions_rejected'] == 1
+
+
+def test_decode_files_repeated_paths(tmp_path):
+    from wenet_stt.corpus import decode_files
+    class SlowFirstModel:
+        """ Stand-in model whose first decode finishes last, so results complete out of order. """
+        sample_rate = 16000
+        def __init__(self):
+            self.calls = 0
+            self.lock = threading.Lock()
+        def decode(self, wav_samples):
+            with self.lock:
+                self.calls += 1
+                call = self.calls
+            if call == 1:
+                time.sleep(0.2)
+            return 'call %d' % call
+    paths = [test_wav_path, str(tmp_path / 'missing.wav'), test_wav_path, test_wav_path]
+    results = list(decode_files(SlowFirstModel(), paths, jobs=3))
+    assert sorted(index for index, record in results) == [0, 1, 2, 3]
+    assert results[-1][1]['text'] == 'call 1'  # Whichever file was decoded first completed last
+    for index, record in results:
+        assert record['path'] == paths[index]
+        assert ('error' in record) == (index == 1)
 
 class TestCLI:
 
@@ -79,6 +562,58 @@ class TestCLI:
     def test_decode_multiple(self):
         process = subprocess.run(f'python3 -m wenet_stt decode {test_model_path} {test_wav_path} {test_wav_path}', shell=True, check=True, capture_output=True)
         assert process.stdout.decode().strip().lower().splitlines() == ['it depends on the context'] * 2
+        process = subprocess.run(f'python3 -m wenet_stt decode {test_model_path} {test_wav_path} {test_wav_path} {test_wav_path} --jobs 2', shell=True, check=True, capture_output=True)
+        assert process.stdout.decode().strip().lower().splitlines() == ['it depends on the context'] * 3
+
+    def test_decode_parallel_jsonl(self, tmp_path):
+        output_path = tmp_path / 'results.jsonl'
+        subprocess.run(f'python3 -m wenet_stt decode {test_model_path} {test_wav_path} {test_wav_path} {test_wav_path} --jobs 2 --output {output_path}', shell=True, check=True, capture_output=True)
+        records = [json.loads(line) for line in output_path.read_text().splitlines()]
+        assert len(records) == 3
+        for record in records:
+            assert record['path'] == test_wav_path
+            assert record['text'].lower() == 'it depends on the context'
+            assert record['decode_time'] > 0
+
+    def test_decode_resume(self, tmp_path):
+        output_path = tmp_path / 'results.jsonl'
+        output_path.write_text(json.dumps(dict(path=test_wav_path, text='previous')) + '\n')
+        process = subprocess.run(f'python3 -m wenet_stt decode {test_model_path} {test_wav_path} --resume --output {output_path}', shell=True, check=True, capture_output=True)
+        assert [json.loads(line)['text'] for line in output_path.read_text().splitlines()] == ['previous']
+
+    def test_decode_resampled_stereo(self, tmp_path, wav_samples):
+        from wenet_stt.audio import resample
+        samples = resample(np.frombuffer(wav_samples, np.int16).astype(np.float32), 16000, 44100)
+        wav_path = tmp_path / 'stereo.wav'
+        with wave.open(str(wav_path), 'wb') as wav_file:
+            wav_file.setnchannels(2)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(44100)
+            wav_file.writeframes(np.stack([samples, np.zeros_like(samples)], axis=1).astype(np.int16).tobytes())
+        process = subprocess.run(f'python3 -m wenet_stt decode {test_model_path} {wav_path} --channel 0', shell=True, check=True, capture_output=True)
+        assert process.stdout.decode().strip().lower() == 'it depends on the context'
+        process = subprocess.run(f'python3 -m wenet_stt decode {test_model_path} {wav_path} --channel all', shell=True, check=True, capture_output=True)
+        assert process.stdout.decode().strip('\n').lower().split('\t') == ['it depends on the context', '']
+
+    def test_benchmark(self, tmp_path):
+        output_path = tmp_path / 'report.json'
+        subprocess.run(f'python3 -m wenet_stt benchmark {test_model_path} {test_wav_path} --concurrency 1 2 --output {output_path}', shell=True, check=True, capture_output=True)
+        report = json.loads(output_path.read_text())
+        assert [(result['mode'], result['concurrency']) for result in report['results']] == [(mode, concurrency) for mode in ('offline', 'streaming', 'cli') for concurrency in (1, 2)]
+        for result in report['results']:
+            assert result['rtf'] > 0
+        assert report['results'][2]['chunk_latency_ms']['p50'] > 0
+
+    def test_benchmark_accuracy(self, tmp_path):
+        references_path = tmp_path / 'text'
+        references_path.write_text('test it depends on the context\n')
+        output_path = tmp_path / 'report.json'
+        subprocess.run(f'python3 -m wenet_stt benchmark {test_model_path} {test_wav_path} --modes offline streaming --references {references_path} --output {output_path}', shell=True, check=True, capture_output=True)
+        report = json.loads(output_path.read_text())
+        assert report['references'] == 1
+        for result in report['results']:
+            assert result['variant'] == 'float'
+            assert result['accuracy'] == dict(wer=0.0, errors=0, words=5)
 
     def test_download_list(self):
         process = subprocess.run(f'python3 -m wenet_stt download', shell=True, check=True, capture_output=True)
@@ -0,0 +1,185 @@
+#
+# This file is part of wenet_stt_python.
+# (c) Copyright 2021 by David Zurow
+# Licensed under the AGPL-3.0; see LICENSE file.
+#
+
+import hashlib, http.server, io, os, threading, zipfile
+
+import pytest
+
+from wenet_stt.utils import default_cache_dir, download_file, download_model, fetch_model, read_manifest
+
+
+class FileServer(object):
+    """ Local HTTP stand-in for a model host, serving in-memory files with optional byte range support, and injectable failures. """
+
+    def __init__(self, files, ranges=True, content_length=True):
+        self.files = files
+        self.ranges = ranges
+        self.content_length = content_length
+        self.fail_after = None  # Close each response after sending this many bytes
+        self.requests = []
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = server.files.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                range_header = self.headers.get('Range')
+                with server._lock:
+                    server.requests.append(range_header)
+                start, end = 0, len(data)
+                if server.ranges and range_header:
+                    first, _, last = range_header.partition('=')[2].partition('-')
+                    start, end = int(first), min(int(last) + 1, len(data))
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, len(data)))
+                else:
+                    self.send_response(200)
+                if server.ranges:
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('ETag', '"%s"' % hashlib.sha256(data).hexdigest()[:16])
+                if server.content_length:
+                    self.send_header('Content-Length', str(end - start))
+                else:
+                    self.close_connection = True
+                self.end_headers()
+                body = data[start:end]
+                if server.fail_after is not None:
+                    body = body[:server.fail_after]
+                self.wfile.write(body)
+                with server._lock:
+                    server.bytes_sent += len(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self._server.server_address[1], path)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def make_model_zip(name):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_file:
+        zip_file.writestr(name + '/words.txt', '<blank> 0\nhello 1\n')
+        zip_file.writestr(name + '/final.zip', os.urandom(100000))
+    return buffer.getvalue()
+
+@pytest.fixture
+def data():
+    return os.urandom(1000000)
+
+@pytest.fixture
+def server_factory():
+    servers = []
+    def factory(files, **kwargs):
+        servers.append(FileServer(files, **kwargs))
+        return servers[-1]
+    yield factory
+    for server in servers:
+        server.close()
+
+
+def test_download_segments(tmp_path, data, server_factory):
+    server = server_factory({'/file': data})
+    path = str(tmp_path / 'file')
+    digest = download_file(server.url('/file'), path, segments=4, min_segment_size=1000)
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert open(path, 'rb').read() == data
+    assert len([request for request in server.requests if request != 'bytes=0-0']) == 4
+    assert sorted(os.listdir(tmp_path)) == ['file']
+
+@pytest.mark.parametrize('ranges, content_length', [(False, True), (False, False)])
+def test_download_without_ranges(tmp_path, data, server_factory, ranges, content_length):
+    server = server_factory({'/file': data}, ranges=ranges, content_length=content_length)
+    path = str(tmp_path / 'file')
+    download_file(server.url('/file'), path, segments=4, min_segment_size=1000)
+    assert open(path, 'rb').read() == data
+
+def test_download_resume(tmp_path, data, server_factory):
+    server = server_factory({'/file': data})
+    path = str(tmp_path / 'file')
+    server.fail_after = 100000
+    with pytest.raises(Exception):
+        download_file(server.url('/file'), path, segments=2, min_segment_size=1000, retries=0)
+    assert not os.path.exists(path)
+    assert os.path.exists(path + '.part') and os.path.exists(path + '.part.json')
+    server.fail_after = None
+    server.bytes_sent = 0
+    download_file(server.url('/file'), path, segments=2, min_segment_size=1000)
+    assert open(path, 'rb').read() == data
+    assert server.bytes_sent == 1 + len(data) - 2 * 100000  # The probe, then only what each segment had left
+    assert sorted(os.listdir(tmp_path)) == ['file']
+
+def test_download_retries(tmp_path, data, server_factory):
+    server = server_factory({'/file': data})
+    server.fail_after = 300000  # Every response fails partway, but each retry resumes further along
+    path = str(tmp_path / 'file')
+    download_file(server.url('/file'), path, segments=1, min_segment_size=1000, retries=5)
+    assert open(path, 'rb').read() == data
+
+def test_download_checksum_mismatch(tmp_path, data, server_factory):
+    server = server_factory({'/file': data})
+    path = str(tmp_path / 'file')
+    with pytest.raises(ValueError):
+        download_file(server.url('/file'), path, sha256='0' * 64)
+    assert os.listdir(tmp_path) == []
+    download_file(server.url('/file'), path, sha256=hashlib.sha256(data).hexdigest().upper())
+    assert open(path, 'rb').read() == data
+
+def test_download_model(tmp_path, server_factory):
+    archive = make_model_zip('test_model')
+    server = server_factory({'/test_model.zip': archive})
+    model_dir = download_model('test_model', url=server.url('/test_model.zip'), parent_dir=str(tmp_path))
+    assert model_dir == os.path.join(str(tmp_path), 'test_model')
+    assert sorted(os.listdir(model_dir)) == ['.wenet_stt_download.json', 'final.zip', 'words.txt']
+    assert read_manifest(model_dir)['sha256'] == hashlib.sha256(archive).hexdigest()
+    assert os.listdir(str(tmp_path)) == ['test_model']
+    with pytest.raises(FileExistsError):
+        download_model('test_model', url=server.url('/test_model.zip'), parent_dir=str(tmp_path))
+
+def test_download_model_bad_archive(tmp_path, server_factory):
+    server = server_factory({'/test_model.zip': b'not a zip file'})
+    with pytest.raises(zipfile.BadZipFile):
+        download_model('test_model', url=server.url('/test_model.zip'), parent_dir=str(tmp_path))
+    assert os.listdir(str(tmp_path)) == []  # Nothing left half installed
+
+def test_default_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv('WENET_STT_CACHE', str(tmp_path))
+    assert default_cache_dir() == str(tmp_path)
+    monkeypatch.delenv('WENET_STT_CACHE')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    assert default_cache_dir() == os.path.join(str(tmp_path), 'wenet_stt')
+
+def test_fetch_model_cached(monkeypatch, tmp_path, server_factory):
+    monkeypatch.setenv('WENET_STT_CACHE', str(tmp_path))
+    archive = make_model_zip('test_model')
+    server = server_factory({'/test_model.zip': archive})
+    sha256 = hashlib.sha256(archive).hexdigest()
+    # Concurrent fetches (as from many workers sharing the cache) download only once.
+    model_dirs = []
+    threads = [threading.Thread(target=lambda: model_dirs.append(fetch_model('test_model', url=server.url('/test_model.zip'), sha256=sha256))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert model_dirs == [os.path.join(str(tmp_path), 'models', 'test_model')] * 4
+    assert os.path.isfile(os.path.join(model_dirs[0], 'words.txt'))
+    requests = len(server.requests)
+    assert requests == 2  # Probe and one segment
+    assert fetch_model('test_model', url=server.url('/test_model.zip')) == model_dirs[0]
+    assert len(server.requests) == requests
+    with pytest.raises(ValueError):
+        fetch_model('test_model', url=server.url('/test_model.zip'), sha256='0' * 64)